@@ -1,6 +1,7 @@
 import os
 from celery import Celery
 from celery.schedules import crontab
+from datetime import timedelta
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'e_commerce.settings')
 
@@ -18,6 +19,26 @@ app.conf.beat_schedule = {
     'cart_abundance_mail': {
         'task': 'shop.celery.tasks.send_cart_abundance_mail',
         'schedule': crontab(),
+    },
+    'release_expired_stock_reservations': {
+        'task': 'shop.celery.tasks.release_expired_stock_reservations',
+        'schedule': crontab(),
+    },
+    'drain_order_mails': {
+        'task': 'shop.celery.tasks.drain_order_mails',
+        'schedule': timedelta(seconds=15),
+    },
+    'reconcile_payments': {
+        'task': 'shop.celery.tasks.reconcile_payments',
+        'schedule': crontab(minute='*/10'),
+    },
+    'snapshot_search_index': {
+        'task': 'shop.celery.tasks.snapshot_search_index',
+        'schedule': crontab(minute=0),
+    },
+    'compute_product_rankings': {
+        'task': 'shop.celery.tasks.compute_product_rankings',
+        'schedule': crontab(minute='*/15'),
     }
 }
 
@@ -102,6 +102,27 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# shared redis cache across the gunicorn workers, local memory cache for development
+
+if os.getenv('CACHE_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('CACHE_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# redis for the shopping carts and the mail queue
+REDIS_URL = os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/1')
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -148,6 +169,13 @@ STATICFILES_DIRS = [
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
+# image uploads are named by their content hash (utils.storage) - served with far-future headers
+# by utils.storage.serve_media, or from S3 with the same Cache-Control
+DEFAULT_FILE_STORAGE = 'utils.storage.ContentAddressedFileSystemStorage'
+
+# product search index snapshot, written by the snapshot_search_index task and loaded by every process
+SEARCH_INDEX_PATH = os.getenv('SEARCH_INDEX_PATH') or os.path.join(BASE_DIR, 'search_index.snapshot')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -220,7 +248,7 @@ if not bool(os.getenv('DEBUG')):
     AWS_S3_FILE_OVERWRITE = False
     AWS_DEFAULT_ACL = None
     AWS_S3_VERITY = True
-    DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+    DEFAULT_FILE_STORAGE = 'utils.storage.ContentAddressedS3Storage'
 
 # email settings
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -3,6 +3,13 @@ import multiprocessing
 # using the below calculation for better cpu usage
 workers = multiprocessing.cpu_count() * 2 + 1
 
+# threaded workers - a request waiting on the payment gateway does not hold the whole worker
+worker_class = 'gthread'
+threads = 4
+
+# reuse the client connections between requests
+keepalive = 5
+
 bind = '0.0.0.0:8000'
 
 wsgi_app = 'e_commerce.wsgi:application'
@@ -1,7 +1,14 @@
-from django.contrib import admin
+import uuid
+from django.contrib import admin, messages
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.shortcuts import redirect, render
+from django.utils import timezone
+from django.urls import path
 from .models import Category
 from .models import SubCategory
 from .models import Product
+from .models import Order
 from shop.models import User
 
 
@@ -11,6 +18,15 @@ from django.contrib.auth.models import Group
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.forms import ReadOnlyPasswordHashField
 from django.core.exceptions import ValidationError
+from datetime import timedelta
+
+from shop.services.catalog_io import catalog_export_rows
+from shop.services.order_export import order_export_rows
+from shop.services.reports import sales_report
+
+# constant helper
+from utils.constants import *
+from utils.export import streaming_export_response
 
 
 # custom user model registered in admin
@@ -97,8 +113,125 @@ class SubCategoryAdmin(admin.ModelAdmin):
     list_display = ('name', 'image', 'description')
 
 
+class CatalogImportForm(forms.Form):
+    file = forms.FileField(help_text="csv or xlsx - sku, name, category, subcategory, description, quantity, "
+                                     "original_price, selling_price, status, is_exclusive")
+    create_missing = forms.BooleanField(required=False, label="Create unknown categories and subcategories")
+
+    def clean_file(self):
+        file = self.cleaned_data['file']
+        if not file.name.lower().endswith(('.csv', '.xlsx')):
+            raise ValidationError("Only csv and xlsx files")
+        return file
+
+
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'product_image', 'category_id')
+    list_display = ('name', 'sku', 'product_image', 'category_id')
+    search_fields = ('sku', 'name')
+    change_list_template = 'admin/shop/product/change_list.html'
+    actions = ['export_csv', 'export_xlsx']
+
+    def get_urls(self):
+        return [
+            path('import/', self.admin_site.admin_view(self.import_catalog), name='shop_product_import'),
+        ] + super().get_urls()
+
+    def import_catalog(self, request):
+        """
+        Upload a catalog file, the import runs in a celery task
+        """
+        form = CatalogImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            from shop.celery.tasks import import_catalog_file
+
+            # a name of its own for every upload - the task deletes the file once it is imported
+            name = default_storage.save(
+                f"{CATALOG_IMPORT_DIR}/{uuid.uuid4().hex}-{form.cleaned_data['file'].name}", form.cleaned_data['file']
+            )
+            import_catalog_file.delay(name, form.cleaned_data['create_missing'])
+            messages.success(request, "Catalog import started, the report shows up here once it is done")
+            return redirect('admin:shop_product_import')
+
+        return render(request, 'admin/shop/product/import_catalog.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Import catalog',
+            'form': form,
+            'report': cache.get(CATALOG_IMPORT_REPORT_CACHE_KEY),
+        })
+
+    @admin.action(description="Export selected products as csv")
+    def export_csv(self, request, queryset):
+        return streaming_export_response(catalog_export_rows(queryset), 'csv', 'catalog')
+
+    @admin.action(description="Export selected products as xlsx")
+    def export_xlsx(self, request, queryset):
+        return streaming_export_response(catalog_export_rows(queryset), 'xlsx', 'catalog')
+
+
+class SalesReportForm(forms.Form):
+    start = forms.DateField(widget=forms.DateInput(attrs={'type': 'date'}))
+    end = forms.DateField(widget=forms.DateInput(attrs={'type': 'date'}))
+    refresh = forms.BooleanField(required=False, label="Read the cached days again")
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('start') and cleaned_data.get('end') and cleaned_data['start'] > cleaned_data['end']:
+            raise ValidationError("Start date is after the end date")
+        return cleaned_data
+
+
+class OrderAdmin(admin.ModelAdmin):
+    list_display = ('order_number', 'user', 'amount', 'district', 'payment_type', 'payment_status', 'order_status',
+                    'ordered_date')
+    list_filter = ('payment_status', 'order_status', 'payment_type')
+    search_fields = ('order_number', 'user__email', 'provider_order_id')
+    list_select_related = ('user',)
+    date_hierarchy = 'ordered_date'
+    change_list_template = 'admin/shop/order/change_list.html'
+    actions = ['export_csv', 'export_xlsx']
+
+    def get_urls(self):
+        return [
+            path('export/<str:file_format>/', self.admin_site.admin_view(self.export_orders), name='shop_order_export'),
+            path('report/', self.admin_site.admin_view(self.report), name='shop_order_report'),
+        ] + super().get_urls()
+
+    def export_orders(self, request, file_format):
+        """
+        Every order with its items, streamed
+        """
+        return streaming_export_response(order_export_rows(), 'xlsx' if file_format == 'xlsx' else 'csv', 'orders')
+
+    def report(self, request):
+        """
+        Daily revenue, units per product and per district sales of a date range
+        """
+        today = timezone.localdate()
+        form = SalesReportForm(request.GET or {'start': today - timedelta(days=29), 'end': today})
+
+        report = None
+        if form.is_valid():
+            report = sales_report(form.cleaned_data['start'], form.cleaned_data['end'], form.cleaned_data['refresh'])
+            report['daily'] = report['daily'].reset_index().to_dict('records')
+            report['products'] = report['products'].head(REPORT_TOP_PRODUCTS).reset_index().to_dict('records')
+            report['districts'] = report['districts'].reset_index().to_dict('records')
+
+        return render(request, 'admin/shop/order/sales_report.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Sales report',
+            'form': form,
+            'report': report,
+        })
+
+    @admin.action(description="Export selected orders as csv")
+    def export_csv(self, request, queryset):
+        return streaming_export_response(order_export_rows(queryset), 'csv', 'orders')
+
+    @admin.action(description="Export selected orders as xlsx")
+    def export_xlsx(self, request, queryset):
+        return streaming_export_response(order_export_rows(queryset), 'xlsx', 'orders')
 
 
 admin.site.register(User, UserAdmin)
@@ -106,4 +239,5 @@ admin.site.register(User, UserAdmin)
 admin.site.register(Category, CategoryAdmin)
 admin.site.register(SubCategory, SubCategoryAdmin)
 admin.site.register(Product, ProductAdmin)
+admin.site.register(Order, OrderAdmin)
 admin.site.unregister(Group)
@@ -1,12 +1,24 @@
-import os
 from celery import shared_task
-from django.core.mail import EmailMessage
+from django.core.cache import cache
+from django.core.files.storage import default_storage
 from django.utils import timezone
-from datetime import timedelta
+from django.utils.dateparse import parse_datetime
 import logging
 from dotenv import load_dotenv
-from django.template.loader import get_template
-from shop.models import Cart
+from shop.models import Cart, Order, OrderItem
+from shop.services.stock import release_expired_reservations
+from shop.services.cart_store import CartStore
+from shop.services.reconciliation import reconcile_pending_orders
+from shop.services.mail import queue_order_mail, drain_order_mail_queue
+from shop.services.abandoned_cart import AbandonedCartMailError, fan_out_abandoned_cart_mails, send_abandoned_cart_mails_to
+from shop.services import images
+from shop.services.search import write_search_index_snapshot
+from shop.services.catalog_io import import_catalog
+from shop.services.rankings import compute_rankings
+from shop.services.catalog import refresh_home_catalog
+
+# constant helper
+from utils.constants import *
 
 
 logger = logging.getLogger('django')
@@ -14,40 +26,128 @@ load_dotenv()
 
 
 @shared_task()
-def send_order_details_mail(user_email, body):
+def drain_order_mails():
     try:
-        email = EmailMessage(
-            'Majestic - Ecommerce site',
-            body,
-            os.getenv('SITE_EMAIL_ADDRESS'),
-            [user_email]
-        )
-
-        email.content_subtype = 'html'
-        email.send(fail_silently=True)
+        sent = drain_order_mail_queue()
+        if sent:
+            logger.info(f'Order emails sent - {sent}')
     except Exception as e:
-        logger.critical(f'Order email not sent.-  {e}')
+        logger.critical(f'Order emails not sent.-  {e}')
 
 
 @shared_task()
 def send_cart_abundance_mail():
     try:
-        cart_abundance_mail_template = get_template('shop/mail/cart_abundance_mail.html').render()
-
-        user_emails = Cart.objects.filter(
-            # created_at__gt=timezone.now() - timedelta(days=5),
-            # is_purchased=False
-        ).values_list('user__email', flat=True).distinct()
+        users = fan_out_abandoned_cart_mails()
+        if users:
+            logger.info(f'Cart abundance mails queued for {users} users')
+    except Exception as e:
+        logger.warning(f'cart abundance mail did not sent. - {e}')
 
-        if user_emails:
-            email = EmailMessage(
-                'Majestic - Ecommerce site',
-                cart_abundance_mail_template,
-                os.getenv('SITE_EMAIL_ADDRESS'),
-                user_emails
-            )
 
-            email.content_subtype = 'html'
-            email.send(fail_silently=True)
+@shared_task(bind=True, max_retries=ABANDONED_CART_MAIL_MAX_RETRIES)
+def send_abandoned_cart_mails(self, user_ids, window_start, window_end):
+    try:
+        send_abandoned_cart_mails_to(user_ids, parse_datetime(window_start), parse_datetime(window_end))
+    except AbandonedCartMailError as e:
+        logger.warning(f'cart abundance mail did not sent. - {e}')
+        # the same window again for the users without a mail, the sweep has moved past their carts
+        raise self.retry(args=(e.user_ids, window_start, window_end), countdown=ABANDONED_CART_MAIL_RETRY_SECONDS)
     except Exception as e:
         logger.warning(f'cart abundance mail did not sent. - {e}')
+
+
+@shared_task()
+def release_expired_stock_reservations():
+    try:
+        released = release_expired_reservations()
+        if released:
+            logger.info(f'Expired stock reservations released - {released} items')
+    except Exception as e:
+        logger.error(f'Expired stock reservations not released. - {e}')
+
+
+@shared_task()
+def persist_cart(user_id):
+    try:
+        CartStore.for_user(user_id).persist()
+    except Exception as e:
+        logger.error(f'Cart of user {user_id} not persisted. - {e}')
+
+
+@shared_task()
+def complete_order_purchase(order_id):
+    try:
+        order = Order.objects.get(pk=order_id)
+        product_ids = list(OrderItem.objects.filter(order=order).values_list('product_id', flat=True))
+
+        # the purchased products leave the cart
+        Cart.objects.filter(user_id=order.user_id, product_id__in=product_ids, is_purchased=False).update(is_purchased=True)
+        CartStore.for_user(order.user_id).remove(*product_ids)
+
+        queue_order_mail(order.id)
+    except Exception as e:
+        logger.error(f'Order {order_id} purchase not completed. - {e}')
+
+
+@shared_task()
+def reconcile_payments():
+    try:
+        stats = reconcile_pending_orders()
+        logger.info(f'Payment reconciliation - {stats}')
+    except Exception as e:
+        logger.error(f'Payment reconciliation failed. - {e}')
+
+
+@shared_task()
+def generate_image_variants(label, pk, force=False):
+    try:
+        images.generate_image_variants(label, pk, force=force)
+    except Exception as e:
+        logger.error(f'Image variants of {label} {pk} not generated. - {e}')
+
+
+@shared_task()
+def snapshot_search_index():
+    try:
+        index = write_search_index_snapshot()
+        logger.info(f'Search index snapshot written - {len(index)} products, version {index.version}')
+    except Exception as e:
+        logger.error(f'Search index snapshot not written. - {e}')
+
+
+@shared_task()
+def import_catalog_file(name, create_missing=False):
+    report = {'file': name, 'started_at': timezone.now().isoformat()}
+    try:
+        with default_storage.open(name, 'rb') as file:
+            stats, errors = import_catalog(file, name, create_missing=create_missing)
+        report.update(stats, error_lines=errors)
+    except Exception as e:
+        logger.error(f'Catalog {name} not imported. - {e}')
+        report['failed'] = str(e)
+    finally:
+        default_storage.delete(name)
+
+    report['finished_at'] = timezone.now().isoformat()
+    cache.set(CATALOG_IMPORT_REPORT_CACHE_KEY, report, None)
+
+
+@shared_task()
+def compute_product_rankings():
+    try:
+        rankings = compute_rankings()
+        logger.info(f"Product rankings computed - {rankings['events']} events, "
+                    f"{rankings['trending_flags_changed']} trending flags changed")
+    except Exception as e:
+        logger.error(f'Product rankings not computed. - {e}')
+
+
+@shared_task()
+def refresh_home_catalog_snapshot():
+    # a change committed from now on queues the next rebuild
+    cache.delete(HOME_CATALOG_REFRESH_PENDING_KEY)
+    try:
+        refresh_home_catalog()
+    except Exception as e:
+        logger.error(f'Home catalog snapshot not rebuilt. - {e}')
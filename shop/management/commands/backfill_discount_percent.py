@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from shop.services.catalog import backfill_discount_percent, refresh_home_catalog
+
+
+class Command(BaseCommand):
+    help = 'Set the stored discount percent of every product from its original and selling prices'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help='Products per UPDATE')
+
+    def handle(self, *args, **options):
+        updated = backfill_discount_percent(batch_size=options['batch_size'])
+        refresh_home_catalog()
+        self.stdout.write(self.style.SUCCESS(f'Discount percent set on {updated} products'))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+
+from shop.celery.tasks import generate_image_variants as generate_image_variants_task
+from shop.services.catalog import refresh_home_catalog
+from shop.services.images import IMAGE_FIELDS, generate_image_variants, model_label, variants_outdated
+from shop.services.product_cache import invalidate_product_fragments
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Build the resized jpeg/webp variants of the category, subcategory and product images missing them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Rebuild the up-to-date variants too')
+        parser.add_argument('--queue', action='store_true', help='Queue a celery task per image instead of building here')
+
+    def handle(self, *args, **options):
+        for model, field in IMAGE_FIELDS.items():
+            label = model_label(model)
+            built = []
+            for instance in model.objects.only('id', field, 'image_variants').iterator(chunk_size=500):
+                if not (options['force'] or variants_outdated(instance)):
+                    continue
+
+                if options['queue']:
+                    generate_image_variants_task.delay(label, instance.pk, force=options['force'])
+                    built.append(instance.pk)
+                    continue
+
+                try:
+                    if generate_image_variants(label, instance.pk, force=options['force'], notify=False):
+                        built.append(instance.pk)
+                except Exception as e:
+                    self.stderr.write(f"{label} {instance.pk}: {e}")
+
+            if model is Product and built and not options['queue']:
+                invalidate_product_fragments(built)
+
+            self.stdout.write(f"{label}: {len(built)} images {'queued' if options['queue'] else 'built'}")
+
+        if not options['queue']:
+            refresh_home_catalog()
+
+        self.stdout.write(self.style.SUCCESS('Image variants backfilled'))
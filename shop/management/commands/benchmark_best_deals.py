@@ -0,0 +1,85 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F, ExpressionWrapper, FloatField
+
+# models
+from shop.models import (
+    Category,
+    SubCategory,
+    Product,
+    get_discount_percent
+)
+from shop.services.catalog import best_deal_products
+
+# constant helper
+from utils.constants import *
+from utils.helper import explain
+
+
+def computed_best_deals():
+    # the ranking before the stored discount_percent column
+    return Product.objects.active_products().annotate(price_difference=ExpressionWrapper(
+        ((F('original_price') - F('selling_price')) * F('original_price')) * 100,
+        output_field=FloatField()
+    )).order_by('price_difference')
+
+
+def add_synthetic_products(count, seed):
+    generator = random.Random(seed)
+    category = Category.objects.create(name='benchmark', description='benchmark')
+    subcategory = SubCategory.objects.create(name='benchmark', category=category, description='benchmark')
+
+    batch = []
+    for number in range(count):
+        original_price = round(generator.uniform(100, 10000), 2)
+        selling_price = round(original_price * generator.uniform(0.3, 1), 2)
+        batch.append(Product(
+            category=category, subcategory=subcategory, name=f'benchmark {number}', description='benchmark',
+            quantity=10, original_price=original_price, selling_price=selling_price, status=generator.random() < 0.9,
+            discount_percent=get_discount_percent(original_price, selling_price)
+        ))
+        if len(batch) == 5000:
+            Product.objects.bulk_create(batch)
+            batch = []
+    Product.objects.bulk_create(batch)
+
+
+class Command(BaseCommand):
+    help = 'Best deals query - computed discount ordering vs the indexed discount_percent column. ' \
+           'Synthetic products are added inside a transaction that is rolled back at the end.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=200000, help='Synthetic products, 0 for the current data')
+        parser.add_argument('--runs', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=7)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['products']:
+                started = time.perf_counter()
+                add_synthetic_products(options['products'], options['seed'])
+                self.stdout.write(f"{options['products']} synthetic products added in {time.perf_counter() - started:.1f}s")
+
+            for name, queryset in (('computed discount', computed_best_deals()), ('discount_percent', best_deal_products())):
+                queryset = queryset[:HOME_CATALOG_PRODUCTS_LIMIT]
+
+                timings = []
+                for _ in range(options['runs']):
+                    started = time.perf_counter()
+                    list(queryset)
+                    timings.append(time.perf_counter() - started)
+                timings.sort()
+
+                self.stdout.write(
+                    f"{name}: median {timings[len(timings) // 2] * 1000:.1f}ms, "
+                    f"max {timings[-1] * 1000:.1f}ms over {options['runs']} runs"
+                )
+                if connection.vendor == 'mysql':
+                    for row in explain(queryset):
+                        self.stdout.write(f"    {row.get('table')}: type {row.get('type')}, key {row.get('key')}, "
+                                          f"rows {row.get('rows')}, {row.get('Extra')}")
+
+            transaction.set_rollback(True)
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.template.loader import get_template
+
+from shop.services.mail_templates import get_mail_template, list_items
+
+
+class Command(BaseCommand):
+    help = 'Per message render cost of the abandoned cart mail - full template render vs cached shell'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        template_name = 'shop/mail/cart_abundance_mail.html'
+        recipients = [
+            {'user_name': f'user {i}', 'cart_lines': list_items([f'product {i} - 1 qty', f'product {i + 1} - 2 qty'])}
+            for i in range(options['recipients'])
+        ]
+
+        started = time.perf_counter()
+        for recipient in recipients:
+            get_template(template_name).render(recipient)
+        full_render = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for recipient in recipients:
+            get_mail_template(template_name).render(**recipient)
+        cached_shell = time.perf_counter() - started
+
+        for name, elapsed in (('full render', full_render), ('cached shell', cached_shell)):
+            self.stdout.write(
+                f"{name}: {len(recipients)} mails in {elapsed:.2f}s - "
+                f"{elapsed / len(recipients) * 1000000:.0f} us per mail"
+            )
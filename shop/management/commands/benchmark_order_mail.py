@@ -0,0 +1,42 @@
+import time
+
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Mail throughput against a local SMTP sink (python -m aiosmtpd -n -l localhost:1025) - ' \
+           'one connection per mail vs one connection for the batch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=500)
+        parser.add_argument('--host', default='localhost')
+        parser.add_argument('--port', type=int, default=1025)
+
+    def handle(self, *args, **options):
+        messages = [
+            EmailMessage('Majestic - Ecommerce site', '<p>Order details</p>', 'shop@example.com', [f'user{i}@example.com'])
+            for i in range(options['count'])
+        ]
+
+        def connection():
+            return get_connection(
+                'django.core.mail.backends.smtp.EmailBackend',
+                host=options['host'], port=options['port'], username='', password='', use_tls=False
+            )
+
+        started = time.perf_counter()
+        for message in messages:
+            connection().send_messages([message])
+        per_mail = time.perf_counter() - started
+
+        started = time.perf_counter()
+        batch_connection = connection()
+        batch_connection.open()
+        for message in messages:
+            batch_connection.send_messages([message])
+        batch_connection.close()
+        batched = time.perf_counter() - started
+
+        for name, elapsed in (('connection per mail', per_mail), ('one connection', batched)):
+            self.stdout.write(f"{name}: {options['count']} mails in {elapsed:.2f}s - {options['count'] / elapsed:.0f} mails/s")
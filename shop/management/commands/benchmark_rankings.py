@@ -0,0 +1,102 @@
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from shop.services.rankings import DecayedScores, chunk_arrays
+
+# constant helper
+from utils.constants import *
+
+
+def synthetic_chunks(items, products, days, seed):
+    """
+    Order item chunks - product popularity is zipf like, order times are uniform over the window
+    @param items:
+    @param products:
+    @param days: window length
+    @param seed:
+    @return generator of (product ids, units, epoch seconds) arrays:
+    """
+    generator = np.random.default_rng(seed)
+    now = time.time()
+    for start in range(0, items, RANKING_CHUNK_SIZE):
+        size = min(RANKING_CHUNK_SIZE, items - start)
+        yield (
+            np.minimum(generator.zipf(1.3, size), products),
+            generator.integers(1, 4, size).astype(np.float64),
+            now - generator.uniform(0, days * 24 * 60 * 60, size),
+        )
+
+
+def half_lives():
+    return {
+        'trending': TRENDING_HALF_LIFE_HOURS * 60 * 60,
+        'best_sellers': BEST_SELLER_HALF_LIFE_DAYS * 60 * 60 * 24,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Time decayed ranking of synthetic order items - scoring throughput of both rankings, ' \
+           'row to array conversion of the database chunks and a check against a plain python scoring'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=10000000)
+        parser.add_argument('--products', type=int, default=200000)
+        parser.add_argument('--seed', type=int, default=7)
+
+    def handle(self, *args, **options):
+        now = time.time()
+
+        # scoring - the numpy part of compute_rankings
+        scores = DecayedScores(now, half_lives())
+        scoring = 0
+        for product_ids, units, timestamps in synthetic_chunks(
+            options['items'], options['products'], BEST_SELLER_WINDOW_DAYS, options['seed']
+        ):
+            started = time.perf_counter()
+            scores.add(product_ids, units, timestamps)
+            scoring += time.perf_counter() - started
+
+        started = time.perf_counter()
+        for name in half_lives():
+            scores.top(name, TRENDING_PRODUCTS_LIMIT * RANKING_CANDIDATES_FACTOR)
+        ranking = time.perf_counter() - started
+        self.stdout.write(
+            f"{scores.events} order items scored in {scoring:.2f}s "
+            f"({scores.events / scoring / 1e6:.1f}M items/s), top lists in {ranking * 1000:.1f}ms"
+        )
+
+        # the rows of the database chunks are python tuples - their conversion is timed on a few chunks
+        generator = random.Random(options['seed'])
+        moment = datetime.fromtimestamp(now, timezone.utc)
+        rows = [
+            (generator.randint(1, options['products']), generator.randint(1, 3),
+             moment - timedelta(seconds=generator.uniform(0, BEST_SELLER_WINDOW_DAYS * 24 * 60 * 60)))
+            for _ in range(RANKING_CHUNK_SIZE)
+        ]
+        runs = 5
+        started = time.perf_counter()
+        for _ in range(runs):
+            chunk_arrays(rows)
+        conversion = (time.perf_counter() - started) / (runs * RANKING_CHUNK_SIZE)
+        self.stdout.write(
+            f"row conversion {conversion * 1e9:.0f}ns per item - "
+            f"{conversion * options['items']:.1f}s for {options['items']} items on top of the database reads"
+        )
+
+        # the same ranking from a plain python loop over the sample rows
+        check = DecayedScores(now, half_lives())
+        check.add(*chunk_arrays(rows))
+        expected = defaultdict(float)
+        for product_id, units, ordered_date in rows:
+            expected[product_id] += units * 2 ** (-(now - ordered_date.timestamp()) / half_lives()['best_sellers'])
+        top = sorted(expected, key=lambda product_id: (-expected[product_id], product_id))[:BEST_SELLER_PRODUCTS_LIMIT]
+        agrees = set(check.top('best_sellers', BEST_SELLER_PRODUCTS_LIMIT)) == set(top)
+        style = self.style.SUCCESS if agrees else self.style.ERROR
+        self.stdout.write(style(
+            f"top {BEST_SELLER_PRODUCTS_LIMIT} best sellers {'match' if agrees else 'differ from'} the python scoring"
+        ))
@@ -0,0 +1,105 @@
+import os
+import random
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.services.search import SearchIndex
+
+# constant helper
+from utils.constants import *
+
+
+def synthetic_catalog(products, seed):
+    """
+    Products named from a skewed vocabulary - a few very common words and a long tail, like a real catalog
+    @param products:
+    @param seed:
+    @return generator of documents, list of words:
+    """
+    generator = random.Random(seed)
+    words = [f'{generator.choice("bcdfghklmnprstvw")}{generator.choice("aeiou")}{index:x}' for index in range(20000)]
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    categories = [f'category{index}' for index in range(10)]
+    subcategories = [f'sub{index}' for index in range(200)]
+
+    def documents():
+        for product_id in range(1, products + 1):
+            yield {
+                'id': product_id,
+                'name': ' '.join(generator.choices(words, weights, k=4)),
+                'description': ' '.join(generator.choices(words, weights, k=16)),
+                'category': generator.choice(categories),
+                'subcategory': generator.choice(subcategories),
+            }
+
+    return documents(), words
+
+
+def percentiles(timings):
+    timings = sorted(timings)
+    return {
+        name: timings[min(len(timings) - 1, int(len(timings) * fraction))] * 1000
+        for name, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))
+    }
+
+
+class Command(BaseCommand):
+    help = 'Build, snapshot and query latency of the product search index on a synthetic catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000000)
+        parser.add_argument('--queries', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=7)
+
+    def handle(self, *args, **options):
+        documents, words = synthetic_catalog(options['products'], options['seed'])
+
+        started = time.perf_counter()
+        index = SearchIndex()
+        index.build(documents)
+        self.stdout.write(f"build: {len(index)} products, {len(index.vocabulary)} terms in {time.perf_counter() - started:.1f}s")
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'search_index.snapshot')
+            started = time.perf_counter()
+            index.dump(path)
+            self.stdout.write(f"snapshot write: {os.path.getsize(path) / 1024 / 1024:.1f} MB in {time.perf_counter() - started:.1f}s")
+
+            started = time.perf_counter()
+            index = SearchIndex.load(path)
+            self.stdout.write(f"snapshot load: {time.perf_counter() - started:.1f}s")
+
+        generator = random.Random(options['seed'] + 1)
+        weights = [1 / (rank + 1) ** 0.5 for rank in range(len(words))]
+        queries = []
+        for _ in range(options['queries']):
+            query = generator.choices(words, weights, k=generator.randint(1, 3))
+            # the last word is still being typed
+            query[-1] = query[-1][:generator.randint(2, len(query[-1]))]
+            queries.append(' '.join(query))
+
+        results = 0
+        search_timings = []
+        for query in queries:
+            started = time.perf_counter()
+            results += bool(index.search(query))
+            search_timings.append(time.perf_counter() - started)
+
+        autocomplete_timings = []
+        for query in queries:
+            started = time.perf_counter()
+            index.autocomplete(query)
+            autocomplete_timings.append(time.perf_counter() - started)
+
+        for name, timings, target in (
+            ('search', search_timings, SEARCH_LATENCY_TARGET_MS),
+            ('autocomplete', autocomplete_timings, AUTOCOMPLETE_LATENCY_TARGET_MS),
+        ):
+            stats = percentiles(timings)
+            line = ', '.join(f'{key} {value:.2f}ms' for key, value in stats.items())
+            style = self.style.SUCCESS if stats['p95'] <= target else self.style.ERROR
+            self.stdout.write(style(f"{name}: {line} - p95 target {target}ms"))
+
+        self.stdout.write(f"{results} of {len(queries)} queries had results")
@@ -0,0 +1,64 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F
+
+# models
+from shop.models import Product
+
+
+def conditional_update(product_id):
+    with transaction.atomic():
+        return Product.objects.filter(pk=product_id, quantity__gte=1).update(quantity=F('quantity') - 1) == 1
+
+
+def select_for_update(product_id):
+    with transaction.atomic():
+        quantity = Product.objects.select_for_update().values_list('quantity', flat=True).get(pk=product_id)
+        if quantity < 1:
+            return False
+        # a plain UPDATE under the row lock - save() would add the signal handlers to the timing
+        Product.objects.filter(pk=product_id).update(quantity=quantity - 1)
+        return True
+
+
+class Command(BaseCommand):
+    help = 'Parallel buyers taking stock of a single hot product - conditional UPDATE vs select_for_update. ' \
+           'The taken stock is given back at the end.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_id', type=int)
+        parser.add_argument('--buyers', type=int, default=32, help='Parallel threads')
+        parser.add_argument('--attempts', type=int, default=50, help='Reservations per buyer')
+
+    def handle(self, *args, **options):
+        product_id = options['product_id']
+
+        for name, take in (('conditional update', conditional_update), ('select_for_update', select_for_update)):
+            taken = []
+
+            def buyer():
+                count = 0
+                try:
+                    for _ in range(options['attempts']):
+                        count += take(product_id)
+                finally:
+                    taken.append(count)
+                    connection.close()
+
+            threads = [threading.Thread(target=buyer) for _ in range(options['buyers'])]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+            attempts = options['buyers'] * options['attempts']
+            Product.objects.filter(pk=product_id).update(quantity=F('quantity') + sum(taken))
+            self.stdout.write(
+                f"{name}: {attempts} attempts, {sum(taken)} reserved in {elapsed:.2f}s - "
+                f"{attempts / elapsed:.0f} reservations/s"
+            )
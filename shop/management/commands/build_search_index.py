@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+
+from shop.services.search import write_search_index_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Build the product search index from the database and write the snapshot the processes load at start'
+
+    def handle(self, *args, **options):
+        index = write_search_index_snapshot()
+        self.stdout.write(self.style.SUCCESS(
+            f"Search index snapshot written to {settings.SEARCH_INDEX_PATH} - "
+            f"{len(index)} products, {len(index.vocabulary)} terms, version {index.version}"
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from shop.services.rankings import compute_rankings
+
+
+class Command(BaseCommand):
+    help = 'Compute the trending and best seller rankings now, publish them and rebuild the home catalog'
+
+    def handle(self, *args, **options):
+        rankings = compute_rankings()
+        self.stdout.write(self.style.SUCCESS(
+            f"{rankings['events']} events scored - {len(rankings['trending'])} trending, "
+            f"{len(rankings['best_sellers'])} best sellers, {rankings['trending_flags_changed']} trending flags changed"
+        ))
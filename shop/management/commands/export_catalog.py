@@ -0,0 +1,37 @@
+import csv
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.services.catalog_io import catalog_export_rows
+from utils.export import write_xlsx
+
+
+class Command(BaseCommand):
+    help = 'Write the catalog to a csv or xlsx file in the import format'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        extension = os.path.splitext(path)[1].lower()
+        if extension not in ('.csv', '.xlsx'):
+            raise CommandError('Export path must end with .csv or .xlsx')
+
+        exported = 0
+
+        def rows():
+            nonlocal exported
+            for row in catalog_export_rows():
+                exported += 1
+                yield row
+
+        if extension == '.csv':
+            with open(path, 'w', newline='', encoding='utf-8') as file:
+                csv.writer(file).writerows(rows())
+        else:
+            write_xlsx(rows(), path)
+
+        # the header row is not a product
+        self.stdout.write(self.style.SUCCESS(f'{exported - 1} products written to {path}'))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.services.catalog_io import CatalogImportError, import_catalog
+
+# constant helper
+from utils.constants import *
+
+
+class Command(BaseCommand):
+    help = 'Upsert products from a csv or xlsx catalog file, matched on sku. ' \
+           'Columns - sku, name, category, subcategory, description, quantity, original_price, selling_price, ' \
+           'status, is_exclusive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--create-missing', action='store_true',
+                            help='Create unknown categories and subcategories instead of rejecting the rows')
+        parser.add_argument('--chunk-size', type=int, default=CATALOG_IMPORT_CHUNK_SIZE, help='Rows per upsert')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], 'rb') as file:
+                stats, errors = import_catalog(
+                    file, options['path'], create_missing=options['create_missing'], chunk_size=options['chunk_size']
+                )
+        except (OSError, CatalogImportError) as e:
+            raise CommandError(str(e))
+
+        for error in errors:
+            self.stderr.write(error)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['rows']} rows read, {stats['upserted']} products upserted, {stats['errors']} rows rejected"
+        ))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.core.files.storage import default_storage
+
+from shop.models import Product
+from shop.services.catalog import refresh_home_catalog
+from shop.services.images import IMAGE_FIELDS, model_label, move_image_to_content_addressed
+from shop.services.product_cache import invalidate_product_fragments
+
+
+class Command(BaseCommand):
+    help = 'Move the uploaded images and their variants to content hash names'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete-old', action='store_true',
+                            help='Delete the old files once every row points to the new names')
+
+    def handle(self, *args, **options):
+        old_names = set()
+        for model, field in IMAGE_FIELDS.items():
+            label = model_label(model)
+            moved = []
+            for instance in model.objects.only('id', field, 'image_variants').iterator(chunk_size=500):
+                try:
+                    names = move_image_to_content_addressed(instance)
+                except Exception as e:
+                    self.stderr.write(f"{label} {instance.pk}: {e}")
+                    continue
+
+                if names:
+                    moved.append(instance.pk)
+                    old_names.update(names)
+
+            if model is Product and moved:
+                invalidate_product_fragments(moved)
+
+            self.stdout.write(f"{label}: {len(moved)} images moved")
+
+        refresh_home_catalog()
+
+        if options['delete_old']:
+            # the same old file may be shared by rows, it is deleted only when none of them still use it
+            for model, field in IMAGE_FIELDS.items():
+                old_names -= set(model.objects.filter(**{f'{field}__in': list(old_names)}).values_list(field, flat=True))
+
+            for name in old_names:
+                default_storage.delete(name)
+            self.stdout.write(f"{len(old_names)} old files deleted")
+
+        self.stdout.write(self.style.SUCCESS('Media moved to content addressed names'))
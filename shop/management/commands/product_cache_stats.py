@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from shop.services.product_cache import product_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Hit/miss statistics of the product details page cache'
+
+    def handle(self, *args, **options):
+        stats = product_cache_stats()
+        self.stdout.write(
+            f"hits: {stats['hits']}, misses: {stats['misses']}, hit ratio: {stats['hit_ratio']:.2%}"
+        )
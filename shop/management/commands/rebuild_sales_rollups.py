@@ -0,0 +1,29 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.services.rollups import rebuild_sales_rollups
+
+# constant helper
+from utils.constants import *
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily product and district sales rollups from the orders, a batch of days per transaction. ' \
+           'Run once to backfill the history and after orders are edited or cancelled in the admin.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, help='First day, YYYY-MM-DD - the first sale by default')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last day, YYYY-MM-DD - today by default')
+        parser.add_argument('--batch-days', type=int, default=SALES_ROLLUP_BATCH_DAYS, help='Days per transaction')
+
+    def handle(self, *args, **options):
+        if options['start'] and options['end'] and options['start'] > options['end']:
+            raise CommandError('Start date is after the end date')
+        if options['batch_days'] < 1:
+            raise CommandError('Batch days must be positive')
+
+        stats = rebuild_sales_rollups(options['start'], options['end'], options['batch_days'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['days']} days rebuilt - {stats['product_rows']} product rows, {stats['district_rows']} district rows"
+        ))
@@ -0,0 +1,29 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from shop.services.reconciliation import reconcile_pending_orders
+
+# constant helper
+from utils.constants import *
+
+
+class Command(BaseCommand):
+    help = 'Check the pending online payment orders against razorpay, or show the last run metrics'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stats', action='store_true', help='Show the metrics of the last run only')
+        parser.add_argument('--batch-size', type=int, default=RECONCILIATION_BATCH_SIZE)
+        parser.add_argument('--workers', type=int, default=RECONCILIATION_WORKERS)
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            stats = cache.get(RECONCILIATION_STATS_CACHE_KEY)
+        else:
+            stats = reconcile_pending_orders(batch_size=options['batch_size'], workers=options['workers'])
+
+        if not stats:
+            self.stdout.write('No reconciliation run yet')
+            return
+
+        for name, value in stats.items():
+            self.stdout.write(f"{name}: {value}")
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from shop.services.counters import reconcile_product_counters
+
+
+class Command(BaseCommand):
+    help = 'Recount the active products of every category and subcategory and fix the drifted counters'
+
+    def handle(self, *args, **options):
+        fixed = reconcile_product_counters()
+        for model_name, count in fixed.items():
+            self.stdout.write(f"{model_name}: {count} counters fixed")
+
+        self.stdout.write(self.style.SUCCESS('Product counters reconciled'))
@@ -0,0 +1,31 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from shop.services.reports import sales_report
+
+
+class Command(BaseCommand):
+    help = 'Daily revenue, units per product and per district sales of a date range, cached per day'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, help='First day, YYYY-MM-DD - 30 days ago by default')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last day, YYYY-MM-DD - today by default')
+        parser.add_argument('--refresh', action='store_true', help="Read the cached days from the rollups again")
+        parser.add_argument('--top', type=int, default=10, help='Products listed')
+
+    def handle(self, *args, **options):
+        end = options['end'] or timezone.localdate()
+        start = options['start'] or end - timedelta(days=29)
+        if start > end:
+            raise CommandError('Start date is after the end date')
+
+        report = sales_report(start, end, options['refresh'])
+
+        self.stdout.write(report['daily'].to_string())
+        self.stdout.write(report['products'].head(options['top']).to_string())
+        self.stdout.write(report['districts'][report['districts']['orders'] > 0].to_string())
+        self.stdout.write(self.style.SUCCESS(
+            f"{start} - {end}: {report['orders']} orders, {report['units']} units, revenue {report['revenue']:.2f}"
+        ))
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.3 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0004_cart_is_purchased'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'created_at'], name='product_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'subcategory', 'status', 'created_at'], name='product_listing_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_exclusive', 'status', 'created_at'], name='product_exclusive_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['user', 'is_purchased'], name='cart_user_purchased_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['provider_order_id'], name='order_provider_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-ordered_date'], name='order_user_ordered_idx'),
+        ),
+    ]
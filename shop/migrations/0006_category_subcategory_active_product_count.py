@@ -0,0 +1,35 @@
+# Generated by Django 4.2.3 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+def fill_active_product_count(apps, schema_editor):
+    Category = apps.get_model('shop', 'Category')
+    SubCategory = apps.get_model('shop', 'SubCategory')
+    Product = apps.get_model('shop', 'Product')
+
+    for model, field in ((Category, 'category_id'), (SubCategory, 'subcategory_id')):
+        counts = Product.objects.filter(status=True).values_list(field).annotate(count=models.Count('id')).order_by()
+        for pk, count in counts:
+            model.objects.filter(pk=pk).update(active_product_count=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0005_product_cart_order_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='active_product_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='subcategory',
+            name='active_product_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(fill_active_product_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.3 on 2026-10-18 11:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0006_category_subcategory_active_product_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('status', models.CharField(choices=[('reserved', 'reserved'), ('committed', 'committed'), ('released', 'released')], default='reserved', max_length=20)),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='shop.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='shop.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'expires_at'], name='reservation_status_expiry_idx')],
+            },
+        ),
+    ]
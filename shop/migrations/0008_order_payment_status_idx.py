@@ -0,0 +1,17 @@
+# Generated by Django 4.2.3 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0007_stockreservation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['payment_status', 'payment_type', 'created_at'], name='order_payment_status_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.3 on 2026-10-18 14:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_order_payment_status_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='abandoned_mail_sent_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['is_purchased', 'updated_at'], name='cart_abandoned_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.3 on 2026-10-18 15:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_cart_abandoned_mail_sent_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='subcategory',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
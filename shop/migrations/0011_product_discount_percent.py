@@ -0,0 +1,36 @@
+# Generated by Django 4.2.3 on 2026-10-18 16:40
+
+from django.db import migrations, models
+from django.db.models.functions import Round
+
+
+def fill_discount_percent(apps, schema_editor):
+    Product = apps.get_model('shop', 'Product')
+
+    Product.objects.filter(original_price__gt=models.F('selling_price')).update(discount_percent=Round(
+        (models.F('original_price') - models.F('selling_price')) * 100.0 / models.F('original_price'), 2
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='discount_percent',
+            field=models.FloatField(default=0.0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'discount_percent'], name='product_best_deal_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['subcategory', 'status', 'discount_percent'], name='product_subcat_deal_idx'),
+        ),
+        migrations.RunPython(fill_discount_percent, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-18 17:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_product_discount_percent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='sku',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.3 on 2026-10-18 19:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_product_sku'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DistrictDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('district', models.CharField(max_length=100)),
+                ('orders', models.IntegerField(default=0)),
+                ('revenue', models.FloatField(default=0.0)),
+            ],
+            options={
+                'unique_together': {('day', 'district')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.FloatField(default=0.0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='shop.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'day'], name='product_daily_sales_idx')],
+                'unique_together': {('day', 'product')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-19 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0013_daily_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='payment_status',
+            field=models.CharField(choices=[('completed', 'completed'), ('pending', 'pending'), ('in_progres', 'in_progres'), ('error', 'error'), ('refund', 'refund')], max_length=100),
+        ),
+    ]
@@ -1,6 +1,5 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import BaseUserManager, AbstractUser, PermissionsMixin
-import datetime
 import os
 from utils.constants import *
 import uuid
@@ -61,11 +60,16 @@ class User(AbstractUser, PermissionsMixin):
         return self.email
 
 
-# give file name while uploading
+# upload directory - the storage (utils.storage) names the file by its content hash
 def get_file_name(request, file_name) -> str:
-    date_time = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-    new_file_name = "%s%s" % (date_time, file_name)
-    return os.path.join('uploads/', new_file_name)
+    return os.path.join('uploads/', file_name)
+
+
+# discount of the selling price on the original price, in percent
+def get_discount_percent(original_price, selling_price) -> float:
+    if not original_price or selling_price >= original_price:
+        return 0.0
+    return round((original_price - selling_price) / original_price * 100, 2)
 
 
 # Extending model managers
@@ -83,6 +87,10 @@ class Category(models.Model):
     image = models.ImageField(upload_to=get_file_name, null=True, blank=True)
     status = models.BooleanField(default=False, help_text="1-show, 0-hidden")
     description = models.TextField(max_length=500, null=False, blank=False)
+    # resized jpeg/webp copies of the image - filled by the generate_image_variants task
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # maintained from the product signals, reconciled by the reconcile_product_counters command
+    active_product_count = models.PositiveIntegerField(default=0, db_index=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -98,6 +106,10 @@ class SubCategory(models.Model):
     description = models.TextField(max_length=500, null=False, blank=False)
     status = models.BooleanField(default=False, help_text="1-show, 0-hidden")
     trending = models.BooleanField(default=False, help_text="0-default, 1-trending")
+    # resized jpeg/webp copies of the image - filled by the generate_image_variants task
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # maintained from the product signals, reconciled by the reconcile_product_counters command
+    active_product_count = models.PositiveIntegerField(default=0, db_index=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -109,7 +121,11 @@ class Product(models.Model):
     category = models.ForeignKey(Category, related_name='products', on_delete=models.CASCADE)
     subcategory = models.ForeignKey(SubCategory, related_name='products', on_delete=models.CASCADE)
     name = models.CharField(max_length=255, null=False, blank=False)
+    # catalog file key - the bulk import updates the product with the same sku
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     product_image = models.ImageField(upload_to=get_file_name, null=True, blank=True)
+    # resized jpeg/webp copies of the image - filled by the generate_image_variants task
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     quantity = models.IntegerField(null=False, blank=False)
     original_price = models.FloatField(default=0.00, null=False, blank=False)
     selling_price = models.FloatField(default=0.00, null=False, blank=False)
@@ -117,11 +133,38 @@ class Product(models.Model):
     status = models.BooleanField(default=False, help_text="1-show, 0-hidden")
     trending = models.BooleanField(default=False, help_text="0-default, 1-trending")
     is_exclusive = models.BooleanField(default=False, help_text="0-default, 1-exclusive")
+    # stored for the best deals ranking, set on save and filled by the backfill_discount_percent command
+    discount_percent = models.FloatField(default=0.00, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     objects = ProductQuerySet.as_manager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='product_status_created_idx'),
+            models.Index(fields=['category', 'subcategory', 'status', 'created_at'],
+                         name='product_listing_idx'),
+            models.Index(fields=['is_exclusive', 'status', 'created_at'], name='product_exclusive_idx'),
+            # best deals - ORDER BY discount_percent DESC, id DESC is a backward range scan
+            models.Index(fields=['status', 'discount_percent'], name='product_best_deal_idx'),
+            models.Index(fields=['subcategory', 'status', 'discount_percent'], name='product_subcat_deal_idx'),
+        ]
+
+    # product counters of category and subcategory are updated in the same transaction
+    def save(self, *args, **kwargs):
+        self.discount_percent = get_discount_percent(self.original_price, self.selling_price)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'original_price', 'selling_price'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'discount_percent'}
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
+
     def __str__(self) -> str:
         return self.name
 
@@ -132,11 +175,16 @@ class Cart(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.IntegerField(null=False, blank=False)
     is_purchased = models.BooleanField(default=False)
+    abandoned_mail_sent_at = models.DateTimeField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ('user', 'product')
+        indexes = [
+            models.Index(fields=['user', 'is_purchased'], name='cart_user_purchased_idx'),
+            models.Index(fields=['is_purchased', 'updated_at'], name='cart_abandoned_idx'),
+        ]
 
     @property
     def total_final_cost(self):
@@ -156,7 +204,8 @@ class Order(models.Model):
         ('completed', COMPLETED),
         ('pending', PENDING),
         ('in_progres', IN_PROGRES),
-        ('error', ERROR)
+        ('error', ERROR),
+        ('refund', REFUND)
     ]
 
     order_status = [
@@ -190,6 +239,13 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['provider_order_id'], name='order_provider_order_idx'),
+            models.Index(fields=['user', '-ordered_date'], name='order_user_ordered_idx'),
+            models.Index(fields=['payment_status', 'payment_type', 'created_at'], name='order_payment_status_idx'),
+        ]
+
     def __str__(self) -> str:
         return str(self.order_number)
 
@@ -204,3 +260,58 @@ class OrderItem(models.Model):
 
     class Meta:
         unique_together = ('order', 'product')
+
+
+# stock held for an order until the payment completes or the reservation expires
+class StockReservation(models.Model):
+    reservation_status = [
+        ('reserved', RESERVED),
+        ('committed', COMMITTED),
+        ('released', RELEASED)
+    ]
+
+    order = models.ForeignKey(Order, related_name='reservations', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.IntegerField(null=False, blank=False)
+    status = models.CharField(max_length=20, choices=reservation_status, default=RESERVED)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at'], name='reservation_status_expiry_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.product_id} - {self.quantity}'
+
+
+# sales rollups - one row per local day, kept by services.rollups when an order becomes a sale
+class ProductDailySales(models.Model):
+    day = models.DateField()
+    product = models.ForeignKey(Product, related_name='daily_sales', on_delete=models.CASCADE)
+    units = models.IntegerField(default=0)
+    revenue = models.FloatField(default=0.00)
+
+    class Meta:
+        unique_together = ('day', 'product')
+        indexes = [
+            models.Index(fields=['product', 'day'], name='product_daily_sales_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.day} - {self.product_id}'
+
+
+class DistrictDailySales(models.Model):
+    day = models.DateField()
+    district = models.CharField(max_length=100)
+    orders = models.IntegerField(default=0)
+    revenue = models.FloatField(default=0.00)
+
+    class Meta:
+        unique_together = ('day', 'district')
+
+    def __str__(self) -> str:
+        return f'{self.day} - {self.district}'
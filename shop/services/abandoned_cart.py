@@ -0,0 +1,134 @@
+from datetime import timedelta
+import os
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+import logging
+
+# models
+from shop.models import Cart
+from shop.services.mail_templates import get_mail_template, list_items
+
+# constant helper
+from utils.constants import *
+from utils.helper import get_redis
+
+logger = logging.getLogger('django')
+
+
+class AbandonedCartMailError(Exception):
+    """
+    Some mails of a batch were not sent - the users to retry are kept
+    """
+
+    def __init__(self, user_ids, error):
+        super().__init__(f'{len(user_ids)} abandoned cart mails not sent - {error}')
+        self.user_ids = user_ids
+
+
+def abandoned_carts(window_start, window_end):
+    """
+    Unpurchased carts last changed inside the window and not mailed since that change
+    @param window_start: excluded
+    @param window_end: included
+    @return queryset:
+    """
+    return Cart.objects.filter(
+        is_purchased=False,
+        updated_at__gt=window_start,
+        updated_at__lte=window_end
+    ).filter(
+        Q(abandoned_mail_sent_at__isnull=True) | Q(abandoned_mail_sent_at__lt=F('updated_at'))
+    )
+
+
+def fan_out_abandoned_cart_mails():
+    """
+    Find the users with carts abandoned since the last run and hand them to mail tasks in chunks.
+    Only the carts after the high-water mark are read, so a run costs the new abandoned carts only
+    @return number of users:
+    """
+    from shop.celery.tasks import send_abandoned_cart_mails
+
+    redis = get_redis()
+    now = timezone.now()
+    window_end = now - timedelta(hours=ABANDONED_CART_AFTER_HOURS)
+    high_water_mark = redis.get(ABANDONED_CART_HIGH_WATER_MARK_KEY)
+    window_start = parse_datetime(high_water_mark) if high_water_mark else now - timedelta(days=ABANDONED_CART_MAX_AGE_DAYS)
+
+    if window_end <= window_start:
+        return 0
+
+    user_ids = abandoned_carts(window_start, window_end).values_list('user_id', flat=True).distinct().order_by()
+
+    users = 0
+    chunk = []
+    for user_id in user_ids.iterator(chunk_size=ABANDONED_CART_STREAM_CHUNK_SIZE):
+        chunk.append(user_id)
+        if len(chunk) == ABANDONED_CART_USERS_PER_TASK:
+            send_abandoned_cart_mails.delay(chunk, window_start.isoformat(), window_end.isoformat())
+            users += len(chunk)
+            chunk = []
+
+    if chunk:
+        send_abandoned_cart_mails.delay(chunk, window_start.isoformat(), window_end.isoformat())
+        users += len(chunk)
+
+    redis.set(ABANDONED_CART_HIGH_WATER_MARK_KEY, window_end.isoformat())
+    return users
+
+
+def send_abandoned_cart_mails_to(user_ids, window_start, window_end):
+    """
+    One personalized mail per user over one SMTP connection, the carts of a user are marked once the mail is sent.
+    The high-water mark is already past these carts - the failed users are raised for the task to retry
+    @param user_ids:
+    @param window_start:
+    @param window_end:
+    @return number of mails sent:
+    """
+    carts = abandoned_carts(window_start, window_end).filter(user_id__in=user_ids).select_related('user', 'product')
+
+    carts_by_user = {}
+    for cart in carts:
+        carts_by_user.setdefault(cart.user_id, []).append(cart)
+
+    if not carts_by_user:
+        return 0
+
+    template = get_mail_template('shop/mail/cart_abundance_mail.html')
+    sent_user_ids = []
+    error = None
+    try:
+        with get_connection(fail_silently=False) as connection:
+            for user_id, user_carts in carts_by_user.items():
+                user = user_carts[0].user
+                email = EmailMessage(
+                    'Majestic - Ecommerce site',
+                    template.render(
+                        user_name=user.username,
+                        cart_lines=list_items([f'{cart.product.name} - {cart.quantity} qty' for cart in user_carts])
+                    ),
+                    os.getenv('SITE_EMAIL_ADDRESS'),
+                    [user.email],
+                    connection=connection
+                )
+                email.content_subtype = 'html'
+                try:
+                    email.send()
+                except Exception as e:
+                    error = e
+                    continue
+
+                Cart.objects.filter(pk__in=[cart.id for cart in user_carts]).update(abandoned_mail_sent_at=timezone.now())
+                sent_user_ids.append(user_id)
+    except Exception as e:
+        # the connection could not be opened - nobody after the last sent mail got one
+        error = e
+
+    failed = [user_id for user_id in carts_by_user if user_id not in sent_user_ids]
+    if failed:
+        raise AbandonedCartMailError(failed, error)
+
+    return len(sent_user_ids)
@@ -0,0 +1,53 @@
+from django.db.models import F, Sum, Count, ExpressionWrapper, FloatField, Value
+from django.db.models.functions import Coalesce
+
+# models
+from shop.models import Cart
+
+LINE_FINAL_COST = ExpressionWrapper(F('quantity') * F('product__selling_price'), output_field=FloatField())
+LINE_NET_COST = ExpressionWrapper(F('quantity') * F('product__original_price'), output_field=FloatField())
+
+# will move to the cart once gst and delivery logic completed
+DELIVERY_CHARGES = 0
+GST = 0
+
+
+def cart_lines(user):
+    """
+    Cart items of the user with the product and the line totals, in one query
+    @param user:
+    @return queryset:
+    """
+    return Cart.objects.filter(user=user, is_purchased=False).select_related('product').annotate(
+        total_cost=LINE_FINAL_COST,
+        net_cost=LINE_NET_COST
+    )
+
+
+def cart_summary(user):
+    """
+    Net/final/discount totals and item counts of the user cart, in one aggregate query
+    @param user:
+    @return dict:
+    """
+    summary = Cart.objects.filter(user=user, is_purchased=False).aggregate(
+        total_final_amount=Coalesce(Sum(LINE_FINAL_COST), Value(0.0)),
+        total_net_amount=Coalesce(Sum(LINE_NET_COST), Value(0.0)),
+        item_count=Coalesce(Sum('quantity'), Value(0)),
+        line_count=Count('id')
+    )
+
+    summary['total_discount'] = summary['total_net_amount'] - summary['total_final_amount']
+    summary['delivery_charges'] = DELIVERY_CHARGES
+    summary['gst'] = GST
+    summary['order_amount'] = summary['total_final_amount'] + DELIVERY_CHARGES + GST
+    return summary
+
+
+def lines_order_amount(lines):
+    """
+    Order amount of cart lines already read - the order amount and its items come from the same read
+    @param lines: cart_lines() rows
+    @return float:
+    """
+    return sum(line.total_cost for line in lines) + DELIVERY_CHARGES + GST
@@ -0,0 +1,163 @@
+import uuid
+from django.db import transaction
+
+# models
+from shop.models import Cart
+
+# constant helper
+from utils.constants import *
+from utils.helper import get_redis, upsert_options
+
+# marks a user cart hash as loaded from the Cart table, product ids are the other fields
+LOADED_FIELD = 'loaded'
+
+
+class CartStore:
+    """
+    Shopping cart kept in a redis hash - product id -> quantity.
+    User carts are written behind to the Cart table by a celery task, guest carts live in redis only
+    """
+
+    def __init__(self, key, user_id=None):
+        self.key = key
+        self.user_id = user_id
+        self.redis = get_redis()
+
+    @classmethod
+    def for_user(cls, user_id):
+        return cls(f'{CART_KEY_PREFIX}:user:{user_id}', user_id=user_id)
+
+    @classmethod
+    def for_guest(cls, session):
+        if 'guest_cart' not in session:
+            session['guest_cart'] = uuid.uuid4().hex
+        return cls(f"{CART_KEY_PREFIX}:guest:{session['guest_cart']}")
+
+    @classmethod
+    def for_request(cls, request):
+        if request.user.is_authenticated:
+            return cls.for_user(request.user.id)
+        return cls.for_guest(request.session)
+
+    def _load(self):
+        # user carts are filled from the Cart table the first time they are used
+        if self.user_id is None or self.redis.hexists(self.key, LOADED_FIELD):
+            return
+
+        items = dict(Cart.objects.filter(user_id=self.user_id, is_purchased=False).values_list('product_id', 'quantity'))
+        self.redis.hset(self.key, mapping={LOADED_FIELD: 1, **items})
+
+    def items(self):
+        """
+        @return dict of product id -> quantity:
+        """
+        self._load()
+        return {
+            int(product_id): int(quantity)
+            for product_id, quantity in self.redis.hgetall(self.key).items()
+            if product_id != LOADED_FIELD
+        }
+
+    def get(self, product_id):
+        self._load()
+        quantity = self.redis.hget(self.key, product_id)
+        return int(quantity) if quantity is not None else None
+
+    def set(self, product_id, quantity):
+        self._load()
+        pipeline = self.redis.pipeline()
+        pipeline.hset(self.key, product_id, quantity)
+        self._touch(pipeline)
+        pipeline.execute()
+        self._schedule_persist()
+
+    def set_many(self, items):
+        """
+        @param items: dict of product id -> quantity
+        @return:
+        """
+        self._load()
+        pipeline = self.redis.pipeline()
+        pipeline.hset(self.key, mapping=items)
+        self._touch(pipeline)
+        pipeline.execute()
+        self._schedule_persist()
+
+    def remove(self, *product_ids):
+        if not product_ids:
+            return
+
+        self._load()
+        pipeline = self.redis.pipeline()
+        pipeline.hdel(self.key, *product_ids)
+        self._touch(pipeline)
+        pipeline.execute()
+        self._schedule_persist()
+
+    def clear(self):
+        """
+        Empty the cart, the Cart table is expected to be updated by the caller
+        @return:
+        """
+        self.redis.delete(self.key)
+
+    def merge_into(self, other):
+        """
+        Move the items of this cart into the other one, this cart quantities win
+        @param other: CartStore
+        @return:
+        """
+        items = self.items()
+        if items:
+            other._load()
+            other.redis.hset(other.key, mapping=items)
+            other._schedule_persist()
+        self.clear()
+
+    def _touch(self, pipeline):
+        if self.user_id is None:
+            pipeline.expire(self.key, GUEST_CART_TTL_SECONDS)
+
+    def _schedule_persist(self):
+        # one pending write per user, changes made before it runs are written together
+        if self.user_id is not None and self.redis.sadd(CART_DIRTY_USERS_KEY, self.user_id):
+            from shop.celery.tasks import persist_cart
+            persist_cart.apply_async((self.user_id,), countdown=CART_PERSIST_DELAY_SECONDS)
+
+    def persist(self):
+        """
+        Write the cart to the Cart table - upsert the items, delete the removed ones.
+        The cart stays dirty until the rows are committed, a failed write is retried by the next flush_cart
+        @return:
+        """
+        if self.user_id is None:
+            return
+
+        items = self.items()
+
+        with transaction.atomic():
+            Cart.objects.bulk_create([
+                Cart(user_id=self.user_id, product_id=product_id, quantity=quantity, is_purchased=False)
+                for product_id, quantity in items.items()
+            ], **upsert_options(['user', 'product'], ['quantity', 'is_purchased', 'updated_at']))
+
+            Cart.objects.filter(user_id=self.user_id, is_purchased=False).exclude(product_id__in=list(items)).delete()
+
+            transaction.on_commit(lambda: self._persisted(items))
+
+    def _persisted(self, items):
+        self.redis.srem(CART_DIRTY_USERS_KEY, self.user_id)
+        # a change made during the write found the cart dirty and scheduled nothing
+        if self.items() != items:
+            self._schedule_persist()
+
+
+def flush_cart(user_id):
+    """
+    Write a pending cart change now - before reading the Cart table
+    @param user_id:
+    @return:
+    """
+    cart = CartStore.for_user(user_id)
+    if cart.redis.sismember(CART_DIRTY_USERS_KEY, user_id):
+        cart.persist()
@@ -0,0 +1,250 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Max, Min, Value, When, Window
+from django.db.models.functions import Round, RowNumber
+import logging
+
+# models
+from shop.models import Product
+
+# constant helper
+from utils.constants import *
+
+logger = logging.getLogger('django')
+
+
+def _product_values(product):
+    """
+    Plain dict of the product fields the home page shows, same keys as Product.objects.values(*HOME_CATALOG_PRODUCT_FIELDS)
+    @param product:
+    @return dict:
+    """
+    return {
+        'id': product.id,
+        'name': product.name,
+        'product_image': product.product_image.name,
+        'image_variants': product.image_variants,
+        'original_price': product.original_price,
+        'selling_price': product.selling_price,
+    }
+
+
+def best_deal_products():
+    """
+    Active products ranked by discount, biggest first - a backward scan of product_best_deal_idx
+    @return queryset:
+    """
+    return Product.objects.active_products().order_by('-discount_percent', '-id')
+
+
+def new_arrival_products():
+    """
+    Active products, oldest first as the home page lists them - product_status_created_idx
+    @return queryset:
+    """
+    return Product.objects.active_products().order_by('created_at')
+
+
+def subcategory_listing_products(exclusive=False, best_deals=False):
+    """
+    Products of the subcategories page, prefetched per subcategory
+    @param exclusive: exclusive products only - product_exclusive_idx
+    @param best_deals: shown products ranked by discount - product_subcat_deal_idx
+    @return queryset:
+    """
+    products = Product.objects.filter(subcategory=F('subcategory'))
+
+    if exclusive:
+        products = products.filter(is_exclusive=1).order_by('created_at')
+
+    if best_deals:
+        products = products.filter(status=True).order_by('-discount_percent', '-id')
+
+    return products
+
+
+def backfill_discount_percent(batch_size=10000):
+    """
+    Set the stored discount of every product from its prices, one UPDATE per id range
+    @param batch_size:
+    @return number of products updated:
+    """
+    discount = Case(
+        When(original_price__gt=F('selling_price'), then=Round(
+            (F('original_price') - F('selling_price')) * 100.0 / F('original_price'), 2
+        )),
+        default=Value(0.0),
+        output_field=FloatField()
+    )
+
+    bounds = Product.objects.aggregate(first=Min('id'), last=Max('id'))
+    if bounds['first'] is None:
+        return 0
+
+    updated = 0
+    for start in range(bounds['first'], bounds['last'] + 1, batch_size):
+        updated += Product.objects.filter(id__gte=start, id__lt=start + batch_size).update(discount_percent=discount)
+    return updated
+
+
+def catalog_tree_products(categories=None, products_limit=HOME_CATALOG_PRODUCTS_LIMIT):
+    """
+    First products of every subcategory, ranked with ROW_NUMBER() OVER (PARTITION BY subcategory_id)
+    @param categories: optional Category queryset to restrict the tree
+    @param products_limit: products per subcategory
+    @return queryset:
+    """
+    products = Product.objects.filter(
+        category=F('subcategory__category')
+    ).select_related('subcategory__category')
+
+    if categories is not None:
+        products = products.filter(category__in=categories)
+
+    return products.annotate(
+        row_number=Window(
+            expression=RowNumber(),
+            partition_by=[F('subcategory_id')],
+            order_by=[F('id').asc()]
+        )
+    ).filter(row_number__lte=products_limit).order_by('subcategory__category_id', 'subcategory_id', 'id')
+
+
+def load_catalog_tree(categories=None, products_limit=HOME_CATALOG_PRODUCTS_LIMIT):
+    """
+    Category -> subcategory -> first products tree in a single query.
+    Categories get `all_subcategories` and subcategories get `limited_products` as the templates expect
+    @param categories: optional Category queryset to restrict the tree
+    @param products_limit: products per subcategory
+    @return list of categories:
+    """
+    products = catalog_tree_products(categories, products_limit)
+
+    categories_by_id = {}
+    subcategories_by_id = {}
+    for product in products:
+        subcategory = subcategories_by_id.get(product.subcategory_id)
+        if subcategory is None:
+            subcategory = product.subcategory
+            subcategory.limited_products = []
+            subcategories_by_id[subcategory.id] = subcategory
+
+            category = categories_by_id.get(subcategory.category_id)
+            if category is None:
+                category = subcategory.category
+                category.all_subcategories = []
+                categories_by_id[category.id] = category
+            category.all_subcategories.append(subcategory)
+
+        subcategory.limited_products.append(product)
+
+    return list(categories_by_id.values())
+
+
+def ranked_products(product_ids):
+    """
+    Active products of a ranking in the ranked order
+    @param product_ids:
+    @return list of dicts:
+    """
+    products = {product['id']: product for product in Product.objects.active_products().filter(id__in=product_ids).values(
+        *HOME_CATALOG_PRODUCT_FIELDS
+    )}
+    return [products[product_id] for product_id in product_ids if product_id in products]
+
+
+def build_home_catalog():
+    """
+    Build the home page catalog snapshot - best deals, new arrivals, the trending and best seller rankings
+    and category -> subcategory -> first products tree as plain python data
+    @return dict:
+    """
+    best_deals = best_deal_products().values(*HOME_CATALOG_PRODUCT_FIELDS)[:HOME_CATALOG_PRODUCTS_LIMIT]
+
+    new_arrivals = new_arrival_products().values(*HOME_CATALOG_PRODUCT_FIELDS)[:HOME_CATALOG_PRODUCTS_LIMIT]
+
+    # product ids published by the compute_rankings task
+    rankings = cache.get(RANKINGS_CACHE_KEY) or {}
+
+    categories_with_data = load_catalog_tree()
+
+    categories = [
+        {
+            'id': category.id,
+            'name': category.name,
+            'image': category.image.name,
+            'image_variants': category.image_variants,
+            'all_subcategories': [
+                {
+                    'id': subcategory.id,
+                    'name': subcategory.name,
+                    'image': subcategory.image.name,
+                    'image_variants': subcategory.image_variants,
+                    'limited_products': [_product_values(product) for product in subcategory.limited_products],
+                }
+                for subcategory in category.all_subcategories
+            ],
+        }
+        for category in categories_with_data
+    ]
+
+    return {
+        'best_deals': list(best_deals),
+        'new_arrivals': list(new_arrivals),
+        'trending': ranked_products(rankings.get('trending', [])),
+        'best_sellers': ranked_products(rankings.get('best_sellers', [])),
+        'categories_with_data': categories,
+    }
+
+
+def refresh_home_catalog():
+    """
+    Rebuild the snapshot and publish it to the shared cache
+    @return dict:
+    """
+    home_catalog = build_home_catalog()
+    cache.set(HOME_CATALOG_CACHE_KEY, home_catalog, HOME_CATALOG_CACHE_TIMEOUT)
+    return home_catalog
+
+
+def home_catalog_state(product):
+    """
+    Values of the product the snapshot is built from, as they are stored - comparable to a values_list() row
+    @param product:
+    @return tuple:
+    """
+    return tuple(
+        Product._meta.get_field(field).get_prep_value(getattr(product, field)) for field in HOME_CATALOG_SOURCE_FIELDS
+    )
+
+
+def schedule_home_catalog_refresh():
+    """
+    Rebuild the snapshot in the background once the change is committed.
+    One pending rebuild at a time, the changes made before it runs are rebuilt together
+    @return:
+    """
+    def schedule():
+        if not cache.add(HOME_CATALOG_REFRESH_PENDING_KEY, 1, HOME_CATALOG_REFRESH_PENDING_TIMEOUT):
+            return
+        try:
+            from shop.celery.tasks import refresh_home_catalog_snapshot
+            refresh_home_catalog_snapshot.apply_async(countdown=HOME_CATALOG_REFRESH_DELAY_SECONDS)
+        except Exception as e:
+            cache.delete(HOME_CATALOG_REFRESH_PENDING_KEY)
+            logger.error(f"Home catalog rebuild not queued - {e}")
+
+    transaction.on_commit(schedule)
+
+
+def get_home_catalog():
+    """
+    Home page catalog from the shared cache, built on a cold cache
+    @return dict:
+    """
+    home_catalog = cache.get(HOME_CATALOG_CACHE_KEY)
+    if home_catalog is None:
+        logger.info('Home catalog snapshot missing from cache, rebuilding')
+        home_catalog = refresh_home_catalog()
+
+    return home_catalog
@@ -0,0 +1,256 @@
+import csv
+import io
+import itertools
+import math
+import os
+from django.db import connection, transaction
+from django.db.models import Sum
+from openpyxl import load_workbook
+import logging
+
+# models
+from shop.models import (
+    Category,
+    SubCategory,
+    Product,
+    StockReservation,
+    get_discount_percent
+)
+from shop.services.catalog import refresh_home_catalog
+from shop.services.counters import reconcile_product_counters
+from shop.services.facets import invalidate_facets
+from shop.services.product_cache import invalidate_product_fragments
+from shop.services.search import product_changed
+
+# constant helper
+from utils.constants import *
+from utils.helper import upsert_options
+
+logger = logging.getLogger('django')
+
+# no trending column - the flag is computed by the compute_rankings task, an import would overwrite it
+CATALOG_COLUMNS = (
+    'sku', 'name', 'category', 'subcategory', 'description', 'quantity',
+    'original_price', 'selling_price', 'status', 'is_exclusive',
+)
+
+UPSERT_FIELDS = [
+    'name', 'category', 'subcategory', 'description', 'quantity', 'original_price', 'selling_price',
+    'discount_percent', 'status', 'is_exclusive', 'updated_at',
+]
+
+TRUE_VALUES = ('1', 'true', 'yes', 'y')
+
+
+class CatalogImportError(Exception):
+    pass
+
+
+def _csv_rows(file):
+    reader = csv.DictReader(io.TextIOWrapper(file, encoding='utf-8-sig', newline=''))
+    for row in reader:
+        yield row
+
+
+def _xlsx_rows(file):
+    # read only workbook - rows are parsed one by one from the zip stream
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(cell).strip() if cell is not None else '' for cell in next(rows, ())]
+        for values in rows:
+            yield {column: '' if value is None else str(value) for column, value in zip(header, values)}
+    finally:
+        workbook.close()
+
+
+def catalog_rows(file, file_name):
+    """
+    Rows of a catalog file as dicts, streamed
+    @param file: binary file object
+    @param file_name: the extension picks the reader - .csv or .xlsx
+    @return generator of dicts:
+    """
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension == '.csv':
+        return _csv_rows(file)
+    if extension == '.xlsx':
+        return _xlsx_rows(file)
+    raise CatalogImportError(f'Unsupported catalog file {file_name} - csv and xlsx only')
+
+
+class CatalogImporter:
+    """
+    Upsert catalog rows in chunks - category and subcategory names are resolved from in-memory maps,
+    every chunk is a single bulk_create(update_conflicts=True) on the sku
+    """
+
+    def __init__(self, create_missing=False, chunk_size=CATALOG_IMPORT_CHUNK_SIZE):
+        self.create_missing = create_missing
+        self.chunk_size = chunk_size
+        self.categories = {name.lower(): pk for pk, name in Category.objects.values_list('id', 'name')}
+        self.subcategories = {
+            (category_id, name.lower()): pk
+            for pk, category_id, name in SubCategory.objects.values_list('id', 'category_id', 'name')
+        }
+        # range of the quantity column, None where the database does not enforce one
+        self.max_quantity = connection.ops.integer_field_range('IntegerField')[1]
+        self.stats = {'rows': 0, 'upserted': 0, 'errors': 0}
+        self.errors = []
+
+    def _category_id(self, name):
+        key = name.strip().lower()
+        if key not in self.categories:
+            if not self.create_missing:
+                raise ValueError(f'unknown category "{name}"')
+            self.categories[key] = Category.objects.create(name=name.strip(), description=name.strip()).id
+        return self.categories[key]
+
+    def _subcategory_id(self, category_id, name):
+        key = (category_id, name.strip().lower())
+        if key not in self.subcategories:
+            if not self.create_missing:
+                raise ValueError(f'unknown subcategory "{name}"')
+            self.subcategories[key] = SubCategory.objects.create(
+                name=name.strip(), category_id=category_id, description=name.strip()
+            ).id
+        return self.subcategories[key]
+
+    def _text(self, row, column):
+        value = (row.get(column) or '').strip()
+        if not value:
+            raise ValueError(f'{column} is required')
+        # bulk_create does not validate, a long value fails the whole chunk on MySQL
+        max_length = Product._meta.get_field(column).max_length
+        if len(value) > max_length:
+            raise ValueError(f'{column} is longer than {max_length} characters')
+        return value
+
+    def _number(self, row, column):
+        value = float(row[column])
+        if not math.isfinite(value) or value < 0:
+            raise ValueError(f'{column} must be a non-negative number, got "{row[column]}"')
+        return value
+
+    def _product(self, row):
+        sku = self._text(row, 'sku')
+        name = self._text(row, 'name')
+        original_price = self._number(row, 'original_price')
+        selling_price = self._number(row, 'selling_price')
+        quantity = int(self._number(row, 'quantity'))
+        if self.max_quantity is not None and quantity > self.max_quantity:
+            raise ValueError(f'quantity is too large, got "{row["quantity"]}"')
+
+        category_id = self._category_id(row['category'])
+        return Product(
+            sku=sku,
+            name=name,
+            category_id=category_id,
+            subcategory_id=self._subcategory_id(category_id, row['subcategory']),
+            description=row.get('description') or '',
+            quantity=quantity,
+            original_price=original_price,
+            selling_price=selling_price,
+            discount_percent=get_discount_percent(original_price, selling_price),
+            status=str(row.get('status', '')).strip().lower() in TRUE_VALUES,
+            is_exclusive=str(row.get('is_exclusive', '')).strip().lower() in TRUE_VALUES,
+        )
+
+    def _error(self, line, message):
+        self.stats['errors'] += 1
+        if len(self.errors) < CATALOG_IMPORT_MAX_ERRORS:
+            self.errors.append(f'line {line}: {message}')
+
+    def _upsert(self, products):
+        # later rows of the same sku win
+        products = list({product.sku: product for product in products}.values())
+        skus = [product.sku for product in products]
+
+        with transaction.atomic():
+            # the rows are locked in id order - no reservation is taken or released while the quantities are set
+            existing = list(Product.objects.select_for_update().filter(sku__in=skus).order_by('id').values_list(
+                'sku', 'id', 'category_id', 'subcategory_id'
+            ))
+            old_subcategories = {(category_id, subcategory_id) for _, _, category_id, subcategory_id in existing}
+
+            # the imported quantity is the stock on hand, the units held by open reservations are given back
+            # to the product when the reservation is released
+            reserved = dict(StockReservation.objects.filter(
+                product_id__in=[product_id for _, product_id, _, _ in existing], status=RESERVED
+            ).values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total'))
+            product_ids_by_sku = {sku: product_id for sku, product_id, _, _ in existing}
+            for product in products:
+                held = reserved.get(product_ids_by_sku.get(product.sku), 0)
+                product.quantity = max(product.quantity - held, 0)
+
+            Product.objects.bulk_create(products, **upsert_options(['sku'], UPSERT_FIELDS))
+            changed = list(Product.objects.filter(sku__in=skus).values_list('id', 'category_id', 'subcategory_id'))
+
+            # bulk_create sends no model signals - the caches of the chunk are dropped here
+            product_ids = [product_id for product_id, _, _ in changed]
+            invalidate_facets(old_subcategories | {(category_id, subcategory_id) for _, category_id, subcategory_id in changed})
+            transaction.on_commit(lambda: invalidate_product_fragments(product_ids))
+            product_changed(product_ids)
+
+        self.stats['upserted'] += len(products)
+
+    def run(self, rows):
+        """
+        @param rows: iterable of dicts with the CATALOG_COLUMNS
+        @return stats:
+        """
+        numbered = enumerate(rows, start=2)  # line 1 is the header
+        while True:
+            chunk = list(itertools.islice(numbered, self.chunk_size))
+            if not chunk:
+                break
+
+            products = []
+            for line, row in chunk:
+                self.stats['rows'] += 1
+                try:
+                    products.append(self._product(row))
+                except (KeyError, TypeError, ValueError, OverflowError) as e:
+                    self._error(line, e)
+
+            if products:
+                self._upsert(products)
+
+        # once per import instead of once per product like the model signals
+        reconcile_product_counters()
+        refresh_home_catalog()
+        return self.stats
+
+
+def import_catalog(file, file_name, create_missing=False, chunk_size=CATALOG_IMPORT_CHUNK_SIZE):
+    """
+    Import a csv or xlsx catalog file
+    @param file: binary file object
+    @param file_name:
+    @param create_missing: create the unknown categories and subcategories instead of rejecting the rows
+    @param chunk_size: rows per upsert
+    @return stats, errors:
+    """
+    importer = CatalogImporter(create_missing=create_missing, chunk_size=chunk_size)
+    stats = importer.run(catalog_rows(file, file_name))
+    logger.info(f'Catalog {file_name} imported - {stats}')
+    return stats, importer.errors
+
+
+def catalog_export_rows(queryset=None):
+    """
+    Catalog rows in the import format, read in chunks with iterator()
+    @param queryset: products to export, all by default
+    @return generator of tuples, the header first:
+    """
+    if queryset is None:
+        queryset = Product.objects.all()
+
+    yield CATALOG_COLUMNS
+    rows = queryset.order_by('id').values_list(
+        'sku', 'name', 'category__name', 'subcategory__name', 'description', 'quantity',
+        'original_price', 'selling_price', 'status', 'is_exclusive',
+    ).iterator(chunk_size=CATALOG_EXPORT_CHUNK_SIZE)
+
+    for row in rows:
+        yield row[:8] + tuple(int(flag) for flag in row[8:])
@@ -0,0 +1,66 @@
+from collections import Counter
+from django.db.models import F, Count
+
+# models
+from shop.models import (
+    Category,
+    SubCategory,
+    Product
+)
+
+
+def product_counter_state(product):
+    """
+    The fields of a product the active product counters depend on
+    @param product:
+    @return tuple:
+    """
+    return product.status, product.category_id, product.subcategory_id
+
+
+def apply_product_counter_change(old_state, new_state):
+    """
+    Move the active product counters from the old product state to the new one
+    @param old_state: (status, category_id, subcategory_id) or None for a new product
+    @param new_state: (status, category_id, subcategory_id) or None for a deleted product
+    @return:
+    """
+    category_deltas = Counter()
+    subcategory_deltas = Counter()
+
+    if old_state and old_state[0]:
+        category_deltas[old_state[1]] -= 1
+        subcategory_deltas[old_state[2]] -= 1
+
+    if new_state and new_state[0]:
+        category_deltas[new_state[1]] += 1
+        subcategory_deltas[new_state[2]] += 1
+
+    for model, deltas in ((Category, category_deltas), (SubCategory, subcategory_deltas)):
+        for pk, delta in deltas.items():
+            if delta:
+                model.objects.filter(pk=pk).update(active_product_count=F('active_product_count') + delta)
+
+
+def reconcile_product_counters():
+    """
+    Recount the active products and fix the counters that drifted
+    @return number of categories and subcategories fixed:
+    """
+    fixed = {}
+    for model, field in ((Category, 'category_id'), (SubCategory, 'subcategory_id')):
+        counts = dict(
+            Product.objects.active_products().values_list(field).annotate(count=Count('id')).order_by()
+        )
+
+        drifted = []
+        for instance in model.objects.only('id', 'active_product_count').iterator(chunk_size=2000):
+            count = counts.get(instance.id, 0)
+            if instance.active_product_count != count:
+                instance.active_product_count = count
+                drifted.append(instance)
+
+        model.objects.bulk_update(drifted, ['active_product_count'], batch_size=500)
+        fixed[model.__name__] = len(drifted)
+
+    return fixed
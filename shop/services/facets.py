@@ -0,0 +1,195 @@
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+import logging
+
+# models
+from shop.models import Product
+
+# constant helper
+from utils.constants import *
+
+logger = logging.getLogger('django')
+
+# price buckets - key -> [low, high)
+PRICE_BUCKETS = (
+    ('0-500', 0, 500),
+    ('500-1000', 500, 1000),
+    ('1000-2000', 1000, 2000),
+    ('2000-5000', 2000, 5000),
+    ('5000+', 5000, None),
+)
+
+# discount buckets - key -> minimum discount percent, a product is in every bucket up to its discount
+DISCOUNT_BUCKETS = (
+    ('10', 10),
+    ('20', 20),
+    ('30', 30),
+    ('40', 40),
+    ('50', 50),
+)
+
+FLAG_FACETS = ('exclusive', 'trending')
+
+SORT_ORDERS = ('newest', 'price_asc', 'price_desc', 'discount')
+
+
+def facets_key(category_id, subcategory_id):
+    return f'shop:facets:{category_id}:{subcategory_id}'
+
+
+def facet_products(category_id, subcategory_id):
+    """
+    Active products of a subcategory, newest first as the facet index keeps them - product_listing_idx
+    @param category_id:
+    @param subcategory_id:
+    @return queryset:
+    """
+    return Product.objects.active_products().filter(
+        category_id=category_id, subcategory_id=subcategory_id
+    ).order_by('-created_at', '-id')
+
+
+class FacetIndex:
+    """
+    Facets of the active products of a subcategory as column arrays.
+    Every facet value is a bitmap over the products - filters are bitmap intersections,
+    counts are popcounts of the intersections
+    """
+
+    def __init__(self, ids, prices, discounts, exclusive, trending):
+        """
+        @param ids: product ids in the newest first order
+        @param prices: selling prices
+        @param discounts: discount percents
+        @param exclusive: flags
+        @param trending: flags
+        """
+        self.ids = np.asarray(ids, dtype=np.uint32)
+        prices = np.asarray(prices, dtype=np.float32)
+        discounts = np.asarray(discounts, dtype=np.float32)
+
+        masks = {
+            'price': {
+                key: (prices >= low) & (prices < high if high is not None else True)
+                for key, low, high in PRICE_BUCKETS
+            },
+            'discount': {key: discounts >= minimum for key, minimum in DISCOUNT_BUCKETS},
+            'exclusive': {'1': np.asarray(exclusive, dtype=bool)},
+            'trending': {'1': np.asarray(trending, dtype=bool)},
+        }
+        # bitmaps - one bit per product in the cache
+        self.bitmaps = {
+            group: {key: np.packbits(mask) for key, mask in values.items()}
+            for group, values in masks.items()
+        }
+
+        # positions of the products in every sort order, stable so equal values stay newest first
+        self.orders = {
+            'newest': np.arange(len(self.ids), dtype=np.uint32),
+            'price_asc': np.argsort(prices, kind='stable').astype(np.uint32),
+            'price_desc': np.argsort(-prices, kind='stable').astype(np.uint32),
+            'discount': np.argsort(-discounts, kind='stable').astype(np.uint32),
+        }
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, category_id, subcategory_id):
+        rows = list(facet_products(category_id, subcategory_id).values_list(
+            'id', 'selling_price', 'discount_percent', 'is_exclusive', 'trending'
+        ))
+
+        # the stored discount, the same value the discount sort of the listings reads
+        return cls(
+            [row[0] for row in rows],
+            [row[1] for row in rows],
+            [row[2] for row in rows],
+            [row[3] for row in rows],
+            [row[4] for row in rows],
+        )
+
+    def _masks(self):
+        return {
+            group: {key: np.unpackbits(bitmap, count=len(self.ids)).view(bool) for key, bitmap in values.items()}
+            for group, values in self.bitmaps.items()
+        }
+
+    def query(self, filters, sort='newest', offset=0, limit=PRODUCTS_LIMIT_PER_PAGE):
+        """
+        Filter, count and page the products
+        @param filters: dict of facet group -> selected values, groups are AND-ed
+        @param sort: one of SORT_ORDERS
+        @param offset:
+        @param limit:
+        @return (counts, total, product ids of the page):
+        """
+        masks = self._masks()
+        everything = np.ones(len(self.ids), dtype=bool)
+
+        # values of a group are OR-ed, an unknown value matches nothing
+        group_masks = {}
+        for group, keys in filters.items():
+            if keys and group in masks:
+                group_masks[group] = np.zeros(len(self.ids), dtype=bool)
+                for key in keys:
+                    if key in masks[group]:
+                        group_masks[group] |= masks[group][key]
+
+        # the count of a value is the result size when it is selected on top of the other groups' filters
+        counts = {}
+        for group, values in masks.items():
+            others = everything.copy()
+            for other_group, mask in group_masks.items():
+                if other_group != group:
+                    others &= mask
+            counts[group] = {key: int(np.count_nonzero(others & mask)) for key, mask in values.items()}
+
+        selected = everything
+        for mask in group_masks.values():
+            selected = selected & mask
+
+        order = self.orders.get(sort, self.orders['newest'])
+        positions = order[selected[order]]
+        return counts, len(positions), self.ids[positions[offset:offset + limit]].tolist()
+
+
+def get_facet_index(category_id, subcategory_id):
+    """
+    Facet index of a subcategory from the shared cache, built on a cold cache
+    @param category_id:
+    @param subcategory_id:
+    @return FacetIndex:
+    """
+    key = facets_key(category_id, subcategory_id)
+    index = cache.get(key)
+    if index is None:
+        index = FacetIndex.build(category_id, subcategory_id)
+        cache.set(key, index, FACETS_CACHE_TIMEOUT)
+    return index
+
+
+def parse_facet_filters(params):
+    """
+    Selected facet values from the query string - ?price=0-500&price=500-1000&discount=20&exclusive=1
+    @param params: QueryDict
+    @return dict of facet group -> list of values:
+    """
+    filters = {'price': params.getlist('price')}
+    if params.get('discount'):
+        filters['discount'] = [params.get('discount')]
+    for flag in FLAG_FACETS:
+        if params.get(flag):
+            filters[flag] = ['1']
+    return filters
+
+
+def invalidate_facets(subcategories):
+    """
+    Drop the facet indexes of the subcategories once the change is committed
+    @param subcategories: iterable of (category_id, subcategory_id)
+    @return:
+    """
+    keys = [facets_key(category_id, subcategory_id) for category_id, subcategory_id in set(subcategories)]
+    transaction.on_commit(lambda: cache.delete_many(keys))
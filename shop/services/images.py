@@ -0,0 +1,198 @@
+from io import BytesIO
+import os
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.db import transaction
+from PIL import Image, ImageOps
+import logging
+
+# models
+from shop.models import (
+    Category,
+    SubCategory,
+    Product
+)
+from shop.services.catalog import refresh_home_catalog
+from shop.services.product_cache import invalidate_product_fragments
+from utils.storage import is_content_addressed
+
+# constant helper
+from utils.constants import *
+
+logger = logging.getLogger('django')
+
+# model -> image field with derivatives
+IMAGE_FIELDS = {
+    Category: 'image',
+    SubCategory: 'image',
+    Product: 'product_image',
+}
+
+# variant format -> (Pillow format, file extension)
+VARIANT_FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+}
+
+
+def _refresh_home_catalog():
+    try:
+        refresh_home_catalog()
+    except Exception as e:
+        logger.error(f"Home catalog snapshot not rebuilt - {e}")
+
+
+def model_label(model):
+    return model._meta.label_lower
+
+
+def image_model(label):
+    return apps.get_model(label)
+
+
+def derivative_name(source_name, width, extension):
+    """
+    Requested name of a variant, the storage names the file by its content hash
+    uploads/3f/3f9a...c1.png -> uploads/derivatives/3f9a...c1-320w.webp
+    @param source_name:
+    @param width:
+    @param extension:
+    @return str:
+    """
+    stem = os.path.splitext(os.path.basename(source_name))[0]
+    return f'{IMAGE_DERIVATIVE_DIR}/{stem}-{width}w.{extension}'
+
+
+def _encode(image, variant):
+    pillow_format, _ = VARIANT_FORMATS[variant]
+    buffer = BytesIO()
+    if pillow_format == 'JPEG':
+        # jpeg has no alpha channel
+        image.convert('RGB').save(buffer, pillow_format, quality=IMAGE_DERIVATIVE_QUALITY, optimize=True,
+                                  progressive=True)
+    else:
+        image.save(buffer, pillow_format, quality=IMAGE_DERIVATIVE_QUALITY, method=4)
+    return buffer.getvalue()
+
+
+def build_image_variants(image_file, widths=IMAGE_DERIVATIVE_WIDTHS):
+    """
+    Resize the image to every width smaller than the original and store jpeg and webp copies
+    @param image_file: FieldFile of the original image
+    @param widths:
+    @return dict - {'source': name, 'webp': {width: name}, 'jpeg': {width: name}}:
+    """
+    storage = image_file.storage
+    with storage.open(image_file.name, 'rb') as source:
+        original = ImageOps.exif_transpose(Image.open(source))
+        original.load()
+
+    if original.mode not in ('RGB', 'RGBA'):
+        has_alpha = original.mode in ('LA', 'PA') or 'transparency' in original.info
+        original = original.convert('RGBA' if has_alpha else 'RGB')
+
+    # never upscale, an image narrower than the smallest width gets one variant of its own width
+    target_widths = sorted({min(width, original.width) for width in widths})
+
+    variants = {'source': image_file.name}
+    for variant, (_, extension) in VARIANT_FORMATS.items():
+        variants[variant] = {}
+        for width in target_widths:
+            resized = original.copy()
+            resized.thumbnail((width, original.height), Image.LANCZOS)
+
+            name = derivative_name(image_file.name, width, extension)
+            variants[variant][str(width)] = storage.save(name, ContentFile(_encode(resized, variant)))
+
+    return variants
+
+
+def variants_outdated(instance):
+    """
+    True when the image was changed after its variants were built
+    @param instance: Category, SubCategory or Product
+    @return bool:
+    """
+    image = getattr(instance, IMAGE_FIELDS[type(instance)])
+    return (image.name or None) != (instance.image_variants or {}).get('source')
+
+
+def generate_image_variants(label, pk, force=False, notify=True):
+    """
+    Build and store the image variants of a category, subcategory or product
+    @param label: model label - shop.product
+    @param pk:
+    @param force: rebuild even when the variants are up-to-date
+    @param notify: drop the cached pages showing the image, the backfill does it once at the end
+    @return bool - variants built:
+    """
+    model = image_model(label)
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None or not (force or variants_outdated(instance)):
+        return False
+
+    image = getattr(instance, IMAGE_FIELDS[model])
+    variants = build_image_variants(image) if image else {}
+
+    # update() keeps updated_at and the save signals out of it, the image itself did not change
+    with transaction.atomic():
+        updated = model.objects.filter(pk=pk, **{IMAGE_FIELDS[model]: image.name}).update(image_variants=variants)
+
+        if updated and notify:
+            transaction.on_commit(_refresh_home_catalog)
+            if model is Product:
+                transaction.on_commit(lambda: invalidate_product_fragments([pk]))
+
+    return bool(updated)
+
+
+def queue_image_variants(instance):
+    """
+    Build the variants in the background once the upload is committed
+    @param instance: Category, SubCategory or Product
+    @return:
+    """
+    if not variants_outdated(instance):
+        return
+
+    from shop.celery.tasks import generate_image_variants as generate_image_variants_task
+    label, pk = model_label(type(instance)), instance.pk
+    transaction.on_commit(lambda: generate_image_variants_task.delay(label, pk))
+
+
+def _move_to_content_addressed(storage, name):
+    with storage.open(name, 'rb') as content:
+        return storage.save(name, content)
+
+
+def move_image_to_content_addressed(instance):
+    """
+    Store an image saved under its upload time name again under its content hash, with its variants
+    @param instance: Category, SubCategory or Product
+    @return list of the old file names, empty when nothing was moved:
+    """
+    model = type(instance)
+    field = IMAGE_FIELDS[model]
+    image = getattr(instance, field)
+    if not image or is_content_addressed(image.name):
+        return []
+
+    storage = image.storage
+    old_names = [image.name]
+    new_name = _move_to_content_addressed(storage, image.name)
+
+    variants = instance.image_variants or {}
+    if variants.get('source') == image.name:
+        moved = {'source': new_name}
+        for variant in VARIANT_FORMATS:
+            moved[variant] = {}
+            for width, name in variants.get(variant, {}).items():
+                moved[variant][width] = name if is_content_addressed(name) else _move_to_content_addressed(storage, name)
+                if moved[variant][width] != name:
+                    old_names.append(name)
+        variants = moved
+
+    updated = model.objects.filter(pk=instance.pk, **{field: image.name}).update(
+        **{field: new_name, 'image_variants': variants}
+    )
+    return old_names if updated else []
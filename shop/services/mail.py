@@ -0,0 +1,154 @@
+import os
+import time
+from django.core.mail import EmailMessage, get_connection
+import logging
+
+# models
+from shop.models import Order, OrderItem
+from shop.services.mail_templates import get_mail_template, table_rows
+
+# constant helper
+from utils.constants import *
+from utils.helper import get_redis
+
+logger = logging.getLogger('django')
+
+
+def queue_order_mail(order_id):
+    """
+    Queue the order confirmation mail, only the order id travels - the mail is rendered by the worker
+    @param order_id:
+    @return:
+    """
+    get_redis().rpush(ORDER_MAIL_QUEUE_KEY, order_id)
+
+
+def order_mail(order, order_items):
+    """
+    @param order: with the user selected
+    @param order_items: with the products selected
+    @return EmailMessage:
+    """
+    body = get_mail_template('shop/mail/order_placed.html').render(
+        user_name=order.user.username,
+        order_number=order.order_number,
+        order_lines=table_rows([
+            (order_item.product.name, order_item.quantity, order_item.amount) for order_item in order_items
+        ]),
+        order_amount=order.amount
+    )
+    email = EmailMessage(
+        'Majestic - Ecommerce site',
+        body,
+        os.getenv('SITE_EMAIL_ADDRESS'),
+        [order.user.email]
+    )
+    email.content_subtype = 'html'
+    return email
+
+
+def build_order_mails(order_ids):
+    """
+    Order mails of a batch with two queries - orders with users, items with products
+    @param order_ids:
+    @return dict of order id -> EmailMessage, deleted orders are left out:
+    """
+    orders = Order.objects.select_related('user').in_bulk(order_ids)
+    order_items = {}
+    for order_item in OrderItem.objects.filter(order_id__in=list(orders)).select_related('product'):
+        order_items.setdefault(order_item.order_id, []).append(order_item)
+
+    return {order.id: order_mail(order, order_items.get(order.id, [])) for order in orders.values()}
+
+
+def _acknowledge(redis, order_id):
+    # the mail is done with - sent, given up on or its order is gone
+    redis.pipeline().lrem(ORDER_MAIL_PROCESSING_KEY, 1, order_id).hdel(ORDER_MAIL_ATTEMPTS_KEY, order_id).execute()
+
+
+def _retry(redis, order_id):
+    attempts = redis.hincrby(ORDER_MAIL_ATTEMPTS_KEY, order_id, 1)
+    if attempts >= ORDER_MAIL_MAX_ATTEMPTS:
+        logger.critical(f'Order {order_id} email dropped after {attempts} attempts')
+        _acknowledge(redis, order_id)
+        return
+
+    pipeline = redis.pipeline()
+    pipeline.lrem(ORDER_MAIL_PROCESSING_KEY, 1, order_id)
+    pipeline.rpush(ORDER_MAIL_QUEUE_KEY, order_id)
+    pipeline.execute()
+
+
+def _take_batch(redis, batch_size):
+    # LMOVE keeps every taken id in the processing list until its mail is acknowledged
+    pipeline = redis.pipeline()
+    for _ in range(batch_size):
+        pipeline.lmove(ORDER_MAIL_QUEUE_KEY, ORDER_MAIL_PROCESSING_KEY, 'LEFT', 'RIGHT')
+    return [order_id for order_id in pipeline.execute() if order_id is not None]
+
+
+def drain_order_mail_queue(batch_size=ORDER_MAIL_BATCH_SIZE, rate_per_second=ORDER_MAIL_RATE_PER_SECOND,
+                           max_batches=None):
+    """
+    Send the queued order mails batch by batch over one SMTP connection, at most rate_per_second mails.
+    One drainer runs at a time - overlapping runs return at once, the rate limit holds across runs
+    @param batch_size:
+    @param rate_per_second:
+    @param max_batches: stop after this many batches, None to empty the queue
+    @return number of mails sent:
+    """
+    redis = get_redis()
+    lock = redis.lock(ORDER_MAIL_LOCK_KEY, timeout=ORDER_MAIL_LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        return 0
+
+    interval = 1 / rate_per_second if rate_per_second else 0
+    sent = 0
+    batches = 0
+
+    connection = get_connection(fail_silently=False)
+    try:
+        # ids left in processing by a drainer that crashed are queued again
+        while redis.lmove(ORDER_MAIL_PROCESSING_KEY, ORDER_MAIL_QUEUE_KEY, 'RIGHT', 'LEFT'):
+            pass
+
+        connection.open()
+        while max_batches is None or batches < max_batches:
+            order_ids = _take_batch(redis, batch_size)
+            if not order_ids:
+                break
+            batches += 1
+
+            mails = build_order_mails([int(order_id) for order_id in order_ids])
+            for order_id in order_ids:
+                email = mails.get(int(order_id))
+                if email is None:
+                    _acknowledge(redis, order_id)
+                    continue
+
+                started = time.monotonic()
+                try:
+                    sent += connection.send_messages([email])
+                    _acknowledge(redis, order_id)
+                except Exception as e:
+                    logger.critical(f'Order email not sent to {email.to} - {e}')
+                    _retry(redis, order_id)
+                    # the connection may be broken after a failure
+                    connection.close()
+                    connection.open()
+
+                # rate limit - spread the mails over time instead of bursting the SMTP server
+                wait = interval - (time.monotonic() - started)
+                if wait > 0:
+                    time.sleep(wait)
+
+                # a long drain keeps the lock, the next beat run skips instead of sending in parallel
+                lock.extend(ORDER_MAIL_LOCK_TIMEOUT, replace_ttl=True)
+    finally:
+        connection.close()
+        try:
+            lock.release()
+        except Exception as e:
+            logger.warning(f'Order mail lock already expired - {e}')
+
+    return sent
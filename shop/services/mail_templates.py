@@ -0,0 +1,56 @@
+from functools import lru_cache
+import re
+from django.template.loader import get_template
+from django.utils.html import conditional_escape, format_html
+
+# per recipient fields of the mail templates, rendered as %%field%% in the cached shell
+MAIL_TEMPLATE_FIELDS = {
+    'shop/mail/order_placed.html': ('user_name', 'order_number', 'order_lines', 'order_amount'),
+    'shop/mail/cart_abundance_mail.html': ('user_name', 'cart_lines'),
+}
+
+FIELD_PATTERN = re.compile(r'%%(\w+)%%')
+
+
+class CompiledMailTemplate:
+    """
+    Mail template rendered once, only the per recipient fields are substituted for every mail
+    """
+
+    def __init__(self, template_name):
+        fields = MAIL_TEMPLATE_FIELDS[template_name]
+        shell = get_template(template_name).render({field: f'%%{field}%%' for field in fields})
+        # literal, field, literal, field, ..., literal
+        self.parts = FIELD_PATTERN.split(shell)
+
+    def render(self, **values):
+        parts = self.parts[:]
+        for position in range(1, len(parts), 2):
+            parts[position] = conditional_escape(values.get(parts[position], ''))
+        return ''.join(parts)
+
+
+# compiled once per worker process
+@lru_cache(maxsize=None)
+def get_mail_template(template_name):
+    return CompiledMailTemplate(template_name)
+
+
+def table_rows(rows):
+    """
+    Escaped <tr> rows for the order lines
+    @param rows: list of tuples
+    @return safe html:
+    """
+    return format_html(''.join(
+        '<tr>' + ''.join('<td>{}</td>' for _ in row) + '</tr>' for row in rows
+    ), *[value for row in rows for value in row])
+
+
+def list_items(items):
+    """
+    Escaped <li> items for the cart lines
+    @param items: list of strings
+    @return safe html:
+    """
+    return format_html(''.join('<li>{}</li>' for _ in items), *items)
@@ -0,0 +1,37 @@
+from django.utils import timezone
+import logging
+
+# models
+from shop.models import OrderItem
+
+# constant helper
+from utils.constants import *
+
+logger = logging.getLogger('django')
+
+ORDER_EXPORT_COLUMNS = (
+    'order_number', 'ordered_date', 'email', 'payment_type', 'payment_status', 'order_status', 'order_amount',
+    'street_name', 'city', 'district', 'state', 'pincode', 'sku', 'product', 'quantity', 'amount',
+)
+
+
+def order_export_rows(queryset=None):
+    """
+    One row per order item with the order columns repeated, read in chunks with iterator()
+    @param queryset: orders to export, all by default
+    @return generator of tuples, the header first:
+    """
+    items = OrderItem.objects.all()
+    if queryset is not None:
+        items = items.filter(order__in=queryset.values('id'))
+
+    yield ORDER_EXPORT_COLUMNS
+    rows = items.order_by('order_id', 'id').values_list(
+        'order__order_number', 'order__ordered_date', 'order__user__email', 'order__payment_type',
+        'order__payment_status', 'order__order_status', 'order__amount', 'order__street_name', 'order__city',
+        'order__district', 'order__state', 'order__pincode', 'product__sku', 'product__name', 'quantity', 'amount',
+    ).iterator(chunk_size=ORDER_EXPORT_CHUNK_SIZE)
+
+    for row in rows:
+        # naive local time - spreadsheets have no timezones
+        yield (str(row[0]), timezone.localtime(row[1]).replace(tzinfo=None)) + row[2:]
@@ -0,0 +1,27 @@
+import logging
+
+# models
+from shop.models import Order
+
+logger = logging.getLogger('django')
+
+# newest first, unique for the cursor pagination - a backward scan of order_user_ordered_idx
+ORDER_LIST_ORDERING = ('-ordered_date', '-id')
+
+
+def user_orders(user):
+    """
+    Orders of the user with their items and products, as the order list shows them
+    @param user:
+    @return queryset:
+    """
+    return Order.objects.filter(user=user).prefetch_related('orderitem_set__product')
+
+
+def provider_orders(provider_order_id):
+    """
+    Orders of a razorpay order id - order_provider_order_idx
+    @param provider_order_id:
+    @return queryset:
+    """
+    return Order.objects.filter(provider_order_id=provider_order_id)
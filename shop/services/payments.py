@@ -0,0 +1,113 @@
+from django.db import transaction
+import logging
+
+# models
+from shop.models import Order
+from shop.services.orders import provider_orders
+from shop.services.reconciliation import apply_gateway_statuses, fetch_gateway_status
+from shop.services.rollups import record_order_sales
+from shop.services.stock import OutOfStockError, commit_reservations, release_reservations
+
+# constant helper
+from utils.constants import *
+from utils.helper import razorpay_login, getRazorPayAmount
+
+logger = logging.getLogger('django')
+
+
+def _payment_status(provider_order_id):
+    return provider_orders(provider_order_id).values_list('payment_status', flat=True).first()
+
+
+def create_gateway_order(order):
+    """
+    Razorpay order for an order whose stock is already reserved. A gateway failure gives the stock back
+    and cancels the order before the error is raised
+    @param order:
+    @return razorpay order id:
+    """
+    try:
+        razor_pay_order = razorpay_login().order.create({
+            "amount": getRazorPayAmount(order.amount),
+            "currency": INR,
+            "payment_capture": "0"
+        })
+    except Exception:
+        with transaction.atomic():
+            release_reservations(order)
+            Order.objects.filter(pk=order.pk).update(payment_status=ERROR, order_status=CANCELLED)
+        raise
+
+    order.provider_order_id = razor_pay_order['id']
+    Order.objects.filter(pk=order.pk).update(provider_order_id=order.provider_order_id)
+    return order.provider_order_id
+
+
+def complete_payment(provider_order_id, payment_id, signature_id):
+    """
+    Mark the order paid. Safe to call again for the same payment - razorpay retries and duplicate
+    callbacks find the order completed and change nothing.
+    A payment arriving after the reservation expired takes the stock again, the order is flagged
+    for refund when the stock is gone
+    @param provider_order_id:
+    @param payment_id:
+    @param signature_id:
+    @return payment status of the order, None for an unknown order:
+    """
+    with transaction.atomic():
+        # the row lock is the state transition, a concurrent callback waits and then finds the order settled
+        order = provider_orders(provider_order_id).select_for_update().filter(
+            payment_status__in=[PENDING, ERROR]
+        ).only('id').first()
+
+        if order is None:
+            return _payment_status(provider_order_id)
+
+        try:
+            commit_reservations(order)
+        except OutOfStockError as e:
+            logger.warning(f'Order {order.id} paid after its stock was sold, flagged for refund - {e}')
+            release_reservations(order)
+            Order.objects.filter(pk=order.pk).update(
+                payment_status=REFUND,
+                order_status=CANCELLED,
+                payment_id=payment_id,
+                signature_id=signature_id
+            )
+            return REFUND
+
+        Order.objects.filter(pk=order.pk).update(
+            payment_status=COMPLETED,
+            order_status=IN_PROGRES,
+            payment_id=payment_id,
+            signature_id=signature_id
+        )
+        record_order_sales([order.id])
+
+        # cart clearing and mail run in the worker once the payment is stored
+        from shop.celery.tasks import complete_order_purchase
+        transaction.on_commit(lambda: complete_order_purchase.delay(order.id))
+
+    return COMPLETED
+
+
+def settle_payment_from_gateway(provider_order_id):
+    """
+    Settle a pending order from the payments razorpay has for it - for unsigned reports like the
+    checkout failure callback, which anyone can post for any order
+    @param provider_order_id:
+    @return payment status of the order, None for an unknown order:
+    """
+    order = provider_orders(provider_order_id).filter(
+        payment_status=PENDING
+    ).values('id', 'provider_order_id', 'created_at').first()
+    if order is None:
+        return _payment_status(provider_order_id)
+
+    # a failed attempt can still be retried on the same razorpay order - the order stays pending until
+    # the gateway reports it completed or failed for good
+    status, payment_id = fetch_gateway_status(order)
+    if status is not None:
+        apply_gateway_statuses({order['id']: (status, payment_id)})
+
+    return _payment_status(provider_order_id)
@@ -0,0 +1,116 @@
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+import logging
+
+# models
+from shop.models import Product
+
+# constant helper
+from utils.constants import *
+
+logger = logging.getLogger('django')
+
+
+# the version key holds the product updated_at, the fragment is stored under id + version
+def product_version_key(product_id):
+    return f'shop:product_page:{product_id}:version'
+
+
+def product_fragment_key(product_id, version):
+    return f'shop:product_page:{product_id}:{version}'
+
+
+def product_availability_key(product_id):
+    return f'shop:product_availability:{product_id}'
+
+
+def _count(key):
+    try:
+        cache.add(key, 0, None)
+        cache.incr(key)
+    except Exception as e:
+        logger.warning(f"Product page cache statistics not updated - {e}")
+
+
+def product_with_category(product_id):
+    """
+    The product page product with its category, in one query
+    @param product_id:
+    @return queryset:
+    """
+    return Product.objects.select_related('category').filter(pk=product_id)
+
+
+def get_product_fragment(product_id):
+    """
+    Rendered product details fragment, from the cache when the product did not change
+    @param product_id:
+    @return html:
+    """
+    version = cache.get(product_version_key(product_id))
+    if version is not None:
+        fragment = cache.get(product_fragment_key(product_id, version))
+        if fragment is not None:
+            _count(PRODUCT_PAGE_CACHE_HITS_KEY)
+            return mark_safe(fragment)
+
+    _count(PRODUCT_PAGE_CACHE_MISSES_KEY)
+
+    # raises Product.DoesNotExist for the view
+    product = product_with_category(product_id).get()
+    fragment = render_to_string('shop/products/product_detail.html', {
+        'product': product,
+        'category': product.category
+    })
+
+    version = product.updated_at.timestamp()
+    cache.set_many({
+        product_version_key(product_id): version,
+        product_fragment_key(product_id, version): str(fragment),
+    }, PRODUCT_PAGE_CACHE_TIMEOUT)
+
+    return mark_safe(fragment)
+
+
+def get_product_availability(product_id):
+    """
+    Status and stock of the product for the cart, from the cache
+    @param product_id:
+    @return dict or None when the product does not exist:
+    """
+    availability = cache.get(product_availability_key(product_id))
+    if availability is None:
+        availability = Product.objects.filter(pk=product_id).values('status', 'quantity').first() or {}
+        cache.set(product_availability_key(product_id), availability, PRODUCT_PAGE_CACHE_TIMEOUT)
+
+    return availability or None
+
+
+def invalidate_product_fragments(product_ids):
+    """
+    Drop the cached fragments and availability of the products, next view loads them again
+    @param product_ids:
+    @return:
+    """
+    keys = []
+    for product_id in product_ids:
+        keys += [product_version_key(product_id), product_availability_key(product_id)]
+    cache.delete_many(keys)
+
+
+def product_cache_stats():
+    """
+    Hit/miss statistics of the product page cache
+    @return dict:
+    """
+    counts = cache.get_many([PRODUCT_PAGE_CACHE_HITS_KEY, PRODUCT_PAGE_CACHE_MISSES_KEY])
+    hits = counts.get(PRODUCT_PAGE_CACHE_HITS_KEY, 0)
+    misses = counts.get(PRODUCT_PAGE_CACHE_MISSES_KEY, 0)
+    total = hits + misses
+
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / total if total else 0.0,
+    }
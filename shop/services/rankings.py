@@ -0,0 +1,206 @@
+import itertools
+from datetime import timedelta
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+import logging
+
+# models
+from shop.models import (
+    SubCategory,
+    Product,
+    Cart,
+    OrderItem,
+    ProductDailySales
+)
+from shop.services.catalog import refresh_home_catalog
+from shop.services.facets import invalidate_facets
+from shop.services.product_cache import invalidate_product_fragments
+from shop.services.rollups import sold_orders_filter
+
+# constant helper
+from utils.constants import *
+
+logger = logging.getLogger('django')
+
+
+class DecayedScores:
+    """
+    Per product scores where every event counts its weight halved per half-life of age.
+    Scores are dense float arrays indexed by product id - a chunk is added with one bincount per ranking
+    """
+
+    def __init__(self, now, half_lives):
+        """
+        @param now: epoch seconds the ages are measured from
+        @param half_lives: dict of ranking name -> half-life in seconds
+        """
+        self.now = now
+        self.half_lives = half_lives
+        self.scores = {name: np.zeros(0) for name in half_lives}
+        self.events = 0
+
+    def add(self, product_ids, weights, timestamps, rankings=None):
+        """
+        @param product_ids: array of product ids
+        @param weights: array of event weights - units ordered, units carted
+        @param timestamps: array of event epoch seconds
+        @param rankings: names of the rankings the events count for, all by default
+        @return:
+        """
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        if not len(product_ids):
+            return
+
+        weights = np.asarray(weights, dtype=np.float64)
+        ages = self.now - np.asarray(timestamps, dtype=np.float64)
+        for name in rankings or self.half_lives:
+            chunk = np.bincount(product_ids, weights=weights * np.exp2(-ages / self.half_lives[name]))
+            if len(chunk) > len(self.scores[name]):
+                self.scores[name] = np.pad(self.scores[name], (0, len(chunk) - len(self.scores[name])))
+            self.scores[name][:len(chunk)] += chunk
+        self.events += len(product_ids)
+
+    def top(self, name, limit):
+        """
+        @param name: ranking name
+        @param limit:
+        @return product ids of the highest scores, best first - products without a score are left out:
+        """
+        scores = self.scores[name]
+        limit = min(limit, np.count_nonzero(scores))
+        if not limit:
+            return []
+
+        # partial selection of the top scores, only those are sorted
+        candidates = np.argpartition(-scores, limit - 1)[:limit]
+        return candidates[np.argsort(-scores[candidates], kind='stable')].tolist()
+
+
+def chunk_arrays(chunk):
+    """
+    @param chunk: list of (product id, weight, datetime) rows
+    @return product ids, weights, epoch seconds arrays:
+    """
+    product_ids, weights, dates = zip(*chunk)
+    return (
+        np.fromiter(product_ids, dtype=np.int64, count=len(chunk)),
+        np.fromiter(weights, dtype=np.float64, count=len(chunk)),
+        np.fromiter((date.timestamp() for date in dates), dtype=np.float64, count=len(chunk)),
+    )
+
+
+def day_chunk_arrays(chunk):
+    """
+    @param chunk: list of (product id, weight, date) rows
+    @return product ids, weights, epoch seconds of the middle of the days arrays:
+    """
+    product_ids, weights, days = zip(*chunk)
+    return (
+        np.fromiter(product_ids, dtype=np.int64, count=len(chunk)),
+        np.fromiter(weights, dtype=np.float64, count=len(chunk)),
+        np.array(days, dtype='datetime64[D]').astype('datetime64[s]').astype(np.float64) + 12 * 60 * 60,
+    )
+
+
+def _chunks(queryset, columns, arrays=chunk_arrays):
+    rows = queryset.values_list(*columns).iterator(chunk_size=RANKING_CHUNK_SIZE)
+    while True:
+        chunk = list(itertools.islice(rows, RANKING_CHUNK_SIZE))
+        if not chunk:
+            break
+        yield arrays(chunk)
+
+
+def score_products(now=None):
+    """
+    Time decayed scores - best sellers from the daily product sales rollups,
+    trending from the sold order items and the open carts of the last days
+    @param now: scores are computed as of this time, now by default
+    @return DecayedScores:
+    """
+    now = now or timezone.now()
+    scores = DecayedScores(now.timestamp(), {
+        'trending': TRENDING_HALF_LIFE_HOURS * 60 * 60,
+        'best_sellers': BEST_SELLER_HALF_LIFE_DAYS * 60 * 60 * 24,
+    })
+
+    # a month long half-life needs no finer time than the day - O(days x products) rows instead of O(order items)
+    daily_sales = ProductDailySales.objects.filter(
+        day__gte=timezone.localdate(now) - timedelta(days=BEST_SELLER_WINDOW_DAYS)
+    )
+    for product_ids, units, timestamps in _chunks(daily_sales, ('product_id', 'units', 'day'), day_chunk_arrays):
+        scores.add(product_ids, units, timestamps, rankings=['best_sellers'])
+
+    order_items = OrderItem.objects.filter(
+        sold_orders_filter('order__'), order__ordered_date__gte=now - timedelta(days=TRENDING_WINDOW_DAYS)
+    )
+    for product_ids, units, timestamps in _chunks(order_items, ('product_id', 'quantity', 'order__ordered_date')):
+        scores.add(product_ids, units, timestamps, rankings=['trending'])
+
+    # interest that is not an order yet, a carted unit counts less than a sold one
+    carts = Cart.objects.filter(
+        is_purchased=False, updated_at__gte=now - timedelta(days=TRENDING_WINDOW_DAYS)
+    )
+    for product_ids, units, timestamps in _chunks(carts, ('product_id', 'quantity', 'updated_at')):
+        scores.add(product_ids, units * TRENDING_CART_WEIGHT, timestamps, rankings=['trending'])
+
+    return scores
+
+
+def _active_top(scores, name, limit):
+    # the best scores can belong to hidden products, a few more candidates than needed are checked
+    candidates = scores.top(name, limit * RANKING_CANDIDATES_FACTOR)
+    active = set(Product.objects.active_products().filter(id__in=candidates).values_list('id', flat=True))
+    return [product_id for product_id in candidates if product_id in active][:limit]
+
+
+def _set_trending_flags(product_ids):
+    """
+    Product.trending for the trending products only, SubCategory.trending for their subcategories
+    @param product_ids:
+    @return number of products changed:
+    """
+    with transaction.atomic():
+        raised = list(Product.objects.filter(
+            id__in=product_ids, trending=False
+        ).values_list('id', 'category_id', 'subcategory_id'))
+        dropped = list(Product.objects.filter(trending=True).exclude(
+            id__in=product_ids
+        ).values_list('id', 'category_id', 'subcategory_id'))
+        Product.objects.filter(id__in=[product_id for product_id, _, _ in raised]).update(trending=True)
+        Product.objects.filter(id__in=[product_id for product_id, _, _ in dropped]).update(trending=False)
+
+        subcategory_ids = Product.objects.filter(id__in=product_ids).values('subcategory_id')
+        SubCategory.objects.filter(trending=True).exclude(id__in=subcategory_ids).update(trending=False)
+        SubCategory.objects.filter(id__in=subcategory_ids, trending=False).update(trending=True)
+
+        # update() sends no model signals - the listing facets and product pages show the flag
+        changed = raised + dropped
+        invalidate_facets((category_id, subcategory_id) for _, category_id, subcategory_id in changed)
+        changed_ids = [product_id for product_id, _, _ in changed]
+        transaction.on_commit(lambda: invalidate_product_fragments(changed_ids))
+
+    return len(changed)
+
+
+def compute_rankings(now=None):
+    """
+    Score the products, publish the top lists and the trending flags, rebuild the home catalog with them
+    @param now: rankings are computed as of this time, now by default
+    @return rankings:
+    """
+    scores = score_products(now)
+    rankings = {
+        'trending': _active_top(scores, 'trending', TRENDING_PRODUCTS_LIMIT),
+        'best_sellers': _active_top(scores, 'best_sellers', BEST_SELLER_PRODUCTS_LIMIT),
+        'events': scores.events,
+        'computed_at': timezone.now().isoformat(),
+    }
+    cache.set(RANKINGS_CACHE_KEY, rankings, None)
+
+    rankings['trending_flags_changed'] = _set_trending_flags(rankings['trending'])
+    refresh_home_catalog()
+    return rankings
+
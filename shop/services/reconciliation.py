@@ -0,0 +1,154 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import time
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+import logging
+
+# models
+from shop.models import Order
+from shop.services.rollups import record_order_sales
+from shop.services.stock import OutOfStockError, commit_reservations, release_reservations
+
+# constant helper
+from utils.constants import *
+from utils.helper import razorpay_login
+
+logger = logging.getLogger('django')
+
+ONLINE_PAYMENT_TYPE = ONLINE_PAYMENT.replace(' ', '_')
+
+
+def fetch_gateway_status(order):
+    """
+    Payment status of a pending order from razorpay
+    @param order: dict with id, provider_order_id and created_at
+    @return (status, payment id) - status None when the order should stay pending:
+    """
+    now = timezone.now()
+
+    # the stock was reserved but the razorpay order was never created, nothing can be paid
+    if not order['provider_order_id']:
+        if order['created_at'] < now - timedelta(minutes=STOCK_RESERVATION_TTL_MINUTES):
+            return ERROR, ''
+        return None, None
+
+    payments = razorpay_login().order.payments(order['provider_order_id']).get('items', [])
+
+    # payments are not auto captured, an authorized payment is a paid order
+    for payment in payments:
+        if payment['status'] in ('captured', 'authorized'):
+            return COMPLETED, payment['id']
+
+    if payments and all(payment['status'] == 'failed' for payment in payments):
+        if order['created_at'] < now - timedelta(minutes=STOCK_RESERVATION_TTL_MINUTES):
+            return ERROR, payments[0]['id']
+    elif not payments and order['created_at'] < now - timedelta(hours=PAYMENT_ABANDON_HOURS):
+        return ERROR, ''
+
+    return None, None
+
+
+def _fetch(order):
+    try:
+        return order, fetch_gateway_status(order)
+    except Exception as e:
+        logger.warning(f"Razorpay status of order {order['provider_order_id']} not fetched - {e}")
+        return order, None
+
+
+def apply_gateway_statuses(statuses):
+    """
+    Store the gateway statuses of still pending orders with one bulk_update.
+    A paid order takes its stock again when the reservation expired meanwhile, it is flagged for refund
+    instead of completed when the stock is gone
+    @param statuses: dict of order id -> (status, payment id)
+    @return list of completed order ids, list of failed order ids, list of refunded order ids:
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        # a callback may have handled the order meanwhile, the pending rows are locked and updated only
+        orders = list(Order.objects.select_for_update().filter(
+            id__in=list(statuses), payment_status=PENDING
+        ).only('id', 'payment_status', 'order_status', 'payment_id', 'updated_at'))
+
+        for order in orders:
+            order.payment_status, order.payment_id = statuses[order.id]
+            order.updated_at = now
+            if order.payment_status == COMPLETED:
+                try:
+                    commit_reservations(order)
+                    order.order_status = IN_PROGRES
+                except OutOfStockError as e:
+                    logger.warning(f'Order {order.id} paid after its stock was sold, flagged for refund - {e}')
+                    order.payment_status = REFUND
+                    order.order_status = CANCELLED
+
+        Order.objects.bulk_update(orders, ['payment_status', 'order_status', 'payment_id', 'updated_at'])
+
+        completed = [order.id for order in orders if order.payment_status == COMPLETED]
+        failed = [order for order in orders if order.payment_status == ERROR]
+        refunded = [order for order in orders if order.payment_status == REFUND]
+
+        # only the orders that got their stock are sales
+        record_order_sales(completed)
+        for order in failed + refunded:
+            release_reservations(order)
+
+        from shop.celery.tasks import complete_order_purchase
+        transaction.on_commit(lambda: [complete_order_purchase.delay(order_id) for order_id in completed])
+
+    return completed, [order.id for order in failed], [order.id for order in refunded]
+
+
+def reconcile_pending_orders(batch_size=RECONCILIATION_BATCH_SIZE, workers=RECONCILIATION_WORKERS):
+    """
+    Check the pending online payment orders against razorpay, batch by batch with a bounded pool
+    @param batch_size:
+    @param workers: concurrent gateway calls
+    @return stats:
+    """
+    started = time.perf_counter()
+    now = timezone.now()
+    stats = {'scanned': 0, 'completed': 0, 'failed': 0, 'refunded': 0, 'unchanged': 0, 'errors': 0, 'max_lag_seconds': 0}
+
+    pending_orders = Order.objects.filter(
+        payment_status=PENDING,
+        payment_type=ONLINE_PAYMENT_TYPE,
+        created_at__lt=now - timedelta(minutes=RECONCILIATION_GRACE_MINUTES)
+    ).order_by('id')
+
+    last_id = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            batch = list(pending_orders.filter(id__gt=last_id).values(
+                'id', 'provider_order_id', 'created_at'
+            )[:batch_size])
+            if not batch:
+                break
+
+            last_id = batch[-1]['id']
+            stats['scanned'] += len(batch)
+            stats['max_lag_seconds'] = max(stats['max_lag_seconds'], (now - batch[0]['created_at']).total_seconds())
+
+            statuses = {}
+            for order, result in pool.map(_fetch, batch):
+                if result is None:
+                    stats['errors'] += 1
+                elif result[0] is None:
+                    stats['unchanged'] += 1
+                else:
+                    statuses[order['id']] = result
+
+            if statuses:
+                completed, failed, refunded = apply_gateway_statuses(statuses)
+                stats['completed'] += len(completed)
+                stats['failed'] += len(failed)
+                stats['refunded'] += len(refunded)
+
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    stats['orders_per_second'] = round(stats['scanned'] / stats['seconds'], 1) if stats['seconds'] else 0
+    stats['finished_at'] = timezone.now().isoformat()
+    cache.set(RECONCILIATION_STATS_CACHE_KEY, stats, None)
+    return stats
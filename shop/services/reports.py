@@ -0,0 +1,81 @@
+from datetime import timedelta
+import pandas as pd
+from django.core.cache import cache
+from django.utils import timezone
+import logging
+
+# models
+from shop.models import Product
+from shop.services.rollups import rollup_sales_days, sales_report_key
+
+# constant helper
+from utils.constants import *
+
+logger = logging.getLogger('django')
+
+DISTRICTS = [key for key, _ in TAMIL_NADU_DISTRICTS]
+
+
+def get_sales_days(start, end, refresh=False):
+    """
+    Daily sales from the cache, the missing days are read from the rollups in one pass and cached per day
+    @param start: first day
+    @param end: last day, included
+    @param refresh: read every day of the range from the rollups again
+    @return dict of day -> sales:
+    """
+    days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    cached = {} if refresh else cache.get_many([sales_report_key(day) for day in days])
+    sales = {day: cached[sales_report_key(day)] for day in days if sales_report_key(day) in cached}
+
+    missing = [day for day in days if day not in sales]
+    if missing:
+        computed = rollup_sales_days(missing[0], missing[-1])
+        # a sale recorded while today is read could be overwritten by the stale read, today expires soon anyway
+        today = timezone.localdate()
+        cache.set_many({sales_report_key(day): computed[day] for day in missing if day < today}, REPORT_DAY_CACHE_TIMEOUT)
+        cache.set_many({sales_report_key(day): computed[day] for day in missing if day >= today}, REPORT_TODAY_CACHE_TIMEOUT)
+        sales.update({day: computed[day] for day in missing})
+
+    return sales
+
+
+def sales_report(start, end, refresh=False):
+    """
+    Daily revenue, units per product and per district sales of a date range
+    @param start: first day
+    @param end: last day, included
+    @param refresh: read the cached days from the rollups again
+    @return dict of totals and the daily, products and districts DataFrames:
+    """
+    sales = get_sales_days(start, end, refresh)
+
+    daily = pd.DataFrame.from_records(
+        [(day, values['orders'], values['revenue'], values['units']) for day, values in sorted(sales.items())],
+        columns=['day', 'orders', 'revenue', 'units']
+    ).set_index('day')
+
+    products = pd.DataFrame.from_records(
+        [(product_id, units, revenue) for values in sales.values() for product_id, (units, revenue) in values['products'].items()],
+        columns=['product_id', 'units', 'revenue']
+    ).groupby('product_id').sum().sort_values(['units', 'revenue'], ascending=False)
+    names = dict(Product.objects.filter(id__in=products.index.tolist()).values_list('id', 'name'))
+    products.insert(0, 'name', products.index.map(names))
+
+    districts = pd.DataFrame.from_records(
+        [(district, orders, revenue) for values in sales.values() for district, (orders, revenue) in values['districts'].items()],
+        columns=['district', 'orders', 'revenue']
+    ).groupby('district').sum()
+    # every district in the choices order, the free text ones after them
+    districts = districts.reindex(DISTRICTS + sorted(set(districts.index) - set(DISTRICTS)), fill_value=0)
+
+    return {
+        'start': start,
+        'end': end,
+        'orders': int(daily['orders'].sum()),
+        'revenue': float(daily['revenue'].sum()),
+        'units': int(daily['units'].sum()),
+        'daily': daily,
+        'products': products,
+        'districts': districts,
+    }
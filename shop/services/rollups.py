@@ -0,0 +1,241 @@
+import itertools
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+import pandas as pd
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+import logging
+
+# models
+from shop.models import (
+    Order,
+    OrderItem,
+    ProductDailySales,
+    DistrictDailySales
+)
+
+# constant helper
+from utils.constants import *
+from utils.helper import upsert_increment
+
+logger = logging.getLogger('django')
+
+
+def sales_report_key(day):
+    return f'shop:reports:day:{day.isoformat()}'
+
+
+def invalidate_sales_days(days):
+    """
+    Drop the cached report days once the rollup change is committed
+    @param days: iterable of dates
+    @return:
+    """
+    keys = [sales_report_key(day) for day in set(days)]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def sold_orders_filter(prefix=''):
+    """
+    Orders counted as sales - paid online or placed as cash on delivery, not cancelled
+    @param prefix: lookup prefix of the order, order__ for the order items
+    @return Q:
+    """
+    return (
+        Q(**{f'{prefix}payment_status': COMPLETED})
+        | Q(**{f'{prefix}payment_type': CASH_ON_DELIVERY.replace(' ', '_')})
+    ) & ~Q(**{f'{prefix}order_status': CANCELLED})
+
+
+def local_day_bounds(start, end):
+    """
+    @param start: first day
+    @param end: last day, included
+    @return aware datetimes [start, end + 1 day) in the shop timezone:
+    """
+    zone = timezone.get_current_timezone()
+    return (
+        timezone.make_aware(datetime.combine(start, time.min), zone),
+        timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min), zone),
+    )
+
+
+def _frames(queryset, columns):
+    """
+    DataFrames of REPORT_CHUNK_SIZE rows, the first column is the datetime bucketed into a local day
+    """
+    rows = queryset.values_list(*columns).iterator(chunk_size=REPORT_CHUNK_SIZE)
+    names = ['day'] + [column.split('__')[-1] for column in columns[1:]]
+    while True:
+        chunk = list(itertools.islice(rows, REPORT_CHUNK_SIZE))
+        if not chunk:
+            break
+
+        frame = pd.DataFrame.from_records(chunk, columns=names)
+        frame['day'] = pd.to_datetime(frame['day'], utc=True).dt.tz_convert(
+            timezone.get_current_timezone_name()
+        ).dt.date
+        yield frame
+
+
+def _aggregate(frames, keys, values):
+    # sum every chunk on its own, then the partial sums - memory stays at one chunk plus the groups
+    partials = [frame.groupby(keys, sort=False)[values].sum() for frame in frames]
+    if not partials:
+        return pd.DataFrame(columns=values, index=pd.MultiIndex.from_tuples([], names=keys))
+    return pd.concat(partials).groupby(level=keys).sum()
+
+
+def compute_sales_days(start, end):
+    """
+    Sales of every day of the range from the orders and order items
+    @param start: first day
+    @param end: last day, included
+    @return dict of day -> orders, revenue, units, products {id: (units, revenue)}, districts {district: (orders, revenue)}:
+    """
+    since, until = local_day_bounds(start, end)
+    orders = Order.objects.filter(sold_orders_filter(), ordered_date__gte=since, ordered_date__lt=until)
+    items = OrderItem.objects.filter(
+        sold_orders_filter('order__'), order__ordered_date__gte=since, order__ordered_date__lt=until
+    )
+
+    by_district = _aggregate(
+        (frame.assign(orders=1) for frame in _frames(orders, ('ordered_date', 'district', 'amount'))),
+        ['day', 'district'], ['orders', 'amount']
+    )
+    by_product = _aggregate(
+        _frames(items, ('order__ordered_date', 'product_id', 'quantity', 'amount')),
+        ['day', 'product_id'], ['quantity', 'amount']
+    )
+
+    days = {
+        start + timedelta(days=offset): {'orders': 0, 'revenue': 0.0, 'units': 0, 'products': {}, 'districts': {}}
+        for offset in range((end - start).days + 1)
+    }
+    for (day, district), orders_count, amount in by_district.itertuples(name=None):
+        days[day]['orders'] += int(orders_count)
+        days[day]['revenue'] += float(amount)
+        days[day]['districts'][district] = (int(orders_count), float(amount))
+    for (day, product_id), quantity, amount in by_product.itertuples(name=None):
+        days[day]['units'] += int(quantity)
+        days[day]['products'][int(product_id)] = (int(quantity), float(amount))
+
+    return days
+
+
+def record_order_sales(order_ids):
+    """
+    Add orders to the daily rollups - called once per order, in the transaction that makes it a sale
+    @param order_ids: orders paid online or placed as cash on delivery
+    @return:
+    """
+    orders = {
+        order_id: (timezone.localdate(ordered_date), district, amount)
+        for order_id, ordered_date, district, amount in Order.objects.filter(
+            id__in=order_ids
+        ).values_list('id', 'ordered_date', 'district', 'amount')
+    }
+
+    districts = defaultdict(lambda: [0, 0.0])
+    for day, district, amount in orders.values():
+        districts[(day, district)][0] += 1
+        districts[(day, district)][1] += amount
+
+    products = defaultdict(lambda: [0, 0.0])
+    for order_id, product_id, quantity, amount in OrderItem.objects.filter(
+        order_id__in=list(orders)
+    ).values_list('order_id', 'product_id', 'quantity', 'amount'):
+        products[(orders[order_id][0], product_id)][0] += quantity
+        products[(orders[order_id][0], product_id)][1] += amount
+
+    upsert_increment(
+        ProductDailySales, [(day, product_id, units, revenue) for (day, product_id), (units, revenue) in products.items()],
+        ['day', 'product'], ['units', 'revenue']
+    )
+    upsert_increment(
+        DistrictDailySales, [(day, district, count, revenue) for (day, district), (count, revenue) in districts.items()],
+        ['day', 'district'], ['orders', 'revenue']
+    )
+    invalidate_sales_days(day for day, _, _ in orders.values())
+
+
+def _lock_rollup_days(start, end):
+    for model in (ProductDailySales, DistrictDailySales):
+        list(model.objects.select_for_update().filter(day__gte=start, day__lte=end).values_list('id', flat=True))
+
+
+def rebuild_sales_rollups(start=None, end=None, batch_days=SALES_ROLLUP_BATCH_DAYS):
+    """
+    Recompute the rollups from the orders, batch_days at a time - backfill and repair after order edits.
+    Safe while sales are recorded, the rollup rows of a batch are locked while it is recomputed
+    @param start: first day, the first sale by default
+    @param end: last day, today by default
+    @param batch_days: days recomputed per transaction
+    @return stats:
+    """
+    stats = {'days': 0, 'product_rows': 0, 'district_rows': 0}
+    if start is None:
+        first_sale = Order.objects.filter(sold_orders_filter()).aggregate(first=Min('ordered_date'))['first']
+        if first_sale is None:
+            return stats
+        start = timezone.localdate(first_sale)
+    end = end or timezone.localdate()
+
+    while start <= end:
+        last = min(start + timedelta(days=batch_days - 1), end)
+        with transaction.atomic():
+            # locking read of the rollup rows before the orders are read, in the order record_order_sales writes.
+            # On the (day, ...) unique keys it takes next-key locks over the day range - a sale recorded meanwhile
+            # waits and then increments the rebuilt rows, a sale recorded before is committed and recomputed
+            _lock_rollup_days(start, last)
+            days = compute_sales_days(start, last)
+            product_rows = [
+                ProductDailySales(day=day, product_id=product_id, units=units, revenue=revenue)
+                for day, values in days.items() for product_id, (units, revenue) in values['products'].items()
+            ]
+            district_rows = [
+                DistrictDailySales(day=day, district=district, orders=count, revenue=revenue)
+                for day, values in days.items() for district, (count, revenue) in values['districts'].items()
+            ]
+
+            ProductDailySales.objects.filter(day__gte=start, day__lte=last).delete()
+            DistrictDailySales.objects.filter(day__gte=start, day__lte=last).delete()
+            ProductDailySales.objects.bulk_create(product_rows, batch_size=SALES_ROLLUP_INSERT_BATCH_SIZE)
+            DistrictDailySales.objects.bulk_create(district_rows, batch_size=SALES_ROLLUP_INSERT_BATCH_SIZE)
+            invalidate_sales_days(days)
+
+        stats['days'] += len(days)
+        stats['product_rows'] += len(product_rows)
+        stats['district_rows'] += len(district_rows)
+        logger.info(f'Sales rollups rebuilt up to {last} - {stats}')
+        start = last + timedelta(days=1)
+
+    return stats
+
+
+def rollup_sales_days(start, end):
+    """
+    Sales of every day of the range from the rollups - O(days) rows, not O(orders)
+    @param start: first day
+    @param end: last day, included
+    @return dict of day -> orders, revenue, units, products {id: (units, revenue)}, districts {district: (orders, revenue)}:
+    """
+    days = {
+        start + timedelta(days=offset): {'orders': 0, 'revenue': 0.0, 'units': 0, 'products': {}, 'districts': {}}
+        for offset in range((end - start).days + 1)
+    }
+    for day, district, count, revenue in DistrictDailySales.objects.filter(
+        day__gte=start, day__lte=end
+    ).values_list('day', 'district', 'orders', 'revenue').iterator(chunk_size=REPORT_CHUNK_SIZE):
+        days[day]['orders'] += count
+        days[day]['revenue'] += revenue
+        days[day]['districts'][district] = (count, revenue)
+    for day, product_id, units, revenue in ProductDailySales.objects.filter(
+        day__gte=start, day__lte=end
+    ).values_list('day', 'product_id', 'units', 'revenue').iterator(chunk_size=REPORT_CHUNK_SIZE):
+        days[day]['units'] += units
+        days[day]['products'][product_id] = (units, revenue)
+
+    return days
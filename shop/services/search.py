@@ -0,0 +1,492 @@
+from array import array
+from bisect import bisect_left, insort
+from collections import defaultdict
+import heapq
+import json
+import math
+import os
+import re
+import threading
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+import logging
+
+# models
+from shop.models import Product
+
+# constant helper
+from utils.constants import *
+from utils.helper import get_redis
+
+logger = logging.getLogger('django')
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+STOP_WORDS = frozenset(('a', 'an', 'and', 'for', 'in', 'of', 'on', 'or', 'the', 'to', 'with'))
+
+# a term in the product name counts more than the same term in the description
+FIELD_WEIGHTS = (
+    ('name', 8),
+    ('subcategory', 4),
+    ('category', 2),
+    ('description', 1),
+)
+
+SNAPSHOT_FORMAT = 2
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall((text or '').lower()) if token not in STOP_WORDS]
+
+
+def document_terms(document):
+    """
+    Weighted terms of a product
+    @param document: dict with name, subcategory, category and description
+    @return dict of term -> weight (1 - 255):
+    """
+    weights = defaultdict(int)
+    for field, weight in FIELD_WEIGHTS:
+        for token in tokenize(document.get(field)):
+            weights[token] += weight
+    return {term: min(weight, 255) for term, weight in weights.items()}
+
+
+class SearchIndex:
+    """
+    Inverted index of the active products - term -> sorted product ids with a parallel weight array.
+    Postings are compact arrays ('I' ids, 'B' weights), updated in place and scored as numpy views
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.vocabulary = []  # sorted terms for the prefix lookups
+        self.document_terms = {}  # product id -> terms, to take a product out of the index
+        self.version = 0
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.document_terms)
+
+    def build(self, documents):
+        """
+        Bulk load - documents must come in ascending id order, the posting arrays are appended to only
+        @param documents: iterable of dicts with id, name, subcategory, category and description
+        @return:
+        """
+        with self.lock:
+            for document in documents:
+                self._append(document['id'], document_terms(document))
+            self.vocabulary = sorted(self.postings)
+
+    def _append(self, product_id, terms):
+        for term, weight in terms.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = (array('I'), array('B'))
+            posting[0].append(product_id)
+            posting[1].append(weight)
+        self.document_terms[product_id] = tuple(terms)
+
+    def add(self, document):
+        with self.lock:
+            product_id = document['id']
+            self.remove(product_id)
+
+            terms = document_terms(document)
+            for term, weight in terms.items():
+                posting = self.postings.get(term)
+                if posting is None:
+                    posting = self.postings[term] = (array('I'), array('B'))
+                    insort(self.vocabulary, term)
+
+                ids, weights = posting
+                if not ids or ids[-1] < product_id:
+                    ids.append(product_id)
+                    weights.append(weight)
+                else:
+                    position = bisect_left(ids, product_id)
+                    ids.insert(position, product_id)
+                    weights.insert(position, weight)
+            self.document_terms[product_id] = tuple(terms)
+
+    def remove(self, product_id):
+        with self.lock:
+            for term in self.document_terms.pop(product_id, ()):
+                ids, weights = self.postings[term]
+                position = bisect_left(ids, product_id)
+                if position < len(ids) and ids[position] == product_id:
+                    del ids[position]
+                    del weights[position]
+
+                if not ids:
+                    del self.postings[term]
+                    del self.vocabulary[bisect_left(self.vocabulary, term)]
+
+    def prefix_terms(self, prefix, limit=SEARCH_PREFIX_EXPANSION_LIMIT):
+        """
+        Terms starting with the prefix, the most common first
+        @param prefix:
+        @param limit:
+        @return list of terms:
+        """
+        start = bisect_left(self.vocabulary, prefix)
+        end = bisect_left(self.vocabulary, prefix + '\uffff', lo=start)
+        if end - start <= limit:
+            terms = self.vocabulary[start:end]
+        else:
+            terms = heapq.nlargest(limit, self.vocabulary[start:end], key=lambda term: len(self.postings[term][0]))
+        return sorted(terms, key=lambda term: -len(self.postings[term][0]))
+
+    def _idf(self, term):
+        return math.log(1 + len(self.document_terms) / len(self.postings[term][0]))
+
+    def _posting_arrays(self, term):
+        # zero copy numpy views of the posting arrays - they must not outlive the lock
+        ids, weights = self.postings[term]
+        return np.frombuffer(ids, dtype=np.uint32), np.frombuffer(weights, dtype=np.uint8) * self._idf(term)
+
+    def _candidates(self, terms):
+        # products with any of the terms, best term score per product
+        if len(terms) == 1:
+            return self._posting_arrays(terms[0])
+
+        postings = [self._posting_arrays(term) for term in terms]
+        ids = np.concatenate([term_ids for term_ids, _ in postings])
+        scores = np.concatenate([term_scores for _, term_scores in postings])
+        order = np.argsort(ids, kind='stable')
+        ids, scores = ids[order], scores[order]
+        ids, starts = np.unique(ids, return_index=True)
+        return ids, np.maximum.reduceat(scores, starts)
+
+    def _match(self, ids, scores, terms):
+        # keep the candidates having one of the terms, binary search in the sorted posting arrays
+        best = np.zeros(len(ids))
+        for term in terms:
+            term_ids, term_scores = self._posting_arrays(term)
+            positions = np.minimum(np.searchsorted(term_ids, ids), len(term_ids) - 1)
+            found = term_ids[positions] == ids
+            best = np.maximum(best, np.where(found, term_scores[positions], 0))
+
+        matched = best > 0
+        return ids[matched], scores[matched] + best[matched]
+
+    def search(self, query, limit=SEARCH_RESULTS_LIMIT):
+        """
+        Products matching every word of the query, the last word is a prefix - ranked by field weight * idf
+        @param query:
+        @param limit:
+        @return list of product ids, best match first:
+        """
+        return self.search_with_total(query, limit)[0]
+
+    def search_with_total(self, query, limit=SEARCH_RESULTS_LIMIT):
+        """
+        Same as search, with the number of matching products before the limit
+        @param query:
+        @param limit:
+        @return (list of product ids, total matches):
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return [], 0
+
+        with self.lock:
+            # every word is a group of alternative terms, a product must match one term of every group
+            groups = [[token] if token in self.postings else [] for token in tokens[:-1]]
+            groups.append(self.prefix_terms(tokens[-1]))
+            if not all(groups):
+                return [], 0
+
+            # candidates from the rarest group, then looked up in the other posting lists
+            groups.sort(key=lambda terms: sum(len(self.postings[term][0]) for term in terms))
+            ids, scores = self._candidates(groups[0])
+            for terms in groups[1:]:
+                if not len(ids):
+                    return [], 0
+                ids, scores = self._match(ids, scores, terms)
+
+            total = len(ids)
+            if total > limit:
+                top = np.argpartition(-scores, limit)[:limit]
+                ids, scores = ids[top], scores[top]
+
+            # newer products (higher ids) first on equal scores
+            order = np.lexsort((-ids.astype(np.int64), -scores))
+            return ids[order].tolist(), total
+
+    def _common_ids(self, tokens):
+        # products having every one of the terms, intersected from the rarest posting list up
+        tokens = sorted(set(tokens), key=lambda token: len(self.postings[token][0]))
+        ids = np.frombuffer(self.postings[tokens[0]][0], dtype=np.uint32)
+        for token in tokens[1:]:
+            if not len(ids):
+                break
+            ids = np.intersect1d(ids, np.frombuffer(self.postings[token][0], dtype=np.uint32), assume_unique=True)
+        return ids
+
+    @staticmethod
+    def _overlap(ids, other_ids):
+        # number of ids in both sorted arrays, the shorter one is looked up in the longer one
+        if len(ids) > len(other_ids):
+            ids, other_ids = other_ids, ids
+        if not len(ids):
+            return 0
+        positions = np.minimum(np.searchsorted(other_ids, ids), len(other_ids) - 1)
+        return int(np.count_nonzero(other_ids[positions] == ids))
+
+    def autocomplete(self, prefix, limit=SEARCH_AUTOCOMPLETE_LIMIT):
+        """
+        Completions of the last word of the query, the earlier words are kept.
+        With earlier words only the completions found in products having all of them are suggested,
+        the ones in the most such products first
+        @param prefix: partial query
+        @param limit:
+        @return list of completed queries:
+        """
+        tokens = tokenize(prefix)
+        if not tokens:
+            return []
+
+        with self.lock:
+            head = tokens[:-1]
+            if not head:
+                return self.prefix_terms(tokens[-1], limit)
+            if any(token not in self.postings for token in head):
+                return []
+
+            ids = self._common_ids(head)
+            counts = []
+            for term in self.prefix_terms(tokens[-1]):
+                count = self._overlap(ids, np.frombuffer(self.postings[term][0], dtype=np.uint32))
+                if count:
+                    counts.append((count, term))
+
+            terms = [term for _, term in sorted(counts, key=lambda item: -item[0])[:limit]]
+            return [f"{' '.join(head)} {term}" for term in terms]
+
+    def dump(self, path):
+        """
+        Write the index to an npz of the posting arrays, atomically replacing the old snapshot.
+        The terms and the index version are a JSON header, nothing in the file is unpickled on load
+        @param path:
+        @return:
+        """
+        with self.lock:
+            terms = list(self.postings)
+            header = {'format': SNAPSHOT_FORMAT, 'version': self.version, 'terms': terms}
+            lengths = np.fromiter((len(self.postings[term][0]) for term in terms), dtype=np.int64, count=len(terms))
+            # the posting arrays of all the terms end to end, split again by the lengths on load
+            ids = np.concatenate([np.zeros(0, dtype=np.uint32)] + [
+                np.frombuffer(self.postings[term][0], dtype=np.uint32) for term in terms
+            ])
+            weights = np.concatenate([np.zeros(0, dtype=np.uint8)] + [
+                np.frombuffer(self.postings[term][1], dtype=np.uint8) for term in terms
+            ])
+
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'wb') as snapshot:
+            np.savez_compressed(
+                snapshot,
+                header=np.frombuffer(json.dumps(header).encode(), dtype=np.uint8),
+                lengths=lengths,
+                ids=ids,
+                weights=weights
+            )
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as snapshot:
+            header = json.loads(snapshot['header'].tobytes())
+            if header.get('format') != SNAPSHOT_FORMAT:
+                raise ValueError(f"Unknown search index snapshot format {header.get('format')}")
+
+            lengths = snapshot['lengths']
+            all_ids = snapshot['ids'].astype(np.uint32, copy=False)
+            all_weights = snapshot['weights'].astype(np.uint8, copy=False)
+
+        if len(header['terms']) != len(lengths) or lengths.sum() != len(all_ids) or len(all_ids) != len(all_weights):
+            raise ValueError('Search index snapshot arrays do not match its header')
+
+        index = cls()
+        index.version = header['version']
+        document_terms = defaultdict(list)
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        for term, start, end in zip(header['terms'], offsets[:-1], offsets[1:]):
+            ids, weights = array('I'), array('B')
+            ids.frombytes(all_ids[start:end].tobytes())
+            weights.frombytes(all_weights[start:end].tobytes())
+            index.postings[term] = (ids, weights)
+            for product_id in ids:
+                document_terms[product_id].append(term)
+
+        index.document_terms = {product_id: tuple(terms) for product_id, terms in document_terms.items()}
+        index.vocabulary = sorted(index.postings)
+        return index
+
+
+# the index of this process, loaded on the first search
+_index = None
+_index_lock = threading.Lock()
+
+
+def _documents(queryset):
+    for row in queryset.values('id', 'name', 'description', 'category__name', 'subcategory__name').iterator(chunk_size=2000):
+        yield {
+            'id': row['id'],
+            'name': row['name'],
+            'description': row['description'],
+            'category': row['category__name'],
+            'subcategory': row['subcategory__name'],
+        }
+
+
+def build_search_index():
+    """
+    Index of the active products from the database
+    @return SearchIndex:
+    """
+    # changes made while the index is built are applied again afterwards, applying a change twice is harmless
+    version = int(get_redis().get(SEARCH_INDEX_VERSION_KEY) or 0)
+
+    index = SearchIndex()
+    index.build(_documents(Product.objects.active_products().order_by('id')))
+    index.version = version
+    return index
+
+
+def write_search_index_snapshot():
+    """
+    Build the index and write the snapshot the processes start from, the older change log is dropped
+    @return SearchIndex:
+    """
+    index = build_search_index()
+    index.dump(settings.SEARCH_INDEX_PATH)
+
+    # keep the changes since the previous snapshot, a process may still be starting from it
+    redis = get_redis()
+    previous_version = int(redis.getset(SEARCH_INDEX_SNAPSHOT_VERSION_KEY, index.version) or 0)
+    redis.zremrangebyscore(SEARCH_INDEX_CHANGES_KEY, '-inf', previous_version)
+    redis.set(SEARCH_INDEX_PRUNED_VERSION_KEY, previous_version)
+    return index
+
+
+def _load_search_index():
+    path = settings.SEARCH_INDEX_PATH
+    if os.path.exists(path):
+        try:
+            index = SearchIndex.load(path)
+            pruned_version = int(get_redis().get(SEARCH_INDEX_PRUNED_VERSION_KEY) or 0)
+            if index.version >= pruned_version:
+                return index
+            logger.info('Search index snapshot is older than the change log, rebuilding')
+        except Exception as e:
+            logger.error(f"Search index snapshot not loaded - {e}")
+
+    return build_search_index()
+
+
+def catch_up(index, version):
+    """
+    Apply the product changes logged by every process since the index version
+    @param index:
+    @param version: current change log version
+    @return number of products refreshed:
+    """
+    changes = get_redis().zrangebyscore(SEARCH_INDEX_CHANGES_KEY, f'({index.version}', version)
+    product_ids = [int(product_id) for product_id in changes]
+
+    documents = {document['id']: document for document in _documents(
+        Product.objects.active_products().filter(id__in=product_ids)
+    )}
+
+    with index.lock:
+        for product_id in product_ids:
+            if product_id in documents:
+                index.add(documents[product_id])
+            else:
+                index.remove(product_id)
+        index.version = max(index.version, version)
+
+    return len(product_ids)
+
+
+def get_search_index():
+    """
+    Index of this process - loaded from the snapshot once, then kept up-to-date from the change log
+    @return SearchIndex:
+    """
+    global _index
+    try:
+        version, pruned_version = (int(value or 0) for value in get_redis().mget(
+            SEARCH_INDEX_VERSION_KEY, SEARCH_INDEX_PRUNED_VERSION_KEY
+        ))
+    except Exception as e:
+        logger.warning(f"Search index change log not read - {e}")
+        version = pruned_version = None
+
+    with _index_lock:
+        # an index that fell behind the pruned change log can not catch up, it is loaded again
+        if _index is None or (pruned_version is not None and _index.version < pruned_version):
+            _index = _load_search_index()
+
+    if version is not None and version > _index.version:
+        try:
+            catch_up(_index, version)
+        except Exception as e:
+            logger.warning(f"Search index not caught up - {e}")
+
+    return _index
+
+
+# INCR and ZADD in one step, a reader never sees the new version without its products
+LOG_CHANGES_SCRIPT = """
+local version = redis.call('INCR', KEYS[1])
+for _, product_id in ipairs(ARGV) do
+    redis.call('ZADD', KEYS[2], version, product_id)
+end
+return version
+"""
+
+
+def log_product_changes(product_ids):
+    """
+    Queue the products for every process to refresh in its index
+    @param product_ids:
+    @return:
+    """
+    if not product_ids:
+        return
+
+    get_redis().eval(LOG_CHANGES_SCRIPT, 2, SEARCH_INDEX_VERSION_KEY, SEARCH_INDEX_CHANGES_KEY, *product_ids)
+
+
+def product_changed(product_ids):
+    """
+    Log the changes once they are committed
+    @param product_ids:
+    @return:
+    """
+    product_ids = list(product_ids)
+
+    def log():
+        try:
+            log_product_changes(product_ids)
+        except Exception as e:
+            logger.error(f"Search index change not logged - {e}")
+
+    transaction.on_commit(log)
+
+
+def search_products(query, limit=SEARCH_RESULTS_LIMIT):
+    """
+    @param query:
+    @param limit:
+    @return (list of product ids, total matches before the limit):
+    """
+    return get_search_index().search_with_total(query, limit)
+
+
+def autocomplete(prefix, limit=SEARCH_AUTOCOMPLETE_LIMIT):
+    return get_search_index().autocomplete(prefix, limit)
@@ -0,0 +1,136 @@
+from collections import Counter
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+import logging
+
+# models
+from shop.models import (
+    Product,
+    StockReservation
+)
+from shop.services.product_cache import invalidate_product_fragments
+
+# constant helper
+from utils.constants import *
+
+logger = logging.getLogger('django')
+
+
+class OutOfStockError(Exception):
+    def __init__(self, product_id):
+        self.product_id = product_id
+        super().__init__(f'Product {product_id} is out of stock')
+
+
+def _take_stock(product_id, quantity):
+    # UPDATE ... SET quantity = quantity - n WHERE id = x AND quantity >= n - no read, no select_for_update
+    return Product.objects.filter(
+        pk=product_id, status=True, quantity__gte=quantity
+    ).update(quantity=F('quantity') - quantity) == 1
+
+
+def _give_back_stock(product_quantities):
+    for product_id, quantity in product_quantities.items():
+        Product.objects.filter(pk=product_id).update(quantity=F('quantity') + quantity)
+
+
+def reserve_stock(order, items):
+    """
+    Take the stock of the order items and hold it until the payment completes.
+    Raises OutOfStockError and rolls back every item when one of them is not available
+    @param order:
+    @param items: list of (product_id, quantity)
+    @return list of reservations:
+    """
+    quantities = Counter()
+    for product_id, quantity in items:
+        quantities[int(product_id)] += int(quantity)
+
+    expires_at = timezone.now() + timedelta(minutes=STOCK_RESERVATION_TTL_MINUTES)
+    with transaction.atomic():
+        # sorted product ids, two orders with the same products lock them in the same order
+        for product_id in sorted(quantities):
+            if not _take_stock(product_id, quantities[product_id]):
+                raise OutOfStockError(product_id)
+
+        reservations = StockReservation.objects.bulk_create([
+            StockReservation(order=order, product_id=product_id, quantity=quantity, expires_at=expires_at)
+            for product_id, quantity in quantities.items()
+        ])
+
+    product_ids = list(quantities)
+    transaction.on_commit(lambda: invalidate_product_fragments(product_ids))
+    return reservations
+
+
+def commit_reservations(order):
+    """
+    Payment completed or cash on delivery - the reserved stock is sold.
+    Reservations released meanwhile (expired before a late payment) take their stock again.
+    Raises OutOfStockError and commits nothing when that stock is not available any more
+    @param order:
+    @return number of reservations committed:
+    """
+    with transaction.atomic():
+        committed = StockReservation.objects.filter(order=order, status=RESERVED).update(status=COMMITTED)
+
+        released = list(StockReservation.objects.select_for_update().filter(
+            order=order, status=RELEASED
+        ).order_by('product_id').only('id', 'product_id', 'quantity'))
+        for reservation in released:
+            if not _take_stock(reservation.product_id, reservation.quantity):
+                raise OutOfStockError(reservation.product_id)
+
+        if released:
+            StockReservation.objects.filter(pk__in=[reservation.pk for reservation in released]).update(status=COMMITTED)
+
+    product_ids = [reservation.product_id for reservation in released]
+    if product_ids:
+        transaction.on_commit(lambda: invalidate_product_fragments(product_ids))
+    return committed + len(released)
+
+
+def _release(reservations):
+    released = Counter()
+    with transaction.atomic():
+        for reservation in reservations:
+            # the conditional update makes a release happen only once, even with concurrent callers
+            if StockReservation.objects.filter(pk=reservation.pk, status=RESERVED).update(status=RELEASED):
+                released[reservation.product_id] += reservation.quantity
+
+        _give_back_stock(released)
+
+    product_ids = list(released)
+    transaction.on_commit(lambda: invalidate_product_fragments(product_ids))
+    return sum(released.values())
+
+
+def release_reservations(order):
+    """
+    Payment failed - give the reserved stock back
+    @param order:
+    @return quantity released:
+    """
+    return _release(StockReservation.objects.filter(order=order, status=RESERVED))
+
+
+def release_expired_reservations(batch_size=500):
+    """
+    Give back the stock of reservations whose payment never completed
+    @param batch_size:
+    @return quantity released:
+    """
+    released = 0
+    while True:
+        reservations = list(StockReservation.objects.filter(
+            status=RESERVED, expires_at__lt=timezone.now()
+        ).only('id', 'product_id', 'quantity')[:batch_size])
+
+        if not reservations:
+            break
+
+        released += _release(reservations)
+
+    return released
@@ -0,0 +1,209 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+import logging
+
+# models
+from .models import (
+    Category,
+    SubCategory,
+    Product
+)
+from shop.services.catalog import home_catalog_state, schedule_home_catalog_refresh
+from shop.services.product_cache import invalidate_product_fragments
+from shop.services.counters import product_counter_state, apply_product_counter_change
+from shop.services.images import queue_image_variants
+from shop.services.search import product_changed
+from shop.services.facets import invalidate_facets
+
+# constant helper
+from utils.constants import *
+
+logger = logging.getLogger('django')
+
+# update_fields may name a foreign key by its field name or its column
+HOME_CATALOG_UPDATE_FIELDS = frozenset(HOME_CATALOG_SOURCE_FIELDS) | {
+    field.removesuffix('_id') for field in HOME_CATALOG_SOURCE_FIELDS
+}
+
+
+@receiver(pre_save, sender=Product)
+def remember_home_catalog_state(sender, instance, update_fields=None, **kwargs):
+    """
+    Keep the stored values the home page snapshot is built from, to rebuild it only when one of them changes
+    @param sender:
+    @param instance:
+    @param update_fields:
+    @param kwargs:
+    @return:
+    """
+    instance._home_catalog_state = None
+    if update_fields is not None and not HOME_CATALOG_UPDATE_FIELDS & set(update_fields):
+        instance._home_catalog_state = home_catalog_state(instance)
+    elif instance.pk:
+        instance._home_catalog_state = Product.objects.filter(pk=instance.pk).values_list(
+            *HOME_CATALOG_SOURCE_FIELDS
+        ).first()
+
+
+@receiver(post_save, sender=Product)
+def product_catalog_changed(sender, instance, **kwargs):
+    """
+    Rebuild the home page catalog snapshot when a field it shows or selects the products by changed
+    @param sender:
+    @param instance:
+    @param kwargs:
+    @return:
+    """
+    if getattr(instance, '_home_catalog_state', None) != home_catalog_state(instance):
+        schedule_home_catalog_refresh()
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=SubCategory)
+@receiver(post_delete, sender=SubCategory)
+def catalog_changed(sender, **kwargs):
+    """
+    Rebuild the home page catalog snapshot once the change is committed
+    @param sender:
+    @param kwargs:
+    @return:
+    """
+    schedule_home_catalog_refresh()
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_counter_state(sender, instance, **kwargs):
+    """
+    Keep the stored status/category/subcategory to move the counters after save.
+    The row is locked until Product.save commits - a concurrent save reads the state this one writes
+    @param sender:
+    @param instance:
+    @param kwargs:
+    @return:
+    """
+    instance._counter_state = None
+    if instance.pk:
+        instance._counter_state = Product.objects.select_for_update().filter(pk=instance.pk).values_list(
+            'status', 'category_id', 'subcategory_id'
+        ).first()
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, raw=False, **kwargs):
+    """
+    Update the active product counters of category and subcategory
+    @param sender:
+    @param instance:
+    @param raw:
+    @param kwargs:
+    @return:
+    """
+    if raw:
+        return
+
+    apply_product_counter_change(getattr(instance, '_counter_state', None), product_counter_state(instance))
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    """
+    Update the active product counters of category and subcategory
+    @param sender:
+    @param instance:
+    @param kwargs:
+    @return:
+    """
+    apply_product_counter_change(product_counter_state(instance), None)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_page_changed(sender, instance, **kwargs):
+    """
+    Drop the cached product details fragment once the change is committed
+    @param sender:
+    @param instance:
+    @param kwargs:
+    @return:
+    """
+    product_id = instance.pk
+    transaction.on_commit(lambda: invalidate_product_fragments([product_id]))
+
+
+@receiver(post_save, sender=Category)
+def category_page_changed(sender, instance, **kwargs):
+    """
+    Drop the cached product details fragments of the category products
+    @param sender:
+    @param instance:
+    @param kwargs:
+    @return:
+    """
+    product_ids = list(Product.objects.filter(category=instance).values_list('id', flat=True))
+    transaction.on_commit(lambda: invalidate_product_fragments(product_ids))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=SubCategory)
+def image_changed(sender, instance, raw=False, **kwargs):
+    """
+    Build the resized jpeg/webp variants of a new or replaced image in the background
+    @param sender:
+    @param instance:
+    @param raw:
+    @param kwargs:
+    @return:
+    """
+    if raw:
+        return
+
+    queue_image_variants(instance)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_search_changed(sender, instance, **kwargs):
+    """
+    Refresh the product in the search index of every process
+    @param sender:
+    @param instance:
+    @param kwargs:
+    @return:
+    """
+    product_changed([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=SubCategory)
+def category_search_changed(sender, instance, **kwargs):
+    """
+    Category and subcategory names are indexed with the products - refresh their products
+    @param sender:
+    @param instance:
+    @param kwargs:
+    @return:
+    """
+    lookup = 'category' if sender is Category else 'subcategory'
+    product_changed(Product.objects.filter(**{lookup: instance}).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_facets_changed(sender, instance, **kwargs):
+    """
+    Drop the facet indexes of the old and the new subcategory of the product
+    @param sender:
+    @param instance:
+    @param kwargs:
+    @return:
+    """
+    subcategories = [(instance.category_id, instance.subcategory_id)]
+    old_state = getattr(instance, '_counter_state', None)
+    if old_state:
+        subcategories.append((old_state[1], old_state[2]))
+
+    invalidate_facets(subcategories)
@@ -0,0 +1,112 @@
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import re
+import threading
+
+PAYMENTS_PATH = re.compile(r'^/v1/orders/([^/]+)/payments$')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep-alive, the pooled client sends every call over the same connection
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.gateway.lock:
+            self.server.gateway.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _handle(self, route):
+        gateway = self.server.gateway
+        with gateway.lock:
+            gateway.requests += 1
+            failing = gateway.failing
+        if failing:
+            return self._respond(500, {'error': {'code': 'SERVER_ERROR', 'description': 'stub gateway failure'}})
+        return route(gateway)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.path != '/v1/orders':
+            return self._respond(404, {'error': {'code': 'BAD_REQUEST_ERROR', 'description': 'not found'}})
+        self._handle(lambda gateway: self._respond(200, gateway.create_order(json.loads(body or b'{}'))))
+
+    def do_GET(self):
+        match = PAYMENTS_PATH.match(self.path.split('?')[0])
+        if match is None:
+            return self._respond(404, {'error': {'code': 'BAD_REQUEST_ERROR', 'description': 'not found'}})
+        self._handle(lambda gateway: self._respond(200, gateway.order_payments(match.group(1))))
+
+
+class StubGateway:
+    """
+    Razorpay orders API on a local port for the tests and local development - orders and payments in memory.
+    Point RAZORPAY_BASE_URL at `url` and the pooled client talks to it
+    """
+
+    def __init__(self):
+        self.orders = {}
+        self.payments = defaultdict(list)
+        self.requests = 0
+        self.connections = 0
+        self.failing = False
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.daemon_threads = True
+        self.server.gateway = self
+        self._thread = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server.server_port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def create_order(self, data):
+        with self.lock:
+            order_id = f'order_stub{next(self._ids)}'
+            self.orders[order_id] = {'id': order_id, 'entity': 'order', 'status': 'created', **data}
+            return self.orders[order_id]
+
+    def add_payment(self, order_id, status):
+        """
+        @param order_id: razorpay order id
+        @param status: created, authorized, captured or failed
+        @return payment id:
+        """
+        with self.lock:
+            payment_id = f'pay_stub{next(self._ids)}'
+            self.payments[order_id].append({'id': payment_id, 'entity': 'payment', 'order_id': order_id, 'status': status})
+            return payment_id
+
+    def order_payments(self, order_id):
+        with self.lock:
+            items = list(self.payments.get(order_id, []))
+        return {'entity': 'collection', 'count': len(items), 'items': items}
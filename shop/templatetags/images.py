@@ -0,0 +1,39 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html
+
+# constant helper
+from utils.constants import *
+
+register = template.Library()
+
+
+def _srcset(variants):
+    return ', '.join(f'{default_storage.url(name)} {width}w' for width, name in sorted(variants.items(), key=lambda item: int(item[0])))
+
+
+@register.simple_tag
+def responsive_image(image, variants, css_class='img-fluid', sizes=IMAGE_DERIVATIVE_SIZES, alt='...'):
+    """
+    <picture> with the webp and jpeg variants of an image, plain <img> until the variants are built
+    @param image: image name or FieldFile
+    @param variants: image_variants of the category, subcategory or product
+    @param css_class:
+    @param sizes: rendered width of the image for the browser to pick a variant
+    @param alt:
+    @return:
+    """
+    name = str(image) if image else ''
+    src = default_storage.url(name) if name else ''
+
+    if not variants or variants.get('source') != name:
+        return format_html('<img class="{}" src="{}" alt="{}"/>', css_class, src, alt)
+
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}"/>'
+        '<img class="{}" src="{}" srcset="{}" sizes="{}" alt="{}" loading="lazy"/>'
+        '</picture>',
+        _srcset(variants['webp']), sizes,
+        css_class, src, _srcset(variants['jpeg']), sizes, alt
+    )
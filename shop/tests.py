@@ -1,3 +1,1117 @@
-from django.test import TestCase
+from datetime import timedelta
+import hashlib
+import hmac
+import json
+import os
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+# models
+from shop.models import (
+    User,
+    Category,
+    SubCategory,
+    Product,
+    Cart,
+    Order,
+    OrderItem,
+    ProductDailySales,
+    DistrictDailySales,
+    StockReservation
+)
+from shop.services.abandoned_cart import AbandonedCartMailError, send_abandoned_cart_mails_to
+from shop.services.cart import cart_lines
+from shop.services.cart_store import CartStore, flush_cart
+from shop.services.catalog_io import CatalogImporter
+from shop.services.catalog import (
+    build_home_catalog,
+    best_deal_products,
+    new_arrival_products,
+    catalog_tree_products,
+    subcategory_listing_products
+)
+from shop.services.facets import FacetIndex, facet_products
+from shop.services.orders import ORDER_LIST_ORDERING, user_orders, provider_orders
+from shop.services.payments import create_gateway_order
+from shop.services.product_cache import product_with_category
+from shop.services.rankings import DecayedScores, compute_rankings
+from shop.services.reconciliation import apply_gateway_statuses, reconcile_pending_orders
+from shop.services.rollups import record_order_sales, rebuild_sales_rollups, rollup_sales_days
+from shop.services.search import SearchIndex
+from shop.services.stock import (
+    OutOfStockError,
+    reserve_stock,
+    commit_reservations,
+    release_reservations,
+    release_expired_reservations
+)
+from shop.stub_gateway import StubGateway
+
+# constant helper
+from utils.constants import *
+from utils.helper import explain, razorpay_login
+
+CART_LINES = 10
+
+# rows per table for the plan checks - MySQL scans tiny tables regardless of indexes
+PLAN_ROWS = 2000
+
+# small lookup tables, a scan of these is expected
+SCAN_ALLOWED_TABLES = ('shop_category', 'shop_subcategory')
+
+
+def create_order(user, **fields):
+    values = dict(
+        user=user, amount=100, street_name='street', city='city', district='district', state='state',
+        pincode='600001', ordered_date=timezone.now(), payment_type=ONLINE_PAYMENT.replace(' ', '_'),
+        payment_status=PENDING, order_status=PENDING, provider_order_id='', payment_id='', signature_id=''
+    )
+    values.update(fields)
+    return Order.objects.create(**values)
+
+
+class MemoryRedis:
+    """
+    The redis hash and set commands of the cart store, kept in memory for the tests
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def hexists(self, key, field):
+        return str(field) in self.data.get(key, {})
+
+    def hget(self, key, field):
+        return self.data.get(key, {}).get(str(field))
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        values = self.data.setdefault(key, {})
+        items = dict(mapping or {})
+        if field is not None:
+            items[field] = value
+        added = len([item for item in items if str(item) not in values])
+        values.update({str(item): str(value) for item, value in items.items()})
+        return added
+
+    def hdel(self, key, *fields):
+        values = self.data.get(key, {})
+        return len([values.pop(str(field)) for field in fields if str(field) in values])
+
+    def sadd(self, key, *members):
+        values = self.data.setdefault(key, set())
+        added = len({str(member) for member in members} - values)
+        values.update(str(member) for member in members)
+        return added
+
+    def srem(self, key, *members):
+        values = self.data.get(key, set())
+        removed = len({str(member) for member in members} & values)
+        values.difference_update(str(member) for member in members)
+        return removed
+
+    def sismember(self, key, member):
+        return str(member) in self.data.get(key, set())
+
+    def expire(self, key, seconds):
+        return key in self.data
+
+    def delete(self, *keys):
+        return len([self.data.pop(key) for key in keys if key in self.data])
+
+    def pipeline(self):
+        return MemoryPipeline(self)
+
+
+class MemoryPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append((getattr(self.redis, name), args, kwargs))
+
+    def execute(self):
+        return [command(*args, **kwargs) for command, args, kwargs in self.commands]
+
+
+class CartStoreTestCase(TestCase):
+    """
+    Cart store on an in-memory redis, the write-behind task is recorded instead of queued
+    """
+
+    def setUp(self):
+        self.redis = MemoryRedis()
+        self.persist_cart = mock.Mock()
+        for patcher in (
+            mock.patch('shop.services.cart_store.get_redis', return_value=self.redis),
+            mock.patch('shop.celery.tasks.persist_cart.apply_async', self.persist_cart),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        category = Category.objects.create(name='category', description='category')
+        subcategory = SubCategory.objects.create(name='subcategory', category=category, description='subcategory')
+        self.products = [
+            Product.objects.create(
+                category=category, subcategory=subcategory, name=f'product {index}', description='product',
+                quantity=5, original_price=200, selling_price=150, status=True
+            )
+            for index in range(3)
+        ]
+        self.user = User.objects.create_user(email='buyer@example.com', username='buyer', password='secret')
+
+    def cart_rows(self):
+        return dict(Cart.objects.filter(user=self.user, is_purchased=False).values_list('product_id', 'quantity'))
+
+
+@mock.patch('shop.views.flush_cart')
+class CartQueryCountTests(TestCase):
+    """
+    The cart list and the checkout page read the cart with a constant number of queries, whatever its size
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='buyer@example.com', username='buyer', password='secret')
+        self.client.force_login(self.user)
+        category = Category.objects.create(name='category', description='category')
+        self.subcategory = SubCategory.objects.create(name='subcategory', category=category, description='subcategory')
+
+    def add_cart_lines(self, count):
+        for _ in range(count):
+            product = Product.objects.create(
+                category=self.subcategory.category, subcategory=self.subcategory, name='product',
+                description='product', quantity=10, original_price=200, selling_price=150, status=True
+            )
+            Cart.objects.create(user=self.user, product=product, quantity=2)
+
+    def queries(self, url, template):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertTemplateUsed(response, template)
+        return len(queries)
+
+    def assert_constant_queries(self, url, template):
+        self.add_cart_lines(1)
+        single_line = self.queries(url, template)
+
+        self.add_cart_lines(CART_LINES - 1)
+        with self.assertNumQueries(single_line):
+            response = self.client.get(url)
+        self.assertTemplateUsed(response, template)
+        self.assertEqual(response.context['item_count'], CART_LINES * 2)
+
+    def test_cart_list(self, flush_cart):
+        self.assert_constant_queries(reverse('carts'), 'shop/cart/cart_list.html')
+
+    def test_checkout(self, flush_cart):
+        self.assert_constant_queries(reverse('checkout'), 'shop/cart/checkout.html')
+
+
+
+class CartStoreTests(CartStoreTestCase):
+    """
+    Carts live in redis hashes, user carts are loaded from and written behind to the Cart table
+    """
+
+    def test_user_cart_is_loaded_from_the_table(self):
+        Cart.objects.create(user=self.user, product=self.products[0], quantity=2)
+        cart = CartStore.for_user(self.user.id)
+
+        self.assertEqual(cart.items(), {self.products[0].id: 2})
+        self.assertEqual(cart.get(self.products[0].id), 2)
+        self.assertIsNone(cart.get(self.products[1].id))
+
+    def test_changes_are_written_behind_together(self):
+        Cart.objects.create(user=self.user, product=self.products[0], quantity=2)
+        cart = CartStore.for_user(self.user.id)
+        cart.set(self.products[1].id, 3)
+        cart.set(self.products[2].id, 1)
+        cart.remove(self.products[0].id)
+
+        # one pending write for the three changes, the table is not touched before it runs
+        self.persist_cart.assert_called_once()
+        self.assertEqual(self.cart_rows(), {self.products[0].id: 2})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            flush_cart(self.user.id)
+
+        self.assertEqual(self.cart_rows(), {self.products[1].id: 3, self.products[2].id: 1})
+        self.assertFalse(self.redis.sismember(CART_DIRTY_USERS_KEY, self.user.id))
+
+        # nothing left to write
+        with mock.patch.object(CartStore, 'persist') as persist:
+            flush_cart(self.user.id)
+        persist.assert_not_called()
+
+    def test_guest_cart_is_merged_at_login(self):
+        Cart.objects.create(user=self.user, product=self.products[0], quantity=2)
+        Cart.objects.create(user=self.user, product=self.products[1], quantity=1)
+        session = {}
+        guest_cart = CartStore.for_guest(session)
+        guest_cart.set_many({self.products[1].id: 4, self.products[2].id: 1})
+
+        # guest carts are not written to the table
+        self.persist_cart.assert_not_called()
+
+        guest_cart.merge_into(CartStore.for_user(self.user.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            flush_cart(self.user.id)
+
+        # the quantities of the guest cart win
+        self.assertEqual(self.cart_rows(), {self.products[0].id: 2, self.products[1].id: 4, self.products[2].id: 1})
+        self.assertEqual(CartStore.for_guest(session).items(), {})
+
+
+class BulkAddToCartTests(CartStoreTestCase):
+    """
+    The bulk add-to-cart endpoint adds the available items in one call and reports every item
+    """
+
+    def post(self, items, **headers):
+        headers.setdefault('HTTP_X_REQUESTED_WITH', 'XMLHttpRequest')
+        return self.client.post(
+            reverse('cart_add_bulk'), json.dumps({'items': items}), content_type='application/json', **headers
+        )
+
+    def items(self):
+        Product.objects.filter(pk=self.products[2].pk).update(status=False)
+        return [
+            {'product_id': self.products[0].id, 'quantity': 2},
+            {'product_id': self.products[1].id, 'quantity': 6},
+            {'product_id': self.products[2].id, 'quantity': 1},
+            {'product_id': self.products[1].id, 'quantity': 0},
+        ]
+
+    def assert_item_statuses(self, response):
+        self.assertEqual(response.json()['status'], 'Cart updated!')
+        self.assertEqual([item['status'] for item in response.json()['items']], [
+            'Product added to cart', 'Product not available', 'Product not available', 'Invalid quantity'
+        ])
+
+    def test_user_items_are_upserted(self):
+        Cart.objects.create(user=self.user, product=self.products[0], quantity=1)
+        self.client.force_login(self.user)
+
+        response = self.post(self.items())
+
+        self.assert_item_statuses(response)
+        self.assertEqual(self.cart_rows(), {self.products[0].id: 2})
+        self.assertEqual(CartStore.for_user(self.user.id).items(), {self.products[0].id: 2})
+
+    def test_guest_items_stay_in_redis(self):
+        response = self.post(self.items())
+
+        self.assert_item_statuses(response)
+        self.assertEqual(CartStore.for_guest(self.client.session).items(), {self.products[0].id: 2})
+        self.assertFalse(Cart.objects.exists())
+
+    def test_invalid_requests(self):
+        too_many = [{'product_id': self.products[0].id, 'quantity': 1}] * (CART_BULK_ITEMS_LIMIT + 1)
+        self.assertEqual(self.post(too_many).status_code, 400)
+        self.assertEqual(self.post([{'product_id': 'x', 'quantity': 1}]).status_code, 400)
+        self.assertEqual(self.post([{'quantity': 1}]).status_code, 400)
+        self.assertEqual(self.post(self.items(), HTTP_X_REQUESTED_WITH='').json()['status'], 'Invalid access')
+        self.assertFalse(Cart.objects.exists())
+
+
+class AbandonedCartMailTests(TestCase):
+    """
+    A cart is marked as mailed only when its mail was sent, the failed users are raised for a retry
+    """
+
+    def setUp(self):
+        category = Category.objects.create(name='category', description='category')
+        subcategory = SubCategory.objects.create(name='subcategory', category=category, description='subcategory')
+        product = Product.objects.create(
+            category=category, subcategory=subcategory, name='product', description='product',
+            quantity=10, original_price=200, selling_price=150, status=True
+        )
+        self.users = [
+            User.objects.create_user(email=f'buyer{index}@example.com', username=f'buyer{index}', password='secret')
+            for index in range(2)
+        ]
+        for user in self.users:
+            Cart.objects.create(user=user, product=product, quantity=1)
+
+        self.window_end = timezone.now()
+        self.window_start = self.window_end - timedelta(days=1)
+        Cart.objects.update(updated_at=self.window_end - timedelta(hours=1))
+
+    def send(self):
+        return send_abandoned_cart_mails_to([user.id for user in self.users], self.window_start, self.window_end)
+
+    def mailed_users(self):
+        return set(Cart.objects.filter(abandoned_mail_sent_at__isnull=False).values_list('user_id', flat=True))
+
+    def test_sent_carts_are_marked(self):
+        self.assertEqual(self.send(), 2)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(self.mailed_users(), {user.id for user in self.users})
+
+        # a second run finds nothing left to mail
+        self.assertEqual(self.send(), 0)
+
+    def test_failed_send_is_not_marked(self):
+        failing = self.users[1].email
+        send = mail.EmailMessage.send
+
+        def send_or_fail(message, *args, **kwargs):
+            if failing in message.to:
+                raise OSError('smtp down')
+            return send(message, *args, **kwargs)
+
+        with mock.patch.object(mail.EmailMessage, 'send', send_or_fail):
+            with self.assertRaises(AbandonedCartMailError) as raised:
+                self.send()
+
+        self.assertEqual(raised.exception.user_ids, [self.users[1].id])
+        self.assertEqual(self.mailed_users(), {self.users[0].id})
+
+        # the retry mails the failed user only
+        self.assertEqual(self.send(), 1)
+        self.assertEqual(self.mailed_users(), {user.id for user in self.users})
+
+
+
+class CatalogImportTests(TestCase):
+    """
+    Catalog rows are validated one by one, a re-import keeps the stock held by open reservations
+    """
+
+    def setUp(self):
+        category = Category.objects.create(name='category', description='category')
+        SubCategory.objects.create(name='subcategory', category=category, description='subcategory')
+
+    def row(self, **values):
+        row = {
+            'sku': 'SKU-1', 'name': 'product', 'category': 'category', 'subcategory': 'subcategory',
+            'description': 'product', 'quantity': '10', 'original_price': '200', 'selling_price': '150',
+            'status': '1', 'is_exclusive': '0',
+        }
+        row.update(values)
+        return row
+
+    def test_invalid_rows_are_reported(self):
+        importer = CatalogImporter()
+        stats = importer.run([
+            self.row(),
+            self.row(sku='S' * 65),
+            self.row(sku='SKU-2', name=''),
+            self.row(sku='SKU-3', selling_price='nan'),
+            self.row(sku='SKU-4', quantity='-1'),
+            self.row(sku='SKU-5', original_price='1e400'),
+            self.row(sku='SKU-6', category='unknown'),
+        ])
+
+        self.assertEqual(stats, {'rows': 7, 'upserted': 1, 'errors': 6})
+        self.assertEqual([error.split(':')[0] for error in importer.errors], [f'line {line}' for line in range(3, 9)])
+        self.assertEqual(list(Product.objects.values_list('sku', 'quantity', 'discount_percent')), [('SKU-1', 10, 25.0)])
+
+    def test_reimport_keeps_reserved_stock(self):
+        CatalogImporter().run([self.row()])
+        product = Product.objects.get(sku='SKU-1')
+        user = User.objects.create_user(email='buyer@example.com', username='buyer', password='secret')
+        order = create_order(user)
+        reserve_stock(order, [(product.id, 3)])
+
+        # 10 units on hand, 3 of them held by the open reservation
+        CatalogImporter().run([self.row(quantity='10', selling_price='120')])
+        product.refresh_from_db()
+        self.assertEqual((product.quantity, product.selling_price), (7, 120))
+
+        release_reservations(order)
+        product.refresh_from_db()
+        self.assertEqual(product.quantity, 10)
+
+
+
+class SalesRollupTests(TestCase):
+    """
+    A rebuild from the orders gives the same rollups as the sales recorded one by one
+    """
+
+    def setUp(self):
+        category = Category.objects.create(name='category', description='category')
+        subcategory = SubCategory.objects.create(name='subcategory', category=category, description='subcategory')
+        self.products = [
+            Product.objects.create(
+                category=category, subcategory=subcategory, name=f'product {index}', description='product',
+                quantity=10, original_price=200, selling_price=150, status=True
+            )
+            for index in range(2)
+        ]
+        self.user = User.objects.create_user(email='buyer@example.com', username='buyer', password='secret')
+
+    def order(self, ordered_date, district, lines, **fields):
+        order = create_order(
+            self.user, ordered_date=ordered_date, district=district,
+            amount=sum(quantity * 150 for _, quantity in lines), **fields
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=quantity, amount=quantity * 150)
+            for product, quantity in lines
+        ])
+        return order
+
+    def rollups(self):
+        return (
+            set(ProductDailySales.objects.values_list('day', 'product_id', 'units', 'revenue')),
+            set(DistrictDailySales.objects.values_list('day', 'district', 'orders', 'revenue')),
+        )
+
+    def test_rebuild_matches_recorded_sales(self):
+        now = timezone.now()
+        first, second = self.products
+        sales = [
+            self.order(now - timedelta(days=1), 'Chennai', [(first, 2), (second, 1)], payment_status=COMPLETED),
+            self.order(now - timedelta(days=1), 'Madurai', [(first, 1)], payment_status=COMPLETED),
+            self.order(now, 'Chennai', [(second, 3)], payment_type=CASH_ON_DELIVERY.replace(' ', '_')),
+        ]
+        # not sales - a pending payment and a refunded order
+        self.order(now, 'Chennai', [(first, 5)])
+        self.order(now, 'Chennai', [(first, 4)], payment_status=REFUND, order_status=CANCELLED)
+
+        for order in sales:
+            record_order_sales([order.id])
+        recorded = self.rollups()
+
+        stats = rebuild_sales_rollups()
+        self.assertEqual(self.rollups(), recorded)
+        self.assertEqual(stats['product_rows'], 3)
+
+        today = rollup_sales_days(timezone.localdate(now), timezone.localdate(now))[timezone.localdate(now)]
+        self.assertEqual((today['orders'], today['units'], today['revenue']), (1, 3, 450.0))
+
+
+
+class StockReservationTests(TestCase):
+    """
+    Stock is taken with conditional updates when an order is placed, then committed or given back once
+    """
+
+    def setUp(self):
+        category = Category.objects.create(name='category', description='category')
+        subcategory = SubCategory.objects.create(name='subcategory', category=category, description='subcategory')
+        self.products = [
+            Product.objects.create(
+                category=category, subcategory=subcategory, name=f'product {index}', description='product',
+                quantity=5, original_price=200, selling_price=150, status=True
+            )
+            for index in range(2)
+        ]
+        self.user = User.objects.create_user(email='buyer@example.com', username='buyer', password='secret')
+
+    def stock(self):
+        return [Product.objects.get(pk=product.pk).quantity for product in self.products]
+
+    def statuses(self, order):
+        return set(StockReservation.objects.filter(order=order).values_list('status', flat=True))
+
+    def test_reserve_takes_the_stock(self):
+        order = create_order(self.user)
+        reservations = reserve_stock(order, [(self.products[0].id, 2), (self.products[1].id, 1), (self.products[0].id, 1)])
+
+        self.assertEqual(len(reservations), 2)
+        self.assertEqual(self.stock(), [2, 4])
+        self.assertEqual(self.statuses(order), {RESERVED})
+
+    def test_out_of_stock_reserves_nothing(self):
+        order = create_order(self.user)
+        with self.assertRaises(OutOfStockError) as raised:
+            reserve_stock(order, [(self.products[0].id, 2), (self.products[1].id, 6)])
+
+        self.assertEqual(raised.exception.product_id, self.products[1].id)
+        self.assertEqual(self.stock(), [5, 5])
+        self.assertFalse(StockReservation.objects.filter(order=order).exists())
+
+    def test_hidden_product_is_not_reserved(self):
+        Product.objects.filter(pk=self.products[0].pk).update(status=False)
+        with self.assertRaises(OutOfStockError):
+            reserve_stock(create_order(self.user), [(self.products[0].id, 1)])
+        self.assertEqual(self.stock(), [5, 5])
+
+    def test_commit_keeps_the_stock_sold(self):
+        order = create_order(self.user)
+        reserve_stock(order, [(self.products[0].id, 3)])
+
+        self.assertEqual(commit_reservations(order), 1)
+        self.assertEqual(self.statuses(order), {COMMITTED})
+
+        # a late failure callback does not give sold stock back
+        self.assertEqual(release_reservations(order), 0)
+        self.assertEqual(self.stock(), [2, 5])
+
+    def test_release_gives_the_stock_back_once(self):
+        order = create_order(self.user)
+        reserve_stock(order, [(self.products[0].id, 3), (self.products[1].id, 2)])
+
+        self.assertEqual(release_reservations(order), 5)
+        self.assertEqual(release_reservations(order), 0)
+        self.assertEqual(self.stock(), [5, 5])
+        self.assertEqual(self.statuses(order), {RELEASED})
+
+    def test_expired_reservations_are_released(self):
+        expired, current = create_order(self.user), create_order(self.user)
+        reserve_stock(expired, [(self.products[0].id, 2)])
+        reserve_stock(current, [(self.products[1].id, 1)])
+        StockReservation.objects.filter(order=expired).update(expires_at=timezone.now() - timedelta(minutes=1))
+
+        self.assertEqual(release_expired_reservations(batch_size=1), 2)
+        self.assertEqual(self.stock(), [5, 4])
+        self.assertEqual(self.statuses(expired), {RELEASED})
+        self.assertEqual(self.statuses(current), {RESERVED})
+
+    def test_late_commit_takes_released_stock_again(self):
+        order = create_order(self.user)
+        reserve_stock(order, [(self.products[0].id, 4)])
+        release_reservations(order)
+
+        # the released stock was sold meanwhile
+        other = create_order(self.user)
+        reserve_stock(other, [(self.products[0].id, 3)])
+        with self.assertRaises(OutOfStockError):
+            commit_reservations(order)
+        self.assertEqual(self.statuses(order), {RELEASED})
+
+        release_reservations(other)
+        self.assertEqual(commit_reservations(order), 1)
+        self.assertEqual(self.stock(), [1, 5])
+
+
+class RankingTests(TestCase):
+    """
+    Trending from the recent sales and carts, best sellers from the daily rollups - hidden products left out
+    """
+
+    def setUp(self):
+        for key in (RANKINGS_CACHE_KEY, HOME_CATALOG_CACHE_KEY):
+            cache.delete(key)
+            self.addCleanup(cache.delete, key)
+
+        category = Category.objects.create(name='category', description='category')
+        self.subcategories = [
+            SubCategory.objects.create(name=f'subcategory {index}', category=category, description='subcategory')
+            for index in range(2)
+        ]
+        self.products = [
+            Product.objects.create(
+                category=category, subcategory=self.subcategories[0], name=f'product {index}', description='product',
+                quantity=10, original_price=200, selling_price=150, status=index != 3
+            )
+            for index in range(4)
+        ]
+        # flagged by an earlier run, nothing sells now
+        self.stale = Product.objects.create(
+            category=category, subcategory=self.subcategories[1], name='stale', description='product',
+            quantity=10, original_price=200, selling_price=150, status=True, trending=True
+        )
+        SubCategory.objects.filter(pk=self.subcategories[1].pk).update(trending=True)
+        self.user = User.objects.create_user(email='buyer@example.com', username='buyer', password='secret')
+        self.now = timezone.now()
+
+    def sold(self, product, quantity, age, **fields):
+        values = dict(payment_status=COMPLETED, order_status=IN_PROGRES)
+        values.update(fields)
+        order = create_order(self.user, ordered_date=self.now - age, **values)
+        OrderItem.objects.create(order=order, product=product, quantity=quantity, amount=quantity * 150)
+
+    def daily_sales(self, product, units, age):
+        ProductDailySales.objects.create(
+            day=timezone.localdate(self.now) - age, product=product, units=units, revenue=units * 150
+        )
+
+    def test_decayed_scores(self):
+        scores = DecayedScores(1000.0, {'ranking': 100.0})
+        scores.add([3, 1, 3], [1, 4, 2], [1000.0, 800.0, 900.0])
+
+        self.assertAlmostEqual(scores.scores['ranking'][3], 1 + 2 * 0.5)
+        self.assertAlmostEqual(scores.scores['ranking'][1], 4 * 0.25)
+        self.assertEqual(scores.top('ranking', 5), [3, 1])
+        self.assertEqual(scores.events, 3)
+
+    def test_rankings_and_trending_flags(self):
+        first, second, third, hidden = self.products
+        self.daily_sales(first, 10, timedelta(days=60))
+        self.daily_sales(second, 4, timedelta(days=0))
+        self.daily_sales(hidden, 50, timedelta(days=0))
+        # older than the best seller window
+        self.daily_sales(third, 100, timedelta(days=BEST_SELLER_WINDOW_DAYS + 1))
+
+        self.sold(third, 2, timedelta(hours=1))
+        self.sold(hidden, 20, timedelta(hours=1))
+        # older than the trending window, cancelled or still unpaid - not counted
+        self.sold(second, 100, timedelta(days=TRENDING_WINDOW_DAYS + 1))
+        self.sold(second, 100, timedelta(hours=1), order_status=CANCELLED)
+        self.sold(second, 100, timedelta(hours=1), payment_status=PENDING, order_status=PENDING)
+
+        Cart.objects.create(user=self.user, product=first, quantity=5)
+        Cart.objects.create(user=self.user, product=second, quantity=50, is_purchased=True)
+
+        rankings = compute_rankings(self.now)
+
+        self.assertEqual(rankings['best_sellers'], [second.id, first.id])
+        self.assertEqual(rankings['trending'], [third.id, first.id])
+        self.assertEqual(cache.get(RANKINGS_CACHE_KEY)['trending'], [third.id, first.id])
+        self.assertEqual(rankings['trending_flags_changed'], 3)
+
+        self.assertEqual(set(Product.objects.filter(trending=True).values_list('id', flat=True)), {first.id, third.id})
+        self.assertEqual(list(SubCategory.objects.filter(trending=True)), [self.subcategories[0]])
+
+        home_catalog = cache.get(HOME_CATALOG_CACHE_KEY)
+        self.assertEqual([product['id'] for product in home_catalog['trending']], [third.id, first.id])
+        self.assertEqual([product['id'] for product in home_catalog['best_sellers']], [second.id, first.id])
+
+
+class StubGatewayTestCase(TestCase):
+    """
+    The pooled razorpay client of a test talks to a stub gateway on a local port
+    """
+
+    def setUp(self):
+        self.gateway = StubGateway().start()
+        self.addCleanup(self.gateway.stop)
+        for patcher in (
+            mock.patch.dict(os.environ, {'RAZORPAY_BASE_URL': self.gateway.url}),
+            # a fresh client for the stub, the process client is restored afterwards
+            mock.patch('utils.helper._razorpay_client', None),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        category = Category.objects.create(name='category', description='category')
+        subcategory = SubCategory.objects.create(name='subcategory', category=category, description='subcategory')
+        self.product = Product.objects.create(
+            category=category, subcategory=subcategory, name='product', description='product',
+            quantity=10, original_price=200, selling_price=150, status=True
+        )
+        self.user = User.objects.create_user(email='buyer@example.com', username='buyer', password='secret')
+
+    def reserved_order(self, quantity=1, **fields):
+        order = create_order(self.user, **fields)
+        reserve_stock(order, [(self.product.id, quantity)])
+        return order
+
+    def stock(self):
+        self.product.refresh_from_db()
+        return self.product.quantity
+
+
+class RazorpayClientTests(StubGatewayTestCase):
+    """
+    One razorpay client per process, its calls reuse a keep-alive connection
+    """
+
+    def test_client_is_reused(self):
+        self.assertIs(razorpay_login(), razorpay_login())
+
+    def test_gateway_orders_share_one_connection(self):
+        orders = [self.reserved_order() for _ in range(3)]
+        provider_order_ids = [create_gateway_order(order) for order in orders]
+
+        self.assertEqual(len(set(provider_order_ids)), 3)
+        self.assertEqual(sorted(provider_order_ids), sorted(self.gateway.orders))
+        self.assertEqual(
+            list(Order.objects.filter(pk__in=[order.pk for order in orders]).order_by('id').values_list('provider_order_id', flat=True)),
+            provider_order_ids
+        )
+        self.assertEqual(self.gateway.orders[provider_order_ids[0]]['amount'], 100 * 100)
+        self.assertEqual((self.gateway.requests, self.gateway.connections), (3, 1))
+
+    def test_gateway_failure_releases_the_stock(self):
+        order = self.reserved_order(quantity=2)
+        self.assertEqual(self.stock(), 8)
+
+        self.gateway.failing = True
+        with self.assertRaises(Exception):
+            create_gateway_order(order)
+
+        order.refresh_from_db()
+        self.assertEqual((order.payment_status, order.order_status, order.provider_order_id), (ERROR, CANCELLED, ''))
+        self.assertEqual(self.stock(), 10)
+
+
+
+class ReconciliationTests(StubGatewayTestCase):
+    """
+    Pending online orders are settled from the payments the gateway has for them
+    """
+
+    def gateway_order(self, age, payment=None, quantity=1):
+        order = self.reserved_order(quantity=quantity)
+        create_gateway_order(order)
+        if payment is not None:
+            self.gateway.add_payment(order.provider_order_id, payment)
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - age)
+        return order
+
+    def assert_order(self, order, payment_status, order_status, reservation_status):
+        order.refresh_from_db()
+        self.assertEqual(
+            (order.payment_status, order.order_status, order.reservations.get().status),
+            (payment_status, order_status, reservation_status)
+        )
+
+    def test_pending_orders_are_settled(self):
+        paid = self.gateway_order(timedelta(minutes=20), 'captured')
+        failed = self.gateway_order(timedelta(minutes=30), 'failed')
+        abandoned = self.gateway_order(timedelta(hours=PAYMENT_ABANDON_HOURS + 1))
+        # a failed attempt inside the reservation time can still be retried by the buyer
+        retrying = self.gateway_order(timedelta(minutes=RECONCILIATION_GRACE_MINUTES + 2), 'failed')
+        # left to the callback
+        recent = self.gateway_order(timedelta(minutes=1), 'captured')
+        settled = self.gateway_order(timedelta(minutes=20), 'captured')
+        Order.objects.filter(pk=settled.pk).update(payment_status=COMPLETED, order_status=IN_PROGRES)
+        self.assertEqual(self.stock(), 4)
+        requests = self.gateway.requests
+
+        stats = reconcile_pending_orders(batch_size=2, workers=3)
+
+        self.assertEqual(
+            {key: stats[key] for key in ('scanned', 'completed', 'failed', 'refunded', 'unchanged', 'errors')},
+            {'scanned': 4, 'completed': 1, 'failed': 2, 'refunded': 0, 'unchanged': 1, 'errors': 0}
+        )
+        self.assertEqual(self.gateway.requests - requests, 4)
+        self.assertEqual(cache.get(RECONCILIATION_STATS_CACHE_KEY)['scanned'], 4)
+
+        self.assert_order(paid, COMPLETED, IN_PROGRES, COMMITTED)
+        self.assert_order(failed, ERROR, PENDING, RELEASED)
+        self.assert_order(abandoned, ERROR, PENDING, RELEASED)
+        self.assert_order(retrying, PENDING, PENDING, RESERVED)
+        self.assert_order(recent, PENDING, PENDING, RESERVED)
+        self.assertEqual(self.stock(), 6)
+
+    def test_gateway_errors_leave_the_orders_pending(self):
+        order = self.gateway_order(timedelta(minutes=20), 'captured')
+        self.gateway.failing = True
+
+        stats = reconcile_pending_orders()
+
+        self.assertEqual((stats['scanned'], stats['errors']), (1, 1))
+        self.assert_order(order, PENDING, PENDING, RESERVED)
+
+    def test_late_payment_takes_the_stock_again(self):
+        order = self.gateway_order(timedelta(hours=1), 'captured', quantity=2)
+        release_reservations(order)
+        self.assertEqual(self.stock(), 10)
+
+        reconcile_pending_orders()
+
+        self.assert_order(order, COMPLETED, IN_PROGRES, COMMITTED)
+        self.assertEqual(self.stock(), 8)
+
+    def test_late_payment_without_stock_is_refunded(self):
+        order = self.gateway_order(timedelta(hours=1), 'captured', quantity=2)
+        release_reservations(order)
+        Product.objects.filter(pk=self.product.pk).update(quantity=1)
+
+        stats = reconcile_pending_orders()
+
+        self.assertEqual(stats['refunded'], 1)
+        self.assert_order(order, REFUND, CANCELLED, RELEASED)
+        self.assertEqual(self.stock(), 1)
+
+    def test_order_settled_by_the_callback_is_skipped(self):
+        order = self.gateway_order(timedelta(minutes=20), 'captured')
+        Order.objects.filter(pk=order.pk).update(payment_status=COMPLETED, order_status=IN_PROGRES)
+        commit_reservations(order)
+
+        self.assertEqual(apply_gateway_statuses({order.id: (ERROR, 'pay_failed')}), ([], [], []))
+        self.assert_order(order, COMPLETED, IN_PROGRES, COMMITTED)
+        self.assertEqual(self.stock(), 9)
+
+
+class PaymentCallbackTests(StubGatewayTestCase):
+    """
+    A payment is applied once however many callbacks razorpay sends, a payment for sold stock is refunded
+    """
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.dict(os.environ, {'RAZOR_KEY_SECRET': 'secret'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch('shop.celery.tasks.complete_order_purchase.delay')
+        self.complete_order_purchase = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def paid_order(self, quantity=2):
+        order = self.reserved_order(quantity, amount=quantity * 150)
+        OrderItem.objects.create(order=order, product=self.product, quantity=quantity, amount=quantity * 150)
+        create_gateway_order(order)
+        order.refresh_from_db()
+        return order, self.gateway.add_payment(order.provider_order_id, 'captured')
+
+    def callback(self, provider_order_id, payment_id, signature=None):
+        if signature is None:
+            signature = hmac.new(
+                b'secret', f'{provider_order_id}|{payment_id}'.encode(), digestmod=hashlib.sha256
+            ).hexdigest()
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('callback'), {
+                'razorpay_order_id': provider_order_id,
+                'razorpay_payment_id': payment_id,
+                'razorpay_signature': signature,
+            })
+
+    def assert_order(self, order, payment_status, order_status):
+        order.refresh_from_db()
+        self.assertEqual((order.payment_status, order.order_status), (payment_status, order_status))
+
+    def test_duplicate_callback_is_applied_once(self):
+        order, payment_id = self.paid_order()
+
+        for _ in range(2):
+            response = self.callback(order.provider_order_id, payment_id)
+            self.assertEqual(response.context['status'], 'Success')
+
+        self.assert_order(order, COMPLETED, IN_PROGRES)
+        self.assertEqual(order.payment_id, payment_id)
+        self.assertEqual(self.stock(), 8)
+        self.assertEqual(set(StockReservation.objects.filter(order=order).values_list('status', flat=True)), {COMMITTED})
+        self.assertEqual(list(ProductDailySales.objects.values_list('units', flat=True)), [2])
+        self.complete_order_purchase.assert_called_once_with(order.id)
+
+    def test_invalid_signature_changes_nothing(self):
+        order, payment_id = self.paid_order()
+
+        response = self.callback(order.provider_order_id, payment_id, signature='forged')
+
+        self.assertEqual(response.status_code, 400)
+        self.assert_order(order, PENDING, PENDING)
+        self.assertEqual(self.stock(), 8)
+        self.complete_order_purchase.assert_not_called()
+
+    def test_payment_for_sold_stock_is_refunded(self):
+        order, payment_id = self.paid_order()
+        release_reservations(order)
+        Product.objects.filter(pk=self.product.pk).update(quantity=1)
+
+        response = self.callback(order.provider_order_id, payment_id)
+
+        self.assertEqual(response.context['status'], 'Refund')
+        self.assert_order(order, REFUND, CANCELLED)
+        self.assertEqual(order.payment_id, payment_id)
+        self.assertEqual(self.stock(), 1)
+        self.assertFalse(ProductDailySales.objects.exists())
+
+        # the refund is final, a repeated callback does not sell the order
+        Product.objects.filter(pk=self.product.pk).update(quantity=10)
+        self.assertEqual(self.callback(order.provider_order_id, payment_id).context['status'], 'Refund')
+        self.assert_order(order, REFUND, CANCELLED)
+        self.complete_order_purchase.assert_not_called()
+
+    def test_unsigned_failure_report_is_checked_with_the_gateway(self):
+        order, payment_id = self.paid_order()
+
+        # anyone can post a failure report, razorpay says the order is paid
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('callback'), {
+                'error[metadata]': json.dumps({'order_id': order.provider_order_id, 'payment_id': payment_id}),
+            })
+
+        self.assertEqual(response.context['status'], 'Success')
+        self.assert_order(order, COMPLETED, IN_PROGRES)
+        self.assertEqual(self.stock(), 8)
+
+
+class HomeCatalogTests(TestCase):
+    """
+    The home snapshot keeps the fields the page shows, only their changes queue one rebuild
+    """
+
+    def setUp(self):
+        cache.delete(HOME_CATALOG_REFRESH_PENDING_KEY)
+        category = Category.objects.create(name='category', description='category')
+        subcategory = SubCategory.objects.create(name='subcategory', category=category, description='subcategory')
+        self.product = Product.objects.create(
+            category=category, subcategory=subcategory, name='product', description='product',
+            quantity=10, original_price=200, selling_price=150, status=True
+        )
+
+    def test_snapshot_has_no_stock(self):
+        home_catalog = build_home_catalog()
+        products = home_catalog['best_deals'] + home_catalog['new_arrivals'] + [
+            product
+            for category in home_catalog['categories_with_data']
+            for subcategory in category['all_subcategories']
+            for product in subcategory['limited_products']
+        ]
+        self.assertEqual(len(products), 3)
+        for product in products:
+            self.assertEqual(set(product), set(HOME_CATALOG_PRODUCT_FIELDS))
+
+    def test_only_shown_fields_queue_a_rebuild(self):
+        with mock.patch('shop.signals.schedule_home_catalog_refresh') as schedule:
+            self.product.quantity = 5
+            self.product.save()
+            self.product.description = 'new description'
+            self.product.save(update_fields=['description'])
+            schedule.assert_not_called()
+
+            self.product.selling_price = 120
+            self.product.save()
+            schedule.assert_called_once()
+
+    def test_changes_are_rebuilt_together(self):
+        with mock.patch('shop.celery.tasks.refresh_home_catalog_snapshot.apply_async') as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.product.name = 'renamed'
+                self.product.save()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.product.status = False
+                self.product.save()
+        apply_async.assert_called_once()
+
+
+class FacetIndexTests(TestCase):
+    """
+    The discount facet and sort read the discount stored on the product
+    """
+
+    def setUp(self):
+        self.category = Category.objects.create(name='category', description='category')
+        self.subcategory = SubCategory.objects.create(name='subcategory', category=self.category, description='subcategory')
+        self.products = [
+            Product.objects.create(
+                category=self.category, subcategory=self.subcategory, name=f'product {selling_price}',
+                description='product', quantity=10, original_price=200, selling_price=selling_price, status=True
+            )
+            for selling_price in (150, 100, 190)
+        ]
+
+    def test_discount_facet_uses_the_stored_discount(self):
+        index = FacetIndex.build(self.category.id, self.subcategory.id)
+        counts, total, product_ids = index.query({'discount': ['20']}, sort='discount')
+        self.assertEqual(product_ids, [self.products[1].id, self.products[0].id])
+        self.assertEqual(counts['discount']['50'], 1)
+
+        # whatever the prices say, the facet follows the stored column like the best deals listing
+        Product.objects.filter(pk=self.products[1].pk).update(discount_percent=0)
+        index = FacetIndex.build(self.category.id, self.subcategory.id)
+        self.assertEqual(index.query({'discount': ['20']})[2], [self.products[0].id])
+
+
+class SearchIndexTests(TestCase):
+    """
+    Autocomplete suggests completions found together with the earlier words, a search reports every match
+    """
+
+    def setUp(self):
+        self.index = SearchIndex()
+        self.index.build([
+            {'id': 1, 'name': 'red shirt', 'category': 'men', 'subcategory': 'shirts', 'description': ''},
+            {'id': 2, 'name': 'red shoes', 'category': 'men', 'subcategory': 'footwear', 'description': ''},
+            {'id': 3, 'name': 'blue shorts', 'category': 'men', 'subcategory': 'bottoms', 'description': ''},
+            {'id': 4, 'name': 'blue shorts', 'category': 'women', 'subcategory': 'bottoms', 'description': ''},
+            {'id': 5, 'name': 'red sheet', 'category': 'home', 'subcategory': 'bedding', 'description': ''},
+        ])
+
+    def test_autocomplete_keeps_to_the_earlier_words(self):
+        self.assertEqual(set(self.index.autocomplete('sh')), {'shirt', 'shirts', 'shoes', 'shorts', 'sheet'})
+        self.assertEqual(set(self.index.autocomplete('red sh')), {'red shirt', 'red shirts', 'red shoes', 'red sheet'})
+        self.assertEqual(self.index.autocomplete('blue men sh'), ['blue men shorts'])
+        self.assertEqual(self.index.autocomplete('green sh'), [])
+
+    def test_autocomplete_ranks_by_matching_products(self):
+        self.index.add({'id': 6, 'name': 'blue shirt', 'category': 'men', 'subcategory': 'shirts', 'description': ''})
+        self.assertEqual(self.index.autocomplete('blue sho'), ['blue shorts'])
+        self.assertIn(self.index.autocomplete('men s')[0], ('men shirt', 'men shirts'))
+
+    def test_total_counts_the_matches_beyond_the_limit(self):
+        product_ids, total = self.index.search_with_total('red', limit=2)
+        self.assertEqual(len(product_ids), 2)
+        self.assertEqual(total, 3)
+
+    def test_search_page_reports_the_total(self):
+        search_products = lambda query: self.index.search_with_total(query, limit=2)
+        with mock.patch('shop.views.search_products', search_products):
+            response = self.client.get(reverse('search'), {'q': 'red'})
+        self.assertEqual(response.context['result_count'], 3)
+
+
+@skipUnless(connection.vendor == 'mysql', 'Query plan checks are written for the MySQL EXPLAIN output')
+class QueryPlanTests(TransactionTestCase):
+    """
+    The queries of the shop views use their indexes - none of them falls back to a full table scan
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='buyer@example.com', username='buyer', password='secret')
+        other = User.objects.create_user(email='other@example.com', username='other', password='secret')
+
+        self.categories = [Category.objects.create(name=f'category {index}', description='category') for index in range(2)]
+        self.subcategories = [
+            SubCategory.objects.create(name=f'subcategory {index}', category=category, description='subcategory')
+            for index, category in enumerate(self.categories * 2)
+        ]
+
+        products = Product.objects.bulk_create([
+            Product(
+                category=self.subcategories[index % 4].category, subcategory=self.subcategories[index % 4],
+                name=f'product {index}', description='product', quantity=10, original_price=200,
+                selling_price=100 + index % 100, discount_percent=50 - index % 100 / 2,
+                status=index % 10 != 0, is_exclusive=index % 20 == 0
+            )
+            for index in range(PLAN_ROWS)
+        ])
+        self.product = products[0]
+
+        Cart.objects.bulk_create([
+            Cart(user=self.user if index < CART_LINES else other, product=products[index], quantity=1)
+            for index in range(PLAN_ROWS)
+        ])
+        Order.objects.bulk_create([
+            Order(
+                user=self.user if index % 2 else other, amount=100, street_name='street', city='city',
+                district='district', state='state', pincode='600001', ordered_date=timezone.now(),
+                payment_type=ONLINE_PAYMENT, payment_status=PENDING, order_status=IN_PROGRES,
+                provider_order_id=f'order_{index}', payment_id='', signature_id=''
+            )
+            for index in range(PLAN_ROWS)
+        ])
+
+        # index statistics of the fresh rows, the optimizer picks its plan from them
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE TABLE shop_product, shop_cart, shop_order')
+
+    def view_querysets(self):
+        category, subcategory = self.categories[0], self.subcategories[0]
+        return [
+            ('home.best_deals', best_deal_products()[:HOME_CATALOG_PRODUCTS_LIMIT]),
+            ('home.new_arrivals', new_arrival_products()[:HOME_CATALOG_PRODUCTS_LIMIT]),
+            ('categories.catalog_tree', catalog_tree_products(Category.objects.filter(pk=category.id))),
+            ('subcategory_products', facet_products(category.id, subcategory.id)),
+            ('product_details', product_with_category(self.product.id)),
+            # the prefetch reads the products of the listed subcategories
+            ('subcategories.exclusive', subcategory_listing_products(exclusive=True).filter(
+                subcategory_id__in=[subcategory.id]
+            )[:12]),
+            ('subcategories.best_deals', subcategory_listing_products(best_deals=True).filter(
+                subcategory_id__in=[subcategory.id]
+            )[:12]),
+            ('cart_list', cart_lines(self.user)),
+            ('order_list', user_orders(self.user).order_by(*ORDER_LIST_ORDERING)[:ORDERS_LIMIT_PER_PAGE + 1]),
+            ('callback', provider_orders('order_0')),
+        ]
+
+    def test_no_full_table_scans(self):
+        for name, queryset in self.view_querysets():
+            with self.subTest(name):
+                rows = explain(queryset)
+                scans = [
+                    row['table'] for row in rows
+                    if row.get('type') == 'ALL' and not (row.get('table') or '').startswith('<')
+                    and row['table'] not in SCAN_ALLOWED_TABLES
+                ]
+                self.assertEqual(scans, [], f"{name} - full scan, plan {rows}")
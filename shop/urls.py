@@ -18,12 +18,17 @@ urlpatterns = [
     path('subcategories', views.subcategories, name='subcategories'),
     path('subcategories/<str:subcategory>', views.subcategories, name='exclusive_with_argument'),
 
+    # search
+    path('search', views.search, name='search'),
+    path('search/autocomplete', views.search_autocomplete, name='search_autocomplete'),
+
     # product details
     path('product/<int:id>', views.product_details, name='product'),
 
 
     # add to cart - ajax request
     path('add_cart', views.add_to_cart, name='cart_add'),
+    path('add_cart_bulk', views.add_to_cart_bulk, name='cart_add_bulk'),
     path('carts', views.cart_list, name='carts'),
     path('cart_delete/<int:cart_id>', views.cart_delete, name='cart_delete'),
     path('checkout', views.checkout, name='checkout'),
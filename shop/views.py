@@ -7,10 +7,9 @@ from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt
 from django.http import JsonResponse, HttpResponse
 from django.utils import timezone
-from django.db.models import F, ExpressionWrapper, FloatField, Prefetch, Count, Subquery, OuterRef
-from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Prefetch
 from django.core.exceptions import ValidationError
-from django.template.loader import get_template
 import logging
 
 # forms
@@ -27,17 +26,28 @@ from .models import (
     Order,
     OrderItem
 )
-from shop.celery.tasks import send_order_details_mail
+from shop.services.catalog import get_home_catalog, load_catalog_tree, subcategory_listing_products
+from shop.services.product_cache import get_product_fragment, get_product_availability
+from shop.services.cart_store import CartStore, flush_cart
+from shop.services.cart import cart_lines, cart_summary, lines_order_amount
+from shop.services.stock import OutOfStockError, reserve_stock, commit_reservations
+from shop.services.orders import ORDER_LIST_ORDERING, user_orders
+from shop.services.payments import create_gateway_order, complete_payment, settle_payment_from_gateway
+from shop.services.rollups import record_order_sales
+from shop.services.mail import queue_order_mail
+from shop.services.search import search_products, autocomplete
+from shop.services.facets import SORT_ORDERS, get_facet_index, parse_facet_filters
 # core python
 import json
 import os
+from urllib.parse import urlencode
 from dotenv import load_dotenv
 
 # constant helper
 from utils.constants import *
+from utils.pagination import CursorPaginator, cursor_offset, offset_page
 from utils.helper import (
-    razorpay_login,
-    getRazorPayAmount,
+    upsert_options,
     verify_signature
 )
 
@@ -52,41 +62,9 @@ def home(request):
     @return render the html page:
     """
     try:
-        best_deals = Product.objects.active_products().annotate(price_difference=ExpressionWrapper(
-            ((F('original_price') - F('selling_price')) * F('original_price')) * 100,
-            output_field=FloatField()
-        )).order_by('price_difference').values()[:12]
-
-        new_arrivals = Product.objects.active_products().order_by('created_at').values()[:12]
-
-        categories_with_data = Category.objects.annotate(subcategory_count=Count('subcategories')).filter(
-            subcategory_count__gt=0
-        ).prefetch_related(
-            Prefetch('subcategories',
-                     queryset=SubCategory.objects.prefetch_related(
-                         Prefetch(
-                             'products',
-                             queryset=Product.objects.filter(category=F('subcategory__category')).filter(
-                                 subcategory=F('subcategory'))[:12],
-                             to_attr='limited_products'
-                         )
-                     ).annotate(
-                         product_count=Subquery(
-                             Product.objects.filter(
-                                 category=OuterRef('category'),
-                             ).filter(
-                                 subcategory=OuterRef('pk')
-                             ).annotate(product_count=Count('id')).values('product_count')[:1]
-                         )
-                     ).filter(
-                         product_count__gt=0
-                     ),
-                     to_attr='all_subcategories'
-                     )
-        )
+        home_catalog = get_home_catalog()
 
-        return render(request, 'shop/index.html', {'best_deals': best_deals, 'new_arrivals': new_arrivals,
-                                                   'categories_with_data': categories_with_data})
+        return render(request, 'shop/index.html', home_catalog)
     except Exception as e:
         logger.error(f"Error in home page - {e}")
         return render(request, 'shop/status_pages/something_went_wrong.html')
@@ -127,7 +105,9 @@ def login_page(request):
             pass_word = request.POST.get('password')
             user = authenticate(request, username=email, password=pass_word)
             if user is not None:
+                guest_cart = CartStore.for_guest(request.session)
                 login(request, user)
+                guest_cart.merge_into(CartStore.for_user(user.id))
                 return redirect('/')
             else:
                 messages.error(request, 'Invalid email or password')
@@ -173,36 +153,13 @@ def categories(request, category=None):
     @return render html page:
     """
     try:
-        categories = Category.objects.annotate(subcategory_count=Count('subcategories')).filter(
-            subcategory_count__gt=0
-        ).prefetch_related(
-            Prefetch('subcategories',
-                     queryset=SubCategory.objects.prefetch_related(
-                         Prefetch(
-                             'products',
-                             queryset=Product.objects.filter(category=F('subcategory__category')).filter(
-                                 subcategory=F('subcategory'))[:12],
-                             to_attr='limited_products'
-                         )
-                     ).annotate(
-                         product_count=Subquery(
-                             Product.objects.filter(
-                                 category=OuterRef('category'),
-                             ).filter(
-                                 subcategory=OuterRef('pk')
-                             ).annotate(product_count=Count('id')).values('product_count')[:1]
-                         )
-                     ).filter(
-                         product_count__gt=0
-                     ),
-                     to_attr='all_subcategories'
-                     )
-        )
-
+        categories = Category.objects.all()
         if category is not None:
             categories = categories.filter(name=category)
 
-        if not categories.exists():
+        categories = load_catalog_tree(categories)
+
+        if not categories:
             messages.info(request, 'No products found on this category. Please visit later...')
             return redirect(request.META.get('HTTP_REFERER'), '/')
 
@@ -215,22 +172,42 @@ def categories(request, category=None):
 # Category products
 def subcategory_products(request, category_id, subcategory_id=None):
     """
-    return subcategory with its products
+    return subcategory with its products - filtered by the price, discount, exclusive and trending facets
     @param request:
     @param category_id:
     @param subcategory_id:
     @return render html page:
     """
     try:
-        products = Product.objects.active_products().filter(category_id=category_id, subcategory_id=subcategory_id)
-        paginator = Paginator(products, PRODUCTS_LIMIT_PER_PAGE)
-        no_of_pages = paginator.num_pages
-        page_numbers = range(1, no_of_pages + 1)
-        page_number = request.GET.get('page_number', 1)
-        products = paginator.get_page(page_number)
-        return render(request, 'shop/products/subcategory_products.html',
-                      {'products': products, 'page_numbers': page_numbers})
-    except Category.DoesNotExist:
+        subcategory = SubCategory.objects.get(pk=subcategory_id, category_id=category_id)
+
+        filters = parse_facet_filters(request.GET)
+        sort = request.GET.get('sort') if request.GET.get('sort') in SORT_ORDERS else 'newest'
+        offset = cursor_offset(request.GET, PRODUCTS_LIMIT_PER_PAGE)
+
+        facet_counts, total, page_ids = get_facet_index(category_id, subcategory_id).query(
+            filters, sort=sort, offset=offset, limit=PRODUCTS_LIMIT_PER_PAGE
+        )
+        products_by_id = Product.objects.active_products().select_related('subcategory').in_bulk(page_ids)
+        products = offset_page(
+            [products_by_id[product_id] for product_id in page_ids if product_id in products_by_id],
+            offset, PRODUCTS_LIMIT_PER_PAGE, total
+        )
+
+        query = request.GET.copy()
+        query.pop('after', None)
+        query.pop('before', None)
+
+        return render(request, 'shop/products/subcategory_products.html', {
+            'subcategory': subcategory,
+            'products': products,
+            'total': total,
+            'facets': facet_counts,
+            'filters': filters,
+            'sort': sort,
+            'extra_query': query.urlencode(),
+        })
+    except (Category.DoesNotExist, SubCategory.DoesNotExist):
         messages.warning(request, 'No such category')
         return redirect('categories')
     except Exception as e:
@@ -238,6 +215,49 @@ def subcategory_products(request, category_id, subcategory_id=None):
         return render(request, 'shop/status_pages/something_went_wrong.html')
 
 
+# product search
+def search(request):
+    """
+    Products matching the search words, best match first
+    @param request:
+    @return render html page:
+    """
+    try:
+        query = request.GET.get('q', '').strip()
+        product_ids, result_count = search_products(query) if query else ([], 0)
+
+        offset = cursor_offset(request.GET, PRODUCTS_LIMIT_PER_PAGE)
+        page_ids = product_ids[offset:offset + PRODUCTS_LIMIT_PER_PAGE]
+        products_by_id = Product.objects.active_products().in_bulk(page_ids)
+        products = offset_page(
+            [products_by_id[product_id] for product_id in page_ids if product_id in products_by_id],
+            offset, PRODUCTS_LIMIT_PER_PAGE, len(product_ids)
+        )
+
+        return render(request, 'shop/products/search.html', {
+            'products': products,
+            'query': query,
+            'result_count': result_count,
+            'extra_query': urlencode({'q': query}),
+        })
+    except Exception as e:
+        logger.error(f"Something went wrong in search page  - {e}")
+        return render(request, 'shop/status_pages/something_went_wrong.html')
+
+
+def search_autocomplete(request):
+    """
+    Ajax request - completions of the partial search query
+    @param request:
+    @return:
+    """
+    try:
+        return JsonResponse({'suggestions': autocomplete(request.GET.get('q', ''))})
+    except Exception as e:
+        logger.error(f"Something went wrong in search autocomplete - {e}")
+        return JsonResponse({'suggestions': []})
+
+
 # product details
 def product_details(request, id):
     """
@@ -247,8 +267,8 @@ def product_details(request, id):
     @return:
     """
     try:
-        product = Product.objects.get(pk=id)
-        return render(request, 'shop/products/product.html', {'product': product, 'category': product.category})
+        product_fragment = get_product_fragment(id)
+        return render(request, 'shop/products/product.html', {'product_fragment': product_fragment})
     except Product.DoesNotExist:
         messages.warning(request, 'No such product')
         return redirect('categories')
@@ -257,48 +277,89 @@ def product_details(request, id):
         return render(request, 'shop/status_pages/something_went_wrong.html')
 
 
-@login_required()
 def add_to_cart(request):
     """
-    Ajax request - add item to cart list
+    Ajax request - add item to cart list, guests included
     @param request:
     @return:
     """
     try:
         if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-            if request.user.is_authenticated:
-                data = json.load(request)
-                product_id = data['product_id']
-                quantity = data['quantity']
-                product = Product.objects.get(pk=product_id)
-                if product and product.status and product.quantity >= quantity:
-                    cart = Cart.objects.filter(user=request.user, product=product_id).first()
-                    if cart:
-                        if cart.quantity != quantity:
-                            cart.quantity = quantity
-                            cart.save()
-
-                            return JsonResponse({'status': 'Cart updated!'})
-                        else:
-                            return JsonResponse({'status': 'Product already added to Cart'})
-                    else:
-                        Cart.objects.create(
-                            user=request.user,
-                            product=product,
-                            quantity=quantity
-                        )
-
-                        return JsonResponse({'status': 'Product added to cart'})
+            data = json.load(request)
+            product_id = int(data['product_id'])
+            quantity = int(data['quantity'])
+            if quantity < 1:
+                return JsonResponse({'status': 'Invalid quantity'})
+
+            product = get_product_availability(product_id)
+            if product and product['status'] and product['quantity'] >= quantity:
+                cart = CartStore.for_request(request)
+                cart_quantity = cart.get(product_id)
+                if cart_quantity is None:
+                    cart.set(product_id, quantity)
+                    return JsonResponse({'status': 'Product added to cart'})
+                elif cart_quantity != quantity:
+                    cart.set(product_id, quantity)
+                    return JsonResponse({'status': 'Cart updated!'})
                 else:
-                    return JsonResponse({'status': 'Product not available'})
+                    return JsonResponse({'status': 'Product already added to Cart'})
             else:
-                return JsonResponse({'status': 'Login to add cart items'}, status=200)
+                return JsonResponse({'status': 'Product not available'})
         else:
             return JsonResponse({'status': 'Invalid access'}, status=200)
-    except Product.DoesNotExist:
-        return JsonResponse({'status': 'Product not available'})
     except Exception as e:
-        logger.error(f"Something went wrong in product details page  - {e}")
+        logger.error(f"Something went wrong in add to cart - {e}")
+        return JsonResponse({'status': 'Something went wrong'})
+
+
+def add_to_cart_bulk(request):
+    """
+    Ajax request - add a list of items to the cart in one call
+    body - {"items": [{"product_id": 1, "quantity": 2}, ...]}
+    @param request:
+    @return per item status:
+    """
+    try:
+        if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+            data = json.load(request)
+            items = [(int(item['product_id']), int(item['quantity'])) for item in data['items']]
+            if len(items) > CART_BULK_ITEMS_LIMIT:
+                return JsonResponse({'status': f'Maximum {CART_BULK_ITEMS_LIMIT} items allowed'}, status=400)
+
+            products = Product.objects.only('id', 'status', 'quantity').in_bulk([product_id for product_id, _ in items])
+
+            results = []
+            accepted = {}
+            for product_id, quantity in items:
+                product = products.get(product_id)
+                if quantity < 1:
+                    results.append({'product_id': product_id, 'status': 'Invalid quantity'})
+                elif product and product.status and product.quantity >= quantity:
+                    accepted[product_id] = quantity
+                    results.append({'product_id': product_id, 'status': 'Product added to cart'})
+                else:
+                    results.append({'product_id': product_id, 'status': 'Product not available'})
+
+            if accepted:
+                if request.user.is_authenticated:
+                    # write the pending redis cart first, the hash is loaded again from the table afterwards
+                    flush_cart(request.user.id)
+                    # one upsert on the (user, product) unique key
+                    Cart.objects.bulk_create([
+                        Cart(user=request.user, product_id=product_id, quantity=quantity, is_purchased=False)
+                        for product_id, quantity in accepted.items()
+                    ], **upsert_options(['user', 'product'], ['quantity', 'is_purchased', 'updated_at']))
+                    CartStore.for_user(request.user.id).clear()
+                else:
+                    CartStore.for_guest(request.session).set_many(accepted)
+
+            return JsonResponse({'status': 'Cart updated!' if accepted else 'No items added', 'items': results})
+        else:
+            return JsonResponse({'status': 'Invalid access'}, status=200)
+    except (KeyError, TypeError, ValueError):
+        return JsonResponse({'status': 'Invalid items'}, status=400)
+    except Exception as e:
+        logger.error(f"Something went wrong in bulk add to cart - {e}")
         return JsonResponse({'status': 'Something went wrong'})
 
 
@@ -312,20 +373,17 @@ def cart_list(request):
     try:
         if request.user.is_authenticated:
             user = request.user
-            # cart_set is a reverse relationship
-            carts = Cart.objects.filter(user=user, is_purchased=False).select_related('product')
-            total_final_amount = sum(cart.total_final_cost for cart in carts)
-            total_net_amount = sum(cart.total_net_cost for cart in carts)
-            delivery_charges = 0
-            gst = 0
+            flush_cart(user.id)
+            summary = cart_summary(user)
 
             context = {
-                'carts': carts,
-                'total_net_amount': total_net_amount,
-                'delivery_charges': delivery_charges,
-                'gst': gst,
-                # will move to the cart property one gst and delivery logic completed
-                'total_final_amount': total_final_amount - delivery_charges - gst,
+                'carts': cart_lines(user),
+                'total_net_amount': summary['total_net_amount'],
+                'total_discount': summary['total_discount'],
+                'item_count': summary['item_count'],
+                'delivery_charges': summary['delivery_charges'],
+                'gst': summary['gst'],
+                'total_final_amount': summary['order_amount'],
             }
             return render(request, 'shop/cart/cart_list.html', context=context)
         else:
@@ -345,7 +403,9 @@ def cart_delete(request, cart_id):
     @return:
     """
     try:
-        Cart.objects.filter(pk=cart_id).delete()
+        cart = Cart.objects.get(pk=cart_id, user=request.user)
+        CartStore.for_user(request.user.id).remove(cart.product_id)
+        cart.delete()
         messages.warning(request, 'Cart removed')
     except Cart.DoesNotExist:
         messages.warning(request, 'Cart not found')
@@ -379,41 +439,38 @@ def create_order(request):
                 form_values['order_status'] = PENDING
                 form_values['amount'] = order_amount
 
-                # razor pay login
-                razor_pay_client = razorpay_login()
-                razor_pay_order = razor_pay_client.order.create({
-                    "amount": getRazorPayAmount(order_amount),
-                    "currency": INR,
-                    "payment_capture": "0"
-                })
-                form_values['provider_order_id'] = razor_pay_order['id']
-                order = Order.objects.create(**form_values)
-                order_item = OrderItem.objects.create(
-                    order=order,
-                    product_id=product_id,
-                    amount=order_amount,
-                    quantity=order_quantity
-                )
+                try:
+                    with transaction.atomic():
+                        order = Order.objects.create(**form_values)
+                        OrderItem.objects.create(
+                            order=order,
+                            product_id=product_id,
+                            amount=order_amount,
+                            quantity=order_quantity
+                        )
+                        reserve_stock(order, [(product_id, order_quantity)])
+                except OutOfStockError:
+                    messages.warning(request, 'Product not available in the requested quantity')
+                    return redirect('product', id=product_id)
+
+                # razorpay order once the stock is held - no gateway order for stock that is gone
+                provider_order_id = create_gateway_order(order)
 
                 context = {
                     'callback_url': HTTP + os.getenv('DEV_URL') + '/callback',
                     'razorpay_kay': os.getenv('RAZOR_KEY_ID'),
-                    'razorpay_order_id': razor_pay_order['id'],
+                    'razorpay_order_id': provider_order_id,
                     'currency': INR,
                     'amount': order_amount
                 }
                 if form_values['payment_type'] == ONLINE_PAYMENT.replace(' ', '_'):
                     return render(request, 'shop/order/payment.html', context)
                 else:
-                    mail_context = {
-                        'user_name': request.user.username,
-                        'order': order,
-                        'order_item': order_item
-                    }
+                    with transaction.atomic():
+                        commit_reservations(order)
+                        record_order_sales([order.id])
 
-                    body = get_template('shop/mail/order_placed.html').render(mail_context)
-
-                    send_order_details_mail.delay(request.user.email, body)
+                    queue_order_mail(order.id)
 
                     context = {
                         'order': order
@@ -452,30 +509,21 @@ def callback(request):
             payment_id = request.POST.get("razorpay_payment_id", "")
             provider_order_id = request.POST.get("razorpay_order_id", "")
             signature_id = request.POST.get("razorpay_signature", "")
-            order = Order.objects.get(provider_order_id=provider_order_id)
-            order.payment_id = payment_id
-            order.signature_id = signature_id
-            order.save()
             if not verify_signature(request.POST):
-                order.status = COMPLETED
-                order.save()
-                Cart.objects.filter(user=order.user).update(created_at__gt=timezone.now(), is_purchased=True)
-                return render(request, "shop/order/callback.html", context={"status": order.status})
-            else:
-                order.status = ERROR
-                order.save()
-                return render(request, "shop/order/callback.html", context={"status": order.status})
+                # forged or corrupted - no order changes
+                logger.warning(f"Razorpay callback with an invalid signature for order {provider_order_id}")
+                return render(request, "shop/order/callback.html", context={"status": 'failed'}, status=400)
+            status = complete_payment(provider_order_id, payment_id, signature_id)
         else:
-            payment_id = json.loads(request.POST.get("error[metadata]")).get("payment_id")
-            provider_order_id = json.loads(request.POST.get("error[metadata]")).get(
-                "order_id"
-            )
+            # the failure report is not signed, the order is settled from the gateway only
+            metadata = json.loads(request.POST.get("error[metadata]") or '{}')
+            status = settle_payment_from_gateway(metadata.get("order_id"))
+
+        if status is None:
+            logger.warning("Razorpay callback for an unknown order")
 
-            order = Order.objects.get(provider_order_id=provider_order_id)
-            order.payment_id = payment_id
-            order.status = ERROR
-            order.save()
-            return render(request, "shop/order/callback.html", context={"status": 'failed'})
+        return render(request, "shop/order/callback.html",
+                      context={"status": {COMPLETED: 'Success', REFUND: 'Refund'}.get(status, 'failed')})
     except Exception as e:
         logger.error(f"Something went wrong in razorpay callback - {e}")
         return render(request, 'shop/status_pages/something_went_wrong.html')
@@ -536,16 +584,10 @@ def order_list(request):
     @return:
     """
     try:
-        orders = Order.objects.filter(user=request.user).prefetch_related('orderitem_set__product').order_by(
-            '-ordered_date')
+        paginator = CursorPaginator(user_orders(request.user), ORDER_LIST_ORDERING, ORDERS_LIMIT_PER_PAGE)
+        orders = paginator.get_page(after=request.GET.get('after'), before=request.GET.get('before'))
 
-        paginator = Paginator(orders, ORDERS_LIMIT_PER_PAGE)
-        no_of_pages = paginator.num_pages
-        page_numbers = range(1, no_of_pages + 1)
-        page_number = request.GET.get('page_number', 1)
-        orders = paginator.get_page(page_number)
-
-        return render(request, 'shop/order/order_list.html', {'orders': orders, 'page_numbers': page_numbers})
+        return render(request, 'shop/order/order_list.html', {'orders': orders})
     except Exception as e:
         logger.error(f"Something went wrong in order list page - {e}")
         return render(request, 'shop/status_pages/something_went_wrong.html')
@@ -565,11 +607,9 @@ def checkout(request):
                 form_values = form.cleaned_data
 
                 user = request.user
-                carts = Cart.objects.filter(user=user).select_related('product')
-                total_final_amount = sum(cart.total_final_cost for cart in carts)
-                delivery_charges = 0
-                gst = 0
-                order_amount = total_final_amount + delivery_charges + gst
+                flush_cart(user.id)
+                carts = list(cart_lines(user))
+                order_amount = lines_order_amount(carts)
 
                 # order creation
                 form_values['user_id'] = request.user.id
@@ -578,48 +618,45 @@ def checkout(request):
                 form_values['order_status'] = PENDING
                 form_values['amount'] = order_amount
 
-                # razor pay login
-                razor_pay_client = razorpay_login()
-                razor_pay_order = razor_pay_client.order.create({
-                    "amount": getRazorPayAmount(order_amount),
-                    "currency": INR,
-                    "payment_capture": "0"
-                })
-                form_values['provider_order_id'] = razor_pay_order['id']
-
-                order = Order.objects.create(**form_values)
-                order_items = []
-                for cart in carts:
-                    order_items.append(OrderItem(
-                        order=order,
-                        product=cart.product,
-                        amount=cart.total_final_cost,
-                        quantity=cart.quantity
-                    ))
-
-                OrderItem.objects.bulk_create(order_items)
+                try:
+                    with transaction.atomic():
+                        order = Order.objects.create(**form_values)
+                        order_items = []
+                        for cart in carts:
+                            order_items.append(OrderItem(
+                                order=order,
+                                product=cart.product,
+                                amount=cart.total_cost,
+                                quantity=cart.quantity
+                            ))
+
+                        OrderItem.objects.bulk_create(order_items)
+                        reserve_stock(order, [(cart.product_id, cart.quantity) for cart in carts])
+                except OutOfStockError:
+                    messages.warning(request, 'Some cart items are not available in the requested quantity')
+                    return redirect('carts')
+
+                # razorpay order once the stock is held - no gateway order for stock that is gone
+                provider_order_id = create_gateway_order(order)
 
                 context = {
                     'callback_url': HTTP + os.getenv('DEV_URL') + '/callback',
                     'razorpay_kay': os.getenv('RAZOR_KEY_ID'),
-                    'razorpay_order_id': razor_pay_order['id'],
+                    'razorpay_order_id': provider_order_id,
                     'currency': INR,
                     'amount': order_amount
                 }
                 if form_values['payment_type'] == ONLINE_PAYMENT.replace(' ', '_'):
                     return render(request, 'shop/order/payment.html', context)
                 else:
-                    mail_context = {
-                        'user_name': request.user.username,
-                        'order': order,
-                        'order_items': order_items
-                    }
+                    with transaction.atomic():
+                        commit_reservations(order)
+                        record_order_sales([order.id])
 
-                    body = get_template('shop/mail/order_placed.html').render(mail_context)
+                    queue_order_mail(order.id)
 
-                    send_order_details_mail.delay(request.user.email, body)
-
-                    Cart.objects.filter(user=request.user).update(created_at__gt=timezone.now(), is_purchased=True)
+                    Cart.objects.filter(user=request.user, is_purchased=False).update(is_purchased=True)
+                    CartStore.for_user(request.user.id).clear()
 
                     context = {
                         'order': order
@@ -628,21 +665,18 @@ def checkout(request):
         else:
             form = OrderForm()
             user = request.user
-
-            # cart_set is a reverse relationship
-            carts = Cart.objects.filter(user=user)
-            total_final_amount = sum(cart.total_final_cost for cart in carts)
-            total_net_amount = sum(cart.total_net_cost for cart in carts)
-            delivery_charges = 0
-            gst = 0
+            flush_cart(user.id)
+            summary = cart_summary(user)
 
             context = {
                 'form': form,
                 'districts': TAMIL_NADU_DISTRICTS,
-                'total_final_amount': total_final_amount,
-                'total_net_amount': total_net_amount,
-                'delivery_charges': delivery_charges,
-                'gst': gst
+                'total_final_amount': summary['order_amount'],
+                'total_net_amount': summary['total_net_amount'],
+                'total_discount': summary['total_discount'],
+                'item_count': summary['item_count'],
+                'delivery_charges': summary['delivery_charges'],
+                'gst': summary['gst']
             }
             return render(request, 'shop/cart/checkout.html', context)
     except Exception as e:
@@ -661,18 +695,7 @@ def subcategories(request, subcategory=None):
         is_exclusive = request.GET.get('exclusive')
         is_best_deals = request.GET.get('best_deals')
 
-        products_query = Product.objects.filter(
-            subcategory=F('subcategory')
-        )
-
-        if is_exclusive:
-            products_query = products_query.filter(is_exclusive=1).order_by('created_at')
-
-        if is_best_deals:
-            products_query = products_query.annotate(price_difference=ExpressionWrapper(
-                ((F('original_price') - F('selling_price')) * F('original_price')) * 100,
-                output_field=FloatField()
-            )).order_by('price_difference')
+        products_query = subcategory_listing_products(exclusive=is_exclusive, best_deals=is_best_deals)
 
         subcategories = SubCategory.objects.prefetch_related(
             Prefetch(
@@ -680,10 +703,8 @@ def subcategories(request, subcategory=None):
                 queryset=products_query[:12],
                 to_attr='limited_products'
             )
-        ).annotate(
-            product_count=Count('products')
         ).filter(
-            product_count__gt=0
+            active_product_count__gt=0
         )
 
         if subcategory is not None:
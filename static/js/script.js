@@ -13,4 +13,24 @@ var timer = setInterval(function() {
         clearInterval(timer);
         closeAlert();
     }
-}, 1)
\ No newline at end of file
+}, 1)
+
+// search suggestions from the product search index
+var searchInput = $('#search-input')
+var searchTimer = null
+
+searchInput.on('input', function() {
+    clearTimeout(searchTimer)
+    searchTimer = setTimeout(function() {
+        var query = searchInput.val()
+        if (!query.trim()) {
+            return
+        }
+        $.getJSON(searchInput.data('autocomplete-url'), {q: query}, function(data) {
+            var suggestions = $('#search-suggestions').empty()
+            $.each(data.suggestions, function(index, suggestion) {
+                suggestions.append($('<option>').attr('value', suggestion))
+            })
+        })
+    }, 150)
+})
@@ -18,12 +18,21 @@ COMPLETED = 'completed'
 PENDING = 'pending'
 ERROR = 'error'
 IN_PROGRES = 'in_progres'
+REFUND = 'refund'  # paid after the stock was gone, the payment is refunded
 
 # order status
 SHIPPED = 'shipped'
 DELIVERED = 'delivered'
 CANCELLED = 'cancelled'
 
+# stock reservation status
+RESERVED = 'reserved'
+COMMITTED = 'committed'
+RELEASED = 'released'
+
+# unpaid online orders give their stock back after this
+STOCK_RESERVATION_TTL_MINUTES = 15
+
 # states - districts data should be moved to database
 # states
 TAMIL_NADU = 'Tamilnadu'
@@ -114,3 +123,112 @@ HTTPS = 'https://'
 # Pagination limits
 ORDERS_LIMIT_PER_PAGE = 5
 PRODUCTS_LIMIT_PER_PAGE = 16
+
+# Home page catalog snapshot
+HOME_CATALOG_CACHE_KEY = 'shop:home_catalog'
+HOME_CATALOG_CACHE_TIMEOUT = None  # rebuilt from the model signals, never expires
+HOME_CATALOG_PRODUCTS_LIMIT = 12
+# product fields the home page shows - stock is not kept in the snapshot, it changes with every order
+HOME_CATALOG_PRODUCT_FIELDS = ('id', 'name', 'product_image', 'image_variants', 'original_price', 'selling_price')
+# a product save changing none of these leaves the snapshot as it is
+HOME_CATALOG_SOURCE_FIELDS = (
+    'name', 'product_image', 'image_variants', 'original_price', 'selling_price',
+    'status', 'category_id', 'subcategory_id'
+)
+HOME_CATALOG_REFRESH_PENDING_KEY = 'shop:home_catalog:refresh_pending'
+HOME_CATALOG_REFRESH_DELAY_SECONDS = 10
+HOME_CATALOG_REFRESH_PENDING_TIMEOUT = 60 * 5  # a lost refresh task does not hold back the next one longer
+
+# Product detail page fragment cache
+PRODUCT_PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+PRODUCT_PAGE_CACHE_HITS_KEY = 'shop:product_page:hits'
+PRODUCT_PAGE_CACHE_MISSES_KEY = 'shop:product_page:misses'
+
+# Redis cart store
+CART_KEY_PREFIX = 'shop:cart'
+CART_DIRTY_USERS_KEY = 'shop:cart:dirty'
+CART_PERSIST_DELAY_SECONDS = 5
+GUEST_CART_TTL_SECONDS = 60 * 60 * 24 * 7
+
+# bulk add to cart
+CART_BULK_ITEMS_LIMIT = 100
+
+# Payment reconciliation
+RECONCILIATION_GRACE_MINUTES = 10  # leave recent orders to the callback
+PAYMENT_ABANDON_HOURS = 24  # orders without any payment attempt are failed after this
+RECONCILIATION_BATCH_SIZE = 200
+RECONCILIATION_WORKERS = 8
+RECONCILIATION_STATS_CACHE_KEY = 'shop:reconciliation:stats'
+
+# Order mail queue
+ORDER_MAIL_QUEUE_KEY = 'shop:mail:orders'
+ORDER_MAIL_BATCH_SIZE = 100
+ORDER_MAIL_RATE_PER_SECOND = 10
+ORDER_MAIL_PROCESSING_KEY = 'shop:mail:orders:processing'  # taken from the queue, not sent yet
+ORDER_MAIL_ATTEMPTS_KEY = 'shop:mail:orders:attempts'
+ORDER_MAIL_MAX_ATTEMPTS = 5
+ORDER_MAIL_LOCK_KEY = 'shop:mail:orders:lock'
+ORDER_MAIL_LOCK_TIMEOUT = 60  # seconds, extended after every mail
+
+# Abandoned cart mails
+ABANDONED_CART_AFTER_HOURS = 24
+ABANDONED_CART_MAX_AGE_DAYS = 5  # older carts are not mailed on the first run
+ABANDONED_CART_HIGH_WATER_MARK_KEY = 'shop:abandoned_cart:high_water_mark'
+ABANDONED_CART_USERS_PER_TASK = 200
+ABANDONED_CART_STREAM_CHUNK_SIZE = 2000
+ABANDONED_CART_MAIL_MAX_RETRIES = 5  # the users a send failed for are retried, the window is already past them
+ABANDONED_CART_MAIL_RETRY_SECONDS = 300
+
+# Image derivatives
+IMAGE_DERIVATIVE_WIDTHS = (320, 640, 960)
+IMAGE_DERIVATIVE_QUALITY = 80
+IMAGE_DERIVATIVE_DIR = 'uploads/derivatives'
+IMAGE_DERIVATIVE_SIZES = '(max-width: 576px) 100vw, (max-width: 992px) 50vw, 25vw'
+
+# Content addressed media
+CONTENT_ADDRESSED_DIR = 'uploads'  # image uploads and their variants, other files keep their names
+MEDIA_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Product search
+SEARCH_RESULTS_LIMIT = 1000
+SEARCH_AUTOCOMPLETE_LIMIT = 8
+SEARCH_PREFIX_EXPANSION_LIMIT = 50
+SEARCH_INDEX_VERSION_KEY = 'shop:search:version'
+SEARCH_INDEX_CHANGES_KEY = 'shop:search:changes'  # sorted set - product id scored by its change version
+SEARCH_INDEX_SNAPSHOT_VERSION_KEY = 'shop:search:snapshot_version'
+SEARCH_INDEX_PRUNED_VERSION_KEY = 'shop:search:pruned_version'
+SEARCH_LATENCY_TARGET_MS = 50  # p95 of a search on a 1M product catalog
+AUTOCOMPLETE_LATENCY_TARGET_MS = 5
+
+# Subcategory listing facets
+FACETS_CACHE_TIMEOUT = 60 * 60 * 24  # dropped from the product signals, the timeout is a safety net
+
+# Catalog import / export
+CATALOG_IMPORT_CHUNK_SIZE = 2000
+CATALOG_EXPORT_CHUNK_SIZE = 2000
+CATALOG_IMPORT_MAX_ERRORS = 100  # row errors kept in the import report
+CATALOG_IMPORT_DIR = 'imports'
+CATALOG_IMPORT_REPORT_CACHE_KEY = 'shop:catalog_import:report'
+
+# Order export / sales reports
+ORDER_EXPORT_CHUNK_SIZE = 2000
+REPORT_CHUNK_SIZE = 20000
+REPORT_DAY_CACHE_TIMEOUT = 60 * 60 * 24 * 30  # dropped when the rollups of the day change
+REPORT_TODAY_CACHE_TIMEOUT = 60
+REPORT_TOP_PRODUCTS = 50
+
+# Daily sales rollups
+SALES_ROLLUP_BATCH_DAYS = 31
+SALES_ROLLUP_INSERT_BATCH_SIZE = 1000
+
+# Trending and best seller rankings
+RANKINGS_CACHE_KEY = 'shop:rankings'
+RANKING_CHUNK_SIZE = 50000
+RANKING_CANDIDATES_FACTOR = 3  # ranked ids checked per published product, hidden products are skipped
+TRENDING_HALF_LIFE_HOURS = 48
+TRENDING_WINDOW_DAYS = 14
+TRENDING_CART_WEIGHT = 0.3  # a carted unit against a sold one
+TRENDING_PRODUCTS_LIMIT = 12
+BEST_SELLER_HALF_LIFE_DAYS = 30
+BEST_SELLER_WINDOW_DAYS = 120  # read from the daily product sales rollups
+BEST_SELLER_PRODUCTS_LIMIT = 12
@@ -0,0 +1,57 @@
+import csv
+import tempfile
+from django.http import FileResponse, StreamingHttpResponse
+from openpyxl import Workbook
+
+
+class Echo:
+    # csv writer target returning the written line, for StreamingHttpResponse
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def write_xlsx(rows, file):
+    """
+    Write the rows with a write only workbook - rows go to disk as they come
+    @param rows:
+    @param file: path or binary file object
+    @return:
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    for row in rows:
+        sheet.append(row)
+    workbook.save(file)
+
+
+def xlsx_temporary_file(rows):
+    """
+    @param rows:
+    @return open temporary file with the workbook, deleted on close:
+    """
+    file = tempfile.TemporaryFile(suffix='.xlsx')
+    write_xlsx(rows, file)
+    file.seek(0)
+    return file
+
+
+def streaming_export_response(rows, file_format, file_name):
+    """
+    Download response of the rows, built while it is sent - csv streamed, xlsx through a temporary file
+    @param rows: iterable of tuples, the header first
+    @param file_format: csv or xlsx
+    @param file_name: without the extension
+    @return response:
+    """
+    if file_format == 'xlsx':
+        return FileResponse(xlsx_temporary_file(rows), as_attachment=True, filename=f'{file_name}.xlsx')
+
+    response = StreamingHttpResponse(csv_lines(rows), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{file_name}.csv"'
+    return response
@@ -1,14 +1,78 @@
 import razorpay
+import redis
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 from dotenv import load_dotenv
 import datetime
+import hashlib
+import hmac
+import threading
+from django.conf import settings
+from django.db import connection
 
 load_dotenv()
 
+_redis_client = None
+_razorpay_client = None
+_razorpay_client_pid = None
+_razorpay_client_lock = threading.Lock()
 
-# login to razor pay
+
+# requests session with a default timeout for every call
+class TimeoutSession(requests.Session):
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(*args, **kwargs)
+
+
+def _razorpay_session():
+    session = TimeoutSession(timeout=(
+        float(os.getenv('RAZORPAY_CONNECT_TIMEOUT') or 3),
+        float(os.getenv('RAZORPAY_READ_TIMEOUT') or 10)
+    ))
+    # connection failures are retried for every call, gateway errors only for GET - creating an order is not idempotent
+    retry = Retry(
+        total=3,
+        connect=3,
+        read=0,
+        status=2,
+        backoff_factor=0.2,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=['GET'],
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=int(os.getenv('RAZORPAY_POOL_SIZE') or 10), max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# login to razor pay - one client with keep-alive connections per process
 def razorpay_login():
-    return razorpay.Client(auth=(os.getenv('RAZOR_KEY_ID'), os.getenv('RAZOR_KEY_SECRET')))
+    global _razorpay_client, _razorpay_client_pid
+    pid = os.getpid()
+    if _razorpay_client is None or _razorpay_client_pid != pid:
+        with _razorpay_client_lock:
+            if _razorpay_client is None or _razorpay_client_pid != pid:
+                options = {}
+                # local stub gateway for development and tests
+                if os.getenv('RAZORPAY_BASE_URL'):
+                    options['base_url'] = os.getenv('RAZORPAY_BASE_URL')
+
+                _razorpay_client = razorpay.Client(
+                    session=_razorpay_session(),
+                    auth=(os.getenv('RAZOR_KEY_ID'), os.getenv('RAZOR_KEY_SECRET')),
+                    **options
+                )
+                _razorpay_client_pid = pid
+
+    return _razorpay_client
 
 
 # razor pay will get amount in paise
@@ -16,7 +80,70 @@ def getRazorPayAmount(amount):
     return float(amount) * 100
 
 
-# check the transaction status
+# check the transaction status - HMAC SHA256 of "order_id|payment_id" with the key secret, no client needed
 def verify_signature(response_data):
-    client = razorpay_login()
-    return client.utility.verify_payment_signature(response_data)
+    message = '{}|{}'.format(response_data.get('razorpay_order_id', ''), response_data.get('razorpay_payment_id', ''))
+    signature = hmac.new(
+        key=str(os.getenv('RAZOR_KEY_SECRET')).encode(),
+        msg=message.encode(),
+        digestmod=hashlib.sha256
+    ).hexdigest()
+    return hmac.compare_digest(signature, str(response_data.get('razorpay_signature', '')))
+
+
+# bulk_create(update_conflicts=True) options - MySQL upserts on any unique key and rejects unique_fields
+def upsert_options(unique_fields, update_fields):
+    options = {'update_conflicts': True, 'update_fields': update_fields}
+    if connection.features.supports_update_conflicts_with_target:
+        options['unique_fields'] = unique_fields
+    return options
+
+
+# insert the rows, adding the increment fields to the existing row on a unique key conflict - rollups and counters
+def upsert_increment(model, rows, unique_fields, increment_fields):
+    if not rows:
+        return
+
+    quote = connection.ops.quote_name
+    fields = list(unique_fields) + list(increment_fields)
+    columns = [model._meta.get_field(field).column for field in fields]
+    table = quote(model._meta.db_table)
+    increments = [model._meta.get_field(field).column for field in increment_fields]
+
+    if connection.vendor == 'mysql':
+        conflict = 'ON DUPLICATE KEY UPDATE ' + ', '.join(
+            f'{quote(column)} = {quote(column)} + VALUES({quote(column)})' for column in increments
+        )
+    else:
+        conflict = 'ON CONFLICT ({}) DO UPDATE SET {}'.format(
+            ', '.join(quote(column) for column in columns[:len(unique_fields)]),
+            ', '.join(f'{quote(column)} = {table}.{quote(column)} + EXCLUDED.{quote(column)}' for column in increments)
+        )
+
+    placeholders = '({})'.format(', '.join(['%s'] * len(columns)))
+    # sorted rows lock the keys in the same order in every transaction
+    rows = sorted(rows)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO {} ({}) VALUES {} {}'.format(
+                table, ', '.join(quote(column) for column in columns), ', '.join([placeholders] * len(rows)), conflict
+            ),
+            [value for row in rows for value in row]
+        )
+
+
+# EXPLAIN rows of the queryset as dicts - the plan checks and the benchmarks read them
+def explain(queryset):
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN ' + sql, params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+# one redis connection pool per process
+def get_redis():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _redis_client
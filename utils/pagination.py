@@ -0,0 +1,129 @@
+import base64
+import json
+from collections.abc import Sequence
+
+from django.db.models import Q
+
+
+# keyset pagination - pages are fetched with WHERE (created_at, id) < (last_created_at, last_id)
+# instead of OFFSET, so every page costs the same and no COUNT(*) is needed
+class CursorPage(Sequence):
+    is_cursor_page = True
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class CursorPaginator:
+    def __init__(self, queryset, ordering, per_page):
+        """
+        @param queryset:
+        @param ordering: unique ordering, all ascending or all descending - ('-created_at', '-id')
+        @param per_page:
+        """
+        self.queryset = queryset
+        self.ordering = ordering
+        self.per_page = per_page
+        self.fields = [field.lstrip('-') for field in ordering]
+        self.descending = ordering[0].startswith('-')
+
+    def encode_cursor(self, obj):
+        values = [getattr(obj, field) for field in self.fields]
+        raw = json.dumps([value.isoformat() if hasattr(value, 'isoformat') else value for value in values])
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return [
+                self.queryset.model._meta.get_field(field).to_python(value)
+                for field, value in zip(self.fields, values)
+            ]
+        except Exception:
+            return None
+
+    def _seek(self, values, forward):
+        # (a, b) > (x, y) is a > x OR (a = x AND b > y)
+        lookup = 'lt' if self.descending == forward else 'gt'
+        condition = Q()
+        for position, field in enumerate(self.fields):
+            equals = dict(zip(self.fields[:position], values[:position]))
+            equals[f'{field}__{lookup}'] = values[position]
+            condition |= Q(**equals)
+        return condition
+
+    def get_page(self, after=None, before=None):
+        """
+        Page after or before the given cursor, first page when no cursor is given
+        @param after:
+        @param before:
+        @return CursorPage:
+        """
+        after_values = self.decode_cursor(after) if after else None
+        before_values = self.decode_cursor(before) if before else None
+
+        if before_values:
+            reversed_ordering = [field[1:] if field.startswith('-') else '-' + field for field in self.ordering]
+            rows = list(self.queryset.filter(self._seek(before_values, forward=False))
+                        .order_by(*reversed_ordering)[:self.per_page + 1])
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            has_next = True
+        else:
+            queryset = self.queryset.order_by(*self.ordering)
+            if after_values:
+                queryset = queryset.filter(self._seek(after_values, forward=True))
+            rows = list(queryset[:self.per_page + 1])
+            has_next = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            has_previous = after_values is not None
+
+        return CursorPage(
+            rows,
+            next_cursor=self.encode_cursor(rows[-1]) if rows and has_next else None,
+            previous_cursor=self.encode_cursor(rows[0]) if rows and has_previous else None,
+        )
+
+
+# offset pagination in the cursor page shape - for result ids ranked in memory (search, facets)
+def cursor_offset(params, per_page):
+    """
+    Offset of the page from the ?after= / ?before= offset cursors
+    @param params: QueryDict
+    @param per_page:
+    @return int:
+    """
+    if params.get('after', '').isdigit():
+        return int(params['after'])
+    if params.get('before', '').isdigit():
+        return max(0, int(params['before']) - per_page)
+    return 0
+
+
+def offset_page(object_list, offset, per_page, total):
+    """
+    @param object_list: objects of the page
+    @param offset: position of the first object
+    @param per_page:
+    @param total: size of the full result
+    @return CursorPage:
+    """
+    return CursorPage(
+        object_list,
+        next_cursor=str(offset + per_page) if offset + per_page < total else None,
+        previous_cursor=str(offset) if offset else None,
+    )
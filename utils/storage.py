@@ -0,0 +1,100 @@
+import hashlib
+import os
+import re
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.views.static import serve
+
+# constant helper
+from utils.constants import *
+
+# <dir>/ab/ab12...ef.jpg - sha256 of the file content
+CONTENT_ADDRESSED_NAME = re.compile(r'(^|/)([0-9a-f]{2})/\2[0-9a-f]{62}\.\w+$')
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+def content_addressed_name(name, content):
+    """
+    uploads/photo.JPG -> uploads/3f/3f9a...c1.jpg
+    @param name: requested name, its directory and extension are kept
+    @param content: File
+    @return str:
+    """
+    digest = content_hash(content)
+    extension = os.path.splitext(name)[1].lower()
+    return os.path.join(os.path.dirname(name), digest[:2], f'{digest}{extension}').replace('\\', '/')
+
+
+def in_content_addressed_dir(name):
+    return (name or '').replace('\\', '/').startswith(f'{CONTENT_ADDRESSED_DIR}/')
+
+
+def is_content_addressed(name):
+    return in_content_addressed_dir(name) and bool(CONTENT_ADDRESSED_NAME.search(name))
+
+
+class ContentAddressedStorageMixin:
+    """
+    Image uploads are named by the sha256 of their content - the same file uploaded twice is stored once
+    and a name never points to other content, so it can be cached forever.
+    Files outside CONTENT_ADDRESSED_DIR, like the catalog imports, are stored under their own name
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not in_content_addressed_dir(name):
+            return super().save(name, content, max_length=max_length)
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        name = content_addressed_name(name, content)
+        if self.exists(name):
+            return name
+
+        return super().save(name, content, max_length=max_length)
+
+
+class ContentAddressedFileSystemStorage(ContentAddressedStorageMixin, FileSystemStorage):
+    pass
+
+
+try:
+    from storages.backends.s3boto3 import S3Boto3Storage
+except ImportError:  # django-storages is needed on S3 only
+    S3Boto3Storage = None
+
+if S3Boto3Storage is not None:
+    class ContentAddressedS3Storage(ContentAddressedStorageMixin, S3Boto3Storage):
+        # the other files get a free name like on the file system
+        file_overwrite = False
+
+        def get_available_name(self, name, max_length=None):
+            # the same content addressed name always has the same content, overwriting it is harmless
+            if is_content_addressed(name):
+                return name
+            return super().get_available_name(name, max_length=max_length)
+
+        def get_object_parameters(self, name):
+            params = super().get_object_parameters(name)
+            if is_content_addressed(name):
+                params.setdefault('CacheControl', MEDIA_CACHE_CONTROL)
+            return params
+
+
+def serve_media(request, path, document_root=None, show_indexes=False):
+    """
+    django.views.static.serve with far-future cache headers for content addressed files
+    """
+    response = serve(request, path, document_root=document_root, show_indexes=show_indexes)
+    if is_content_addressed(path):
+        response['Cache-Control'] = MEDIA_CACHE_CONTROL
+    return response